@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CmdbConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cmdb'
+
+    def ready(self):
+        from cmdb import signals  # noqa
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   gen_cmdb_data.py
+@time    :   2026/10/17 22:10
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+import json
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ucenter.models import UserProfile, Organization, Role, Menu, Permission
+from cmdb.models import Region, Idc, Product, Project, Environment, KubernetesCluster, MicroApp, AppInfo, \
+    KubernetesDeploy, get_default_extra_members
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = '生成CMDB测试数据， 用于性能测试'
+
+    # 数据量参数: (参数名, 默认值, 说明)
+    sizes = (
+        ('regions', 3, '地域数量'),
+        ('idcs', 2, '每个地域的IDC数量'),
+        ('products', 5, '产品数量'),
+        ('projects', 10, '每个产品的项目数量'),
+        ('apps', 10, '每个项目的应用数量'),
+        ('environments', 4, '环境数量， 每个应用在各环境生成一个应用模块'),
+        ('clusters', 4, 'K8s集群数量'),
+        ('deploys', 2, '每个应用模块部署的K8s集群数量'),
+        ('users', 200, '用户数量'),
+        ('orgs', 20, '部门数量'),
+        ('roles', 10, '角色数量'),
+        ('menus', 30, '菜单数量'),
+        ('members', 3, '应用每个成员组的用户数量'),
+    )
+
+    def add_arguments(self, parser):
+        for name, default, help_text in self.sizes:
+            parser.add_argument(f'--{name}', type=int,
+                                default=default, help=f'{help_text}， 默认{default}')
+        parser.add_argument('--prefix', default='syn',
+                            help='名称前缀， 重复生成时需使用不同前缀')
+        parser.add_argument('--password', default='ydevops',
+                            help='用户密码')
+        parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        with transaction.atomic():
+            counts = self.generate(**options)
+        if options['verbosity']:
+            for model, count in counts.items():
+                self.stdout.write(f'{model}: {count}')
+            self.stdout.write(self.style.SUCCESS('测试数据生成完成.'))
+
+    @staticmethod
+    def bulk_create(model, objs):
+        """
+        批量写入， 数据库不支持返回主键时(MySQL)按唯一字段重新查询
+        """
+        objs = model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+        if not objs or objs[0].pk is not None:
+            return objs
+        key = next(i.name for i in model._meta.fields if i.unique and not i.primary_key)
+        saved = model.objects.in_bulk([getattr(i, key) for i in objs], field_name=key)
+        return [saved[getattr(i, key)] for i in objs]
+
+    def sample(self, population, count):
+        return self.random.sample(population, min(count, len(population)))
+
+    def generate(self, prefix, password, **options):
+        counts = {}
+        users, orgs, roles, menus = self.generate_ucenter(prefix, password, **options)
+        counts.update({'UserProfile': len(users), 'Organization': len(orgs),
+                       'Role': len(roles), 'Menu': len(menus)})
+        user_ids = [i.id for i in users]
+
+        regions = self.bulk_create(Region, [Region(name=f'{prefix}-region{i}', alias=f'地域{i}')
+                                            for i in range(options['regions'])])
+        idcs = self.bulk_create(Idc, [
+            Idc(name=f'{prefix}-idc{region.id}-{i}', alias=f'{prefix}-机房{region.id}-{i}', region=region,
+                supplier='aliyun', contact=self.sample(user_ids, 2))
+            for region in regions for i in range(options['idcs'])])
+        environments = self.bulk_create(Environment, [
+            Environment(name=f'{prefix}_env{i}', alias=f'环境{i}', allow_ci_branch=['*'], allow_cd_branch=['*'])
+            for i in range(options['environments'])])
+        clusters = self.bulk_create(KubernetesCluster, [
+            KubernetesCluster(name=f'{prefix}-k8s{i}', version={'core': '1.24', 'apiversion': 'apps/v1'},
+                              config=json.dumps({'type': 'config', 'config': ''}),
+                              idc=self.random.choice(idcs) if idcs else None)
+            for i in range(options['clusters'])])
+        products = self.bulk_create(Product, [
+            Product(name=f'{prefix}-product{i}', alias=f'产品{i}', prefix=prefix,
+                    region=self.random.choice(regions) if regions else None,
+                    creator_id=self.random.choice(user_ids) if user_ids else None,
+                    managers={'product': self.random.choice(user_ids), 'develop': self.random.choice(user_ids)}
+                    if user_ids else {})
+            for i in range(options['products'])])
+        for cluster in clusters:
+            cluster.environment.set(self.sample(environments, 2))
+            cluster.product.set(self.sample(products, 2))
+        projects = self.bulk_create(Project, [
+            Project(projectid=f'{product.name}.project{i}', name=f'project{i}', alias=f'项目{i}', product=product,
+                    creator_id=self.random.choice(user_ids) if user_ids else None,
+                    extra_members=self.get_extra_members(user_ids, options['members']))
+            for product in products for i in range(options['projects'])])
+        apps = self.bulk_create(MicroApp, [
+            MicroApp(appid=f'{project.projectid}.app{i}', name=f'{project.name}-app{i}', alias=f'应用{i}',
+                     project=project, product_id=project.product_id,
+                     creator_id=self.random.choice(user_ids) if user_ids else None,
+                     repo={'name': f'app{i}', 'path_with_namespace': f'{project.name}/app{i}'},
+                     category=f'category.{self.random.choice(["server", "front"])}',
+                     language=self.random.choice(['java', 'python', 'golang', 'node']),
+                     can_edit=self.sample(user_ids, 2),
+                     extra_members=self.get_extra_members(user_ids, options['members']))
+            for project in projects for i in range(options['apps'])])
+        MicroApp.sync_relations(apps)
+        appinfos = self.bulk_create(AppInfo, [
+            AppInfo(uniq_tag=f'{app.appid}.{environment.name.split("_")[-1].lower()}', app=app,
+                    environment=environment, branch='master', can_edit=app.can_edit,
+                    online=self.random.choice([0, 1]))
+            for app in apps for environment in environments])
+        AppInfo.sync_members(appinfos)
+        deploys = KubernetesDeploy.objects.bulk_create([
+            KubernetesDeploy(appinfo=appinfo, kubernetes=cluster, online=appinfo.online, version='1.0.0')
+            for appinfo in appinfos for cluster in self.sample(clusters, options['deploys'])],
+            batch_size=BATCH_SIZE)
+        counts.update({'Region': len(regions), 'Idc': len(idcs), 'Environment': len(environments),
+                       'KubernetesCluster': len(clusters), 'Product': len(products), 'Project': len(projects),
+                       'MicroApp': len(apps), 'AppInfo': len(appinfos), 'KubernetesDeploy': len(deploys)})
+        return counts
+
+    def get_extra_members(self, user_ids, count):
+        members = get_default_extra_members()
+        for v in members.values():
+            v['members'] = self.sample(user_ids, count)
+        return members
+
+    def generate_ucenter(self, prefix, password, **options):
+        """
+        生成用户、部门、角色、菜单
+        """
+        menus = []
+        for i in range(options['menus']):
+            # 每5个菜单为一组， 第一个为目录
+            parent = menus[i - i % 5] if i % 5 else None
+            menus.append(Menu.objects.create(name=f'{prefix}-menu{i}', title=f'菜单{i}', path=f'/{prefix}/menu{i}',
+                                             parent=parent, sort=i,
+                                             component='Layout' if parent is None else f'{prefix}/menu{i}'))
+        permissions = self.bulk_create(Permission, [
+            Permission(name=f'{prefix}-perm{i}', method=f'{prefix}_perm{i}') for i in range(options['roles'] * 2)])
+        roles = self.bulk_create(Role, [Role(name=f'{prefix}-role{i}', desc=f'角色{i}')
+                                        for i in range(options['roles'])])
+        for role in roles:
+            role.menus.set(self.sample(menus, 10))
+            role.permissions.set(self.sample(permissions, 5))
+
+        # 所有用户共用同一密码哈希， 避免逐个计算
+        password = make_password(password)
+        users = self.bulk_create(UserProfile, [
+            UserProfile(username=f'{prefix}-user{i}', first_name=f'用户{i}', email=f'{prefix}-user{i}@example.com',
+                        password=password, is_active=True, position=self.random.choice(['dev', 'op', 'test']),
+                        extra_data={'feishu_openid': f'ou_{prefix}_{i}'}, feishu_openid=f'ou_{prefix}_{i}')
+            for i in range(options['users'])])
+
+        orgs = self.bulk_create(Organization, [
+            Organization(dept_id=f'{prefix}-dept{i}', name=f'部门{i}',
+                         extra_data={'leader_user_id': self.random.choice(users).feishu_openid} if users else {})
+            for i in range(options['orgs'])])
+        for index, org in enumerate(orgs):
+            if index:
+                # 生成多级部门
+                org.parent = orgs[self.random.randrange(index)]
+        Organization.objects.bulk_update(orgs, ['parent'], batch_size=BATCH_SIZE)
+        Organization.rebuild_path()
+
+        if orgs:
+            UserProfile.department.through.objects.bulk_create([
+                UserProfile.department.through(userprofile_id=user.id, organization_id=self.random.choice(orgs).id)
+                for user in users], batch_size=BATCH_SIZE)
+        if roles:
+            UserProfile.roles.through.objects.bulk_create([
+                UserProfile.roles.through(userprofile_id=user.id, role_id=role.id)
+                for user in users for role in self.sample(roles, 2)], batch_size=BATCH_SIZE)
+        return users, orgs, roles, menus
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   rebuild_app_groups.py
+@time    :   2026/10/18 11:20
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cmdb.models import MicroApp, MicroAppGroup, get_extra_member_ids
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = '将旧版本 multiple_ids 关联应用转换为关联应用组， 升级后执行一次'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            groups, apps = self.convert()
+        self.stdout.write(self.style.SUCCESS(f'已生成 {groups} 个关联应用组， 涉及 {apps} 个应用.'))
+
+    @staticmethod
+    def convert():
+        """
+        按 multiple_ids 合并有交集的应用为一组， 已在关联组中的应用并入其所在组， 转换后清空旧字段
+
+        :return: (新建关联组数, 更新应用数)
+        """
+        rows = {i['id']: i for i in MicroApp.objects.select_for_update().values('id', 'group_id', 'multiple_ids')}
+        parents = {}
+
+        def find(i):
+            parents.setdefault(i, i)
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        legacy = [i for i in rows.values() if i['multiple_ids']]
+        for row in legacy:
+            for linked in get_extra_member_ids(row['multiple_ids']):
+                if linked in rows:
+                    parents[find(linked)] = find(row['id'])
+
+        components = {}
+        for app_id in parents:
+            components.setdefault(find(app_id), set()).add(app_id)
+        new_groups, changed = 0, []
+        for ids in components.values():
+            if len(ids) < 2:
+                continue
+            group_id = next((rows[i]['group_id'] for i in sorted(ids) if rows[i]['group_id']), None)
+            if group_id is None:
+                group_id = MicroAppGroup.objects.create().id
+                new_groups += 1
+            changed.extend(MicroApp(id=i, group_id=group_id) for i in ids if rows[i]['group_id'] != group_id)
+        MicroApp.objects.bulk_update(changed, ['group'], batch_size=BATCH_SIZE)
+        MicroApp.objects.filter(id__in=[i['id'] for i in legacy]).update(multiple_app=False, multiple_ids=[])
+        return new_groups, len(changed)
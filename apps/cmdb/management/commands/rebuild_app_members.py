@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   rebuild_app_members.py
+@time    :   2026/10/18 11:00
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cmdb.models import MicroApp, AppInfo
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = '按 can_edit/extra_members 重建应用及应用服务成员索引， 升级后执行一次'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            apps = self.rebuild(MicroApp.objects.only('id', 'can_edit', 'extra_members'), MicroApp.sync_relations)
+            appinfos = self.rebuild(AppInfo.objects.only('id', 'can_edit'), AppInfo.sync_members)
+        self.stdout.write(self.style.SUCCESS(f'已重建 {apps} 个应用、 {appinfos} 个应用服务成员索引.'))
+
+    @staticmethod
+    def rebuild(queryset, sync):
+        count, batch = 0, []
+        for instance in queryset.order_by('pk').iterator(chunk_size=BATCH_SIZE):
+            batch.append(instance)
+            if len(batch) >= BATCH_SIZE:
+                sync(batch)
+                count, batch = count + len(batch), []
+        sync(batch)
+        return count + len(batch)
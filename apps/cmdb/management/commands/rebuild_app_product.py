@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   rebuild_app_product.py
+@time    :   2026/10/18 10:40
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cmdb.models import MicroApp
+
+
+class Command(BaseCommand):
+    help = '按项目重建应用所属产品， 升级后执行一次， 否则历史应用不受 (产品, 应用名) 唯一约束'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = MicroApp.rebuild_product()
+        self.stdout.write(self.style.SUCCESS(f'已更新 {count} 个应用所属产品.'))
@@ -197,6 +197,37 @@ G_ONLINE_CHOICE = (
 )
 
 
+class MicroAppGroup(TimeAbstract):
+    """
+    应用关联组
+    """
+
+    def __str__(self):
+        return str(self.id)
+
+    class Meta:
+        default_permissions = ()
+        verbose_name = '应用关联组'
+        verbose_name_plural = verbose_name + '管理'
+
+
+def get_extra_member_ids(members):
+    """
+    获取成员组用户ID列表
+
+    兼容格式: [1,2,3] 及 {"name": "自定义成员组1", members: [1,2,3]}
+    """
+    if isinstance(members, dict):
+        members = members.get('members', [])
+    ids = []
+    for i in members or []:
+        try:
+            ids.append(int(i))
+        except (TypeError, ValueError):
+            pass
+    return ids
+
+
 class MicroApp(TimeAbstract):
     # product.project.microapp
     appid = models.CharField(max_length=250, db_index=True, unique=True, verbose_name='应用ID',
@@ -205,6 +236,9 @@ class MicroApp(TimeAbstract):
     alias = models.CharField(max_length=128, blank=True, verbose_name='别名')
     project = models.ForeignKey(
         Project, on_delete=models.PROTECT, null=True, blank=True, verbose_name='项目')
+    # 冗余项目所属产品， 产品下应用名称唯一
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, null=True, blank=True, editable=False,
+                                verbose_name='产品', help_text='与项目所属产品一致，无需传值')
     creator = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, verbose_name='创建者',
                                 help_text='前端不需要传递')
     repo = models.JSONField(default=dict, verbose_name='仓库地址',
@@ -219,9 +253,13 @@ class MicroApp(TimeAbstract):
                                 help_text='Kubernetes Deployment部署模板配置')
     language = models.CharField(
         max_length=32, default='java', verbose_name='开发语言')
+    # 关联应用组， 同组应用互为关联应用
+    group = models.ForeignKey('MicroAppGroup', related_name='apps', on_delete=models.SET_NULL, null=True, blank=True,
+                              editable=False, verbose_name='关联应用组')
+    # 已废弃， 由 rebuild_app_groups 转换为关联应用组后清空， 后续版本删除
     multiple_app = models.BooleanField(
-        default=False, blank=True, verbose_name='多应用标志')
-    multiple_ids = models.JSONField(default=list, verbose_name='多应用关联ID列表')
+        default=False, blank=True, editable=False, verbose_name='多应用标志(已废弃)')
+    multiple_ids = models.JSONField(default=list, editable=False, verbose_name='多应用关联ID列表(已废弃)')
     dockerfile = models.JSONField(default=get_default_value, verbose_name='Dockerfile配置',
                                   help_text='默认：{default: null}, 可选: {"default|默认": null, "project|使用项目Dockerfile"： "project", "custom|自定义Dockerfile": ""}')
     online = models.BooleanField(default=True, blank=True, verbose_name='上线下线',
@@ -237,6 +275,57 @@ class MicroApp(TimeAbstract):
     def __str__(self):
         return '[%s]%s' % (self.name, self.alias)
 
+    # 同步到成员索引表的字段
+    relation_fields = ('can_edit', 'extra_members')
+
+    @property
+    def is_linked(self):
+        return self.group_id is not None
+
+    @property
+    def linked_ids(self):
+        """
+        同组应用ID(含当前应用)， 配合 prefetch_related('group__apps') 使用
+        """
+        if self.group_id is None:
+            return []
+        return [i.id for i in self.group.apps.all()]
+
+    def save(self, *args, **kwargs):
+        if self.project_id:
+            self.product_id = self.project.product_id
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is None or set(update_fields) & set(self.relation_fields):
+            self.sync_relations([self])
+
+    @classmethod
+    def sync_relations(cls, apps):
+        """
+        按 can_edit/extra_members 重建成员索引， 批量写入数据后需调用
+        """
+        apps = [i for i in apps if i.pk]
+        if not apps:
+            return
+        ids = [i.pk for i in apps]
+        members = {(app.pk, uid, MicroAppMember.ROLE_EDIT)
+                   for app in apps for uid in get_extra_member_ids(app.can_edit)}
+        members.update((app.pk, uid, role) for app in apps for role, v in (app.extra_members or {}).items()
+                       for uid in get_extra_member_ids(v))
+        MicroAppMember.objects.filter(app_id__in=ids).delete()
+        MicroAppMember.objects.bulk_create([MicroAppMember(app_id=app, user_id=user, role=role)
+                                            for app, user, role in members], batch_size=500)
+
+    @classmethod
+    def rebuild_product(cls):
+        """
+        按项目重建应用所属产品， 用于历史数据
+
+        :return: 更新的应用数
+        """
+        return cls.objects.update(product_id=models.Subquery(
+            Project.objects.filter(id=models.OuterRef('project_id')).values('product_id')[:1]))
+
     class ExtMeta:
         related = True
         dashboard = True
@@ -247,6 +336,10 @@ class MicroApp(TimeAbstract):
         ordering = ['-created_time']
         verbose_name = '应用'
         verbose_name_plural = verbose_name + '管理'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'name'], name='unique_product_app_name')
+        ]
 
 
 class AppInfo(TimeAbstract):
@@ -283,6 +376,27 @@ class AppInfo(TimeAbstract):
     def __str__(self):
         return self.uniq_tag
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is None or 'can_edit' in update_fields:
+            self.sync_members([self])
+
+    @classmethod
+    def sync_members(cls, appinfos):
+        """
+        按 can_edit 重建成员索引， 批量写入数据后需调用
+        """
+        appinfos = [i for i in appinfos if i.pk]
+        if not appinfos:
+            return
+        members = {(appinfo.pk, uid) for appinfo in appinfos
+                   for uid in get_extra_member_ids(appinfo.can_edit)}
+        AppInfoMember.objects.filter(
+            appinfo_id__in=[i.pk for i in appinfos]).delete()
+        AppInfoMember.objects.bulk_create([AppInfoMember(appinfo_id=appinfo, user_id=user)
+                                           for appinfo, user in members], batch_size=500)
+
     @property
     def namespace(self):
         return f'{self.environment.name.replace("_", "-")}-{self.app.project.name.replace("_", "-")}'.lower()
@@ -322,3 +436,48 @@ class KubernetesDeploy(TimeAbstract):
 
     class Meta:
         default_permissions = ()
+
+
+class MicroAppMember(models.Model):
+    """
+    应用成员索引， 由 MicroApp.can_edit/extra_members 同步， 用于按用户查询应用
+    """
+    ROLE_EDIT = 'can_edit'
+
+    app = models.ForeignKey(
+        MicroApp, related_name='members', on_delete=models.CASCADE, verbose_name='应用')
+    # 成员字段可能保存已删除用户的ID， 不建立外键约束
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, db_constraint=False,
+                             verbose_name='用户')
+    role = models.CharField(max_length=64, verbose_name='角色',
+                            help_text='can_edit: 管理人员, 其它为 extra_members 成员组key')
+
+    class Meta:
+        default_permissions = ()
+        verbose_name = '应用成员'
+        verbose_name_plural = verbose_name + '管理'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['app', 'user', 'role'], name='unique_microapp_member')
+        ]
+        indexes = [models.Index(fields=['user', 'role'])]
+
+
+class AppInfoMember(models.Model):
+    """
+    应用服务成员索引， 由 AppInfo.can_edit 同步
+    """
+    appinfo = models.ForeignKey(
+        AppInfo, related_name='members', on_delete=models.CASCADE, verbose_name='应用服务')
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, db_constraint=False,
+                             verbose_name='用户')
+
+    class Meta:
+        default_permissions = ()
+        verbose_name = '应用服务成员'
+        verbose_name_plural = verbose_name + '管理'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['appinfo', 'user'], name='unique_appinfo_member')
+        ]
+        indexes = [models.Index(fields=['user'])]
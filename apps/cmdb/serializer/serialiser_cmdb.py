@@ -13,9 +13,11 @@ from typing import List
 from rest_framework import serializers
 
 from django.db import transaction
-from django.contrib.auth.models import User
 
-from cmdb.models import Product, Project, Environment, KubernetesCluster, MicroApp, AppInfo, KubernetesDeploy
+from common.extends.serializers import BulkPrimaryKeyRelatedField
+from ucenter.models import UserProfile as User
+from cmdb.models import Product, Project, Environment, KubernetesCluster, MicroApp, AppInfo, KubernetesDeploy, \
+    get_extra_member_ids
 
 
 class ProductSerializers(serializers.ModelSerializer):
@@ -78,16 +80,48 @@ class KubernetesClusterListSerializers(serializers.ModelSerializer):
 
 
 class KubernetesClusterSerializers(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
     class Meta:
         model = KubernetesCluster
         fields = '__all__'
 
 
+def get_extra_members_map(instances):
+    """
+    批量获取应用额外成员组用户， 整页数据只查询一次
+
+    :return: {user_id: user}
+    """
+    user_ids = {uid for instance in instances for members in (instance.extra_members or {}).values()
+                for uid in get_extra_member_ids(members)}
+    if not user_ids:
+        return {}
+    return {i.id: i for i in User.objects.filter(id__in=user_ids).only('id', 'first_name', 'username')}
+
+
+class MicroAppListBatchSerializers(serializers.ListSerializer):
+    """
+    应用列表批量序列化， 预先按整页数据加载额外成员组用户
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if hasattr(data, 'all') else data
+        iterable = list(iterable)
+        self.context['extra_members_map'] = get_extra_members_map(iterable)
+        return super().to_representation(iterable)
+
+
 class MicroAppListSerializers(serializers.ModelSerializer):
+    """
+    需配合预加载使用: select_related project/project__product/creator/group, prefetch appinfo_set__environment/group__apps
+    """
     project_info = serializers.SerializerMethodField()
     appinfo = serializers.SerializerMethodField()
     creator_info = serializers.SerializerMethodField()
     extra_team_info = serializers.SerializerMethodField()
+    multiple_app = serializers.BooleanField(source='is_linked', read_only=True)
+    multiple_ids = serializers.ListField(source='linked_ids', read_only=True)
 
     def get_project_info(self, instance):
         project = instance.project
@@ -107,21 +141,30 @@ class MicroAppListSerializers(serializers.ModelSerializer):
             return {'id': '', 'first_name': '', 'username': ''}
 
     def get_extra_team_info(self, instance):
+        users = self.context.get('extra_members_map', None)
+        if users is None:
+            # 单条数据序列化
+            users = get_extra_members_map([instance])
         data = {}
         for k, v in instance.extra_members.items():
             data[k] = [
-                {'id': i.id, 'name': i.name,
+                {'id': i.id, 'name': i.nickname,
                     'first_name': i.first_name, 'username': i.username}
-                for i in User.objects.filter(id__in=v)
+                for i in [users[uid] for uid in get_extra_member_ids(v) if uid in users]
             ]
         return data
 
     class Meta:
         model = MicroApp
         fields = '__all__'
+        list_serializer_class = MicroAppListBatchSerializers
 
 
 class MicroAppSerializers(serializers.ModelSerializer):
+    # 由关联应用组生成， 通过 related/unrelated 接口修改
+    multiple_app = serializers.BooleanField(source='is_linked', read_only=True)
+    multiple_ids = serializers.ListField(source='linked_ids', read_only=True)
+
     class Meta:
         model = MicroApp
         fields = '__all__'
@@ -139,6 +182,7 @@ class MicroAppSerializers(serializers.ModelSerializer):
         validated_data = default_value(['dockerfile', 'target'])
         validated_data[
             'appid'] = f"{validated_data['project'].product.name}.{validated_data['project'].name}.{validated_data['name']}"
+        validated_data['product'] = validated_data['project'].product
         return validated_data
 
     def create(self, validated_data):
@@ -159,13 +203,15 @@ class KubernetesDeploySerializers(serializers.ModelSerializer):
 
 
 class AppInfoListSerializers(serializers.ModelSerializer):
+    """
+    需配合预加载使用: select_related app/app__group/environment, prefetch kubernetes/app_info__kubernetes/app__group__apps
+    """
     app = MicroAppSerializers()
     kubernetes_info = serializers.SerializerMethodField()
 
     def get_kubernetes_info(self, instance):
         serializer = KubernetesDeploySerializers(
-            data=KubernetesDeploy.objects.filter(appinfo=instance.id), many=True)
-        serializer.is_valid()
+            instance=instance.app_info.all(), many=True)
         return serializer.data
 
     class Meta:
@@ -186,8 +232,10 @@ class AppInfoSerializers(serializers.ModelSerializer):
         if kwargs.get('instance', None):
             kubernetes = self.initial_data.get('kubernetes')
             _bulk = []
+            # 一次查询所有关联集群
+            clusters = KubernetesCluster.objects.in_bulk(kubernetes)
             for kid in kubernetes:
-                _ks = KubernetesCluster.objects.get(id=kid)
+                _ks = clusters[int(kid)]
                 _bulk.append(KubernetesDeploy(
                     appinfo=kwargs['instance'], kubernetes=_ks))
             KubernetesDeploy.objects.bulk_create(_bulk, ignore_conflicts=True)
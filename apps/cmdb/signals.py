@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   signals.py
+@time    :   2026/10/17 19:20
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from cmdb.models import Project, MicroApp
+
+
+@receiver(post_save, sender=Project)
+def project_changed(sender, instance, created=False, **kwargs):
+    """
+    项目变更所属产品， 同步更新应用冗余的产品字段
+    """
+    if not created:
+        MicroApp.objects.filter(project=instance).exclude(
+            product_id=instance.product_id).update(product_id=instance.product_id)
@@ -1,3 +1,464 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection, transaction, IntegrityError
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ucenter.models import UserProfile
+from cmdb.models import Product, Project, Environment, KubernetesCluster, MicroApp, AppInfo, KubernetesDeploy, \
+    MicroAppMember, MicroAppGroup
+from common.extends.middleware import PerformanceMiddleware
+from common.testing import QueryBudgetTestMixin
+from cmdb.urls import router
+from cmdb.views import MicroAppViewSet, AppInfoViewSet
 
 # Create your tests here.
+
+
+# 大数据量请求， 关闭慢请求日志
+@mock.patch.object(PerformanceMiddleware, 'slow_threshold', 0)
+class AppInfoQueryCountTestCase(TestCase):
+    """
+    应用服务列表查询次数不随数据量增长
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        product = Product.objects.create(name='product')
+        cls.project = Project.objects.create(
+            projectid='product.project', name='project', product=product)
+        cls.environments = [Environment.objects.create(
+            name=f'env{i}') for i in range(3)]
+        cls.clusters = [KubernetesCluster.objects.create(
+            name=f'k8s{i}') for i in range(2)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_appinfo(self, count):
+        start = AppInfo.objects.count()
+        apps = MicroApp.objects.bulk_create([
+            MicroApp(appid=f'product.project.app{i}', name=f'app{i}', project=self.project) for i in range(start, start + count)])
+        appinfos = AppInfo.objects.bulk_create([
+            AppInfo(uniq_tag=f'{app.appid}.{index}', app=app, environment=self.environments[index % len(self.environments)])
+            for index, app in enumerate(apps)])
+        KubernetesDeploy.objects.bulk_create([
+            KubernetesDeploy(appinfo=appinfo, kubernetes=cluster) for appinfo in appinfos for cluster in self.clusters])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()['data']
+
+    def test_list_query_count(self):
+        self.create_appinfo(10)
+        small, data = self.count_queries('/api/app/service/?page_size=1000')
+        self.assertEqual(len(data['list']), 10)
+        self.assertEqual(len(data['list'][0]['kubernetes_info']), 2)
+        self.create_appinfo(990)
+        large, data = self.count_queries('/api/app/service/?page_size=1000')
+        self.assertEqual(len(data['list']), 1000)
+        self.assertEqual(small, large)
+
+    def test_retrieve_query_count(self):
+        self.create_appinfo(1)
+        appinfo = AppInfo.objects.first()
+        queries, data = self.count_queries(f'/api/app/service/{appinfo.id}/')
+        self.assertEqual(len(data['kubernetes_info']), 2)
+        self.assertLessEqual(queries, 4)
+
+
+class MicroAppBulkTestCase(TestCase):
+    """
+    应用批量创建/更新/删除
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        product = Product.objects.create(name='product')
+        cls.project = Project.objects.create(
+            projectid='product.project', name='project', product=product)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_create(self):
+        data = [{'name': f'app {i}', 'project': self.project.id} for i in range(3)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/app/bulk/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 3)
+        self.assertEqual(MicroApp.objects.filter(
+            creator=self.user, can_edit=[self.user.id]).count(), 3)
+        self.assertTrue(MicroApp.objects.filter(
+            appid='product.project.app-0').exists())
+        # 批量写入， 不随数据量增长
+        self.assertLess(len([i for i in context.captured_queries
+                             if i['sql'].startswith('INSERT')]), 3)
+
+    def test_bulk_create_errors(self):
+        data = [{'name': 'app1', 'project': self.project.id},
+                {'name': 'app2', 'project': 0}]
+        response = self.client.post('/api/app/bulk/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['data']
+        self.assertEqual(errors[0], {})
+        self.assertIn('project', errors[1])
+        self.assertFalse(MicroApp.objects.exists())
+
+    def test_bulk_create_unique(self):
+        MicroApp.objects.create(
+            appid='product.project.app1', name='app1', project=self.project)
+        data = [{'name': 'app1', 'project': self.project.id},
+                {'name': 'app2', 'project': self.project.id},
+                {'name': 'app2', 'project': self.project.id}]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/app/bulk/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['data']
+        self.assertIn('name', errors[0])
+        self.assertEqual(errors[1], {})
+        self.assertIn('name', errors[2])
+        self.assertEqual(len([i for i in context.captured_queries
+                              if 'FROM "cmdb_microapp"' in i['sql']]), 1)
+
+    def test_create_unique(self):
+        MicroApp.objects.create(
+            appid='product.project.app1', name='app1', project=self.project)
+        self.assertEqual(MicroApp.objects.get().product_id, self.project.product_id)
+        response = self.client.post(
+            '/api/app/', {'name': 'app1', 'project': self.project.id, 'product': self.project.product_id}, format='json')
+        self.assertEqual(response.json()['code'], 40300)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            MicroApp.objects.create(
+                appid='product.other.app1', name='app1', project=self.project)
+
+    def test_bulk_update_and_destroy(self):
+        apps = MicroApp.objects.bulk_create([
+            MicroApp(appid=f'product.project.app{i}', name=f'app{i}', project=self.project) for i in range(3)])
+        data = [{'id': i.id, 'name': i.name, 'project': self.project.id, 'alias': f'alias{i.id}'}
+                for i in apps] + [{'id': 0, 'alias': 'none'}]
+        response = self.client.patch('/api/app/bulk/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['data'][:3], [{}, {}, {}])
+        response = self.client.patch('/api/app/bulk/', data[:3], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(MicroApp.objects.values_list('alias', flat=True)),
+                         {f'alias{i.id}' for i in apps})
+
+        response = self.client.delete(
+            '/api/app/bulk/', {'ids': [i.id for i in apps[:2]]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(MicroApp.objects.count(), 1)
+
+
+class MicroAppProductTestCase(TestCase):
+    """
+    应用冗余的所属产品
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        cls.products = [Product.objects.create(name=f'product{i}') for i in range(2)]
+        cls.project = Project.objects.create(
+            projectid='product0.project', name='project', product=cls.products[0])
+        cls.app = MicroApp.objects.create(appid='product0.project.app', name='app', project=cls.project)
+
+    def test_bulk_update_project(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch('/api/project/bulk/', [{'id': self.project.id, 'product': self.products[1].id}],
+                                format='json')
+        self.assertEqual(response.json()['code'], 20000, response.content)
+        self.assertEqual(MicroApp.objects.get(pk=self.app.pk).product_id, self.products[1].id)
+
+    def test_rebuild_product(self):
+        MicroApp.objects.update(product=None)
+        call_command('rebuild_app_product', stdout=StringIO())
+        self.assertEqual(MicroApp.objects.get(pk=self.app.pk).product_id, self.products[0].id)
+
+
+class CursorPaginationTestCase(TestCase):
+    """
+    游标分页与页码分页顺序一致(排序字段可为空)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        product = Product.objects.create(name='product')
+        project = Project.objects.create(
+            projectid='product.project', name='project', product=product)
+        environments = [Environment.objects.create(name=f'env{i}') for i in range(2)]
+        base = timezone.now()
+        times = [base - timedelta(hours=2), None, base, base - timedelta(hours=1), base + timedelta(hours=1)]
+        for i, created_time in enumerate(times):
+            app = MicroApp.objects.create(appid=f'product.project.app{i}', name=f'app{i}', project=project)
+            MicroApp.objects.filter(pk=app.pk).update(created_time=created_time)
+            for index, environment in enumerate(environments):
+                appinfo = AppInfo.objects.create(
+                    uniq_tag=f'{app.appid}.{index}', app=app, environment=environment)
+                # 相同更新时间及多个空值按 id 排序
+                AppInfo.objects.filter(pk=appinfo.pk).update(update_time=times[(i + index) % 3])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_ids(self, url):
+        response = self.client.get(f'{url}?page_size=100')
+        return [i['id'] for i in response.json()['data']['list']]
+
+    def get_cursor_ids(self, url):
+        ids, pages = [], []
+        url = f'{url}?cursor=&page_size=2'
+        while url:
+            data = self.client.get(url).json()['data']
+            pages.append(data)
+            ids.extend(i['id'] for i in data['list'])
+            url = data['next']
+        # 逐页向前翻页
+        previous = [i['id'] for i in pages[-1]['list']]
+        url = pages[-1]['previous']
+        while url:
+            data = self.client.get(url).json()['data']
+            previous = [i['id'] for i in data['list']] + previous
+            url = data['previous']
+        self.assertEqual(previous, ids)
+        return ids
+
+    def test_created_time(self):
+        ids = self.get_ids('/api/app/')
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(self.get_cursor_ids('/api/app/'), ids)
+
+    def test_update_time(self):
+        ids = self.get_ids('/api/app/service/')
+        self.assertEqual(len(ids), 10)
+        self.assertEqual(self.get_cursor_ids('/api/app/service/'), ids)
+
+
+class StreamListTestCase(TestCase):
+    """
+    get_all 流式导出
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        product = Product.objects.create(name='product')
+        project = Project.objects.create(
+            projectid='product.project', name='project', product=product)
+        environment = Environment.objects.create(name='env')
+        for i in range(5):
+            app = MicroApp.objects.create(appid=f'product.project.app{i}', name=f'app{i}', project=project)
+            AppInfo.objects.create(uniq_tag=f'{app.appid}.env', app=app, environment=environment)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_stream(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    # 多批次序列化
+    @mock.patch.object(MicroAppViewSet, 'stream_chunk_size', 2)
+    @mock.patch.object(AppInfoViewSet, 'stream_chunk_size', 2)
+    def test_json(self):
+        for url in ('/api/app/', '/api/app/service/'):
+            expected = self.client.get(f'{url}?get_all=1').json()
+            self.assertEqual(expected['data']['total'], 5)
+            response, content = self.get_stream(f'{url}?get_all=1&stream=json')
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(content), expected)
+
+    @mock.patch.object(MicroAppViewSet, 'stream_chunk_size', 2)
+    def test_ndjson(self):
+        expected = self.client.get('/api/app/?get_all=1').json()['data']['list']
+        response, content = self.get_stream('/api/app/?get_all=1&stream=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = content.split('\n')
+        self.assertEqual(lines[-1], '')
+        self.assertEqual([json.loads(i) for i in lines[:-1]], expected)
+
+    def test_empty(self):
+        AppInfo.objects.all().delete()
+        MicroApp.objects.all().delete()
+        _, content = self.get_stream('/api/app/?get_all=1&stream=json')
+        self.assertEqual(json.loads(content), {'data': {'list': [], 'total': 0}, 'code': 20000, 'message': None})
+        _, content = self.get_stream('/api/app/?get_all=1&stream=ndjson')
+        self.assertEqual(content, '')
+
+
+class MicroAppMemberTestCase(TestCase):
+    """
+    应用成员/关联应用索引
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        cls.member = UserProfile.objects.create(username='member')
+        product = Product.objects.create(name='product')
+        cls.project = Project.objects.create(
+            projectid='product.project', name='project', product=product)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_member_index(self):
+        app = MicroApp.objects.create(appid='product.project.app1', name='app1', project=self.project,
+                                      can_edit=[self.user.id],
+                                      extra_members={'dev': {'name': '开发人员', 'members': [self.member.id]}})
+        MicroApp.objects.create(
+            appid='product.project.app2', name='app2', project=self.project)
+        self.assertEqual(set(MicroAppMember.objects.filter(app=app).values_list('user_id', 'role')),
+                         {(self.user.id, 'can_edit'), (self.member.id, 'dev')})
+
+        response = self.client.get(
+            f'/api/app/?member={self.member.id}&member_role=dev')
+        self.assertEqual([i['id'] for i in response.json()['data']['list']], [app.id])
+        response = self.client.get('/api/app/?member=me&member_role=can_edit')
+        self.assertEqual([i['id'] for i in response.json()['data']['list']], [app.id])
+        # 接口仍返回原JSON格式
+        self.assertEqual(response.json()['data']['list'][0]['can_edit'], [self.user.id])
+
+        app.extra_members = {'dev': {'name': '开发人员', 'members': []}}
+        app.save()
+        self.assertFalse(MicroAppMember.objects.filter(
+            user=self.member).exists())
+
+    def test_appinfo_member_index(self):
+        app = MicroApp.objects.create(appid='product.project.app1', name='app1', project=self.project)
+        environments = [Environment.objects.create(name=f'env{i}') for i in range(2)]
+        appinfo = AppInfo.objects.create(uniq_tag=f'{app.appid}.0', app=app, environment=environments[0],
+                                         can_edit=[self.member.id])
+        AppInfo.objects.create(uniq_tag=f'{app.appid}.1', app=app, environment=environments[1],
+                               can_edit=[self.user.id])
+        response = self.client.get(f'/api/app/service/?member={self.member.id}')
+        self.assertEqual([i['id'] for i in response.json()['data']['list']], [appinfo.id])
+        response = self.client.get('/api/app/service/?member=invalid')
+        self.assertEqual(response.json()['data']['list'], [])
+
+        appinfo.can_edit = []
+        appinfo.save()
+        response = self.client.get(f'/api/app/service/?member={self.member.id}')
+        self.assertEqual(response.json()['data']['list'], [])
+
+        AppInfo.objects.filter(id=appinfo.id).update(can_edit=[self.member.id])
+        call_command('rebuild_app_members', stdout=StringIO())
+        self.client.force_authenticate(self.member)
+        response = self.client.get('/api/app/service/?member=me')
+        self.assertEqual([i['id'] for i in response.json()['data']['list']], [appinfo.id])
+
+    def test_rebuild_groups(self):
+        apps = [MicroApp.objects.create(appid=f'product.project.app{i}', name=f'app{i}', project=self.project)
+                for i in range(4)]
+        MicroApp.objects.filter(id=apps[0].id).update(multiple_app=True, multiple_ids=[apps[0].id, apps[1].id])
+        MicroApp.objects.filter(id=apps[2].id).update(multiple_app=True, multiple_ids=[apps[1].id, apps[2].id])
+        call_command('rebuild_app_groups', stdout=StringIO())
+        groups = dict(MicroApp.objects.values_list('id', 'group_id'))
+        self.assertIsNotNone(groups[apps[0].id])
+        self.assertEqual({groups[i.id] for i in apps[:3]}, {groups[apps[0].id]})
+        self.assertIsNone(groups[apps[3].id])
+        self.assertFalse(MicroApp.objects.filter(multiple_app=True).exists())
+        response = self.client.get(f'/api/app/{apps[1].id}/')
+        self.assertEqual(sorted(response.json()['data']['multiple_ids']), [i.id for i in apps[:3]])
+
+    def test_rebuild_members(self):
+        app = MicroApp.objects.create(appid='product.project.app1', name='app1', project=self.project,
+                                      extra_members={'dev': {'name': '开发人员', 'members': [self.member.id]}})
+        MicroAppMember.objects.all().delete()
+        call_command('rebuild_app_members', stdout=StringIO())
+        response = self.client.get(f'/api/app/?member={self.member.id}')
+        self.assertEqual([i['id'] for i in response.json()['data']['list']], [app.id])
+
+    def test_related_group(self):
+        apps = [MicroApp.objects.create(appid=f'product.project.app{i}', name=f'app{i}', project=self.project)
+                for i in range(4)]
+        response = self.client.post(
+            '/api/app/related/', {'ids': [apps[0].id, apps[1].id]}, format='json')
+        self.assertEqual(response.json()['code'], 20000)
+        group = MicroApp.objects.get(id=apps[0].id).group_id
+        self.assertIsNotNone(group)
+        # 加入目标应用所在关联组， 只更新新加入的应用
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(
+                '/api/app/related/', {'ids': [apps[2].id], 'target': apps[0].id}, format='json')
+        updates = [i['sql'] for i in context.captured_queries if i['sql'].startswith('UPDATE "cmdb_microapp"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(MicroApp.objects.filter(group_id=group).count(), 3)
+
+        response = self.client.get(f'/api/app/{apps[1].id}/')
+        data = response.json()['data']
+        self.assertTrue(data['multiple_app'])
+        self.assertEqual(sorted(data['multiple_ids']), sorted(i.id for i in apps[:3]))
+
+        self.client.post('/api/app/unrelated/', {'id': apps[0].id}, format='json')
+        self.assertEqual(MicroApp.objects.filter(group_id=group).count(), 2)
+        # 只剩一个应用时解散关联组
+        self.client.post('/api/app/unrelated/', {'id': apps[1].id}, format='json')
+        self.assertFalse(MicroApp.objects.filter(group__isnull=False).exists())
+        self.assertFalse(MicroAppGroup.objects.exists())
+
+
+class GenerateDataTestCase(TestCase):
+    """
+    生成测试数据
+    """
+
+    def test_generate(self):
+        call_command('gen_cmdb_data', verbosity=0, regions=1, products=2, projects=2, apps=3, environments=2,
+                     clusters=2, deploys=1, users=10, orgs=3, roles=2, menus=5)
+        self.assertEqual(MicroApp.objects.count(), 12)
+        self.assertEqual(AppInfo.objects.count(), 24)
+        self.assertEqual(KubernetesDeploy.objects.count(), 24)
+        self.assertFalse(MicroApp.objects.filter(product=None).exists())
+        self.assertTrue(MicroAppMember.objects.exists())
+        self.assertEqual(UserProfile.objects.exclude(feishu_openid=None).count(), 10)
+        # 使用不同前缀重复生成
+        call_command('gen_cmdb_data', verbosity=0, prefix='other', products=1, projects=1, apps=1, users=1)
+        self.assertEqual(MicroApp.objects.count(), 13)
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """
+    CMDB视图查询次数预算
+    """
+    routers = ((router, '/api/'), )
+
+    def get_MicroAppViewSet_payload(self, action, instance):
+        # 新增时 can_edit 由创建人生成
+        data = self.get_default_payload(MicroAppViewSet, action, instance)
+        data.pop('can_edit', None)
+        return data
+
+    def get_AppInfoViewSet_payload(self, action, instance):
+        data = self.get_default_payload(AppInfoViewSet, action, instance)
+        data['kubernetes'] = [i.id for i in instance.kubernetes.all()]
+        if action == 'create':
+            # 应用在每个环境只有一个服务， 新增环境
+            data['environment'] = Environment.objects.create(name=f'qb_env{self.counter}').id
+        return data
@@ -39,6 +39,7 @@ class RegionViewSet(AutoModelViewSet):
     )
     queryset = Region.objects.all()
     serializer_class = RegionSerializers
+    query_budget = {'list': 2, 'retrieve': 1, 'create': 2, 'update': 3}
 
 
 class IdcViewSet(AutoModelViewSet):
@@ -62,3 +63,4 @@ class IdcViewSet(AutoModelViewSet):
     )
     queryset = Idc.objects.all()
     serializer_class = IdcSerializers
+    query_budget = {'list': 2, 'retrieve': 1, 'create': 4, 'update': 5}
@@ -12,12 +12,14 @@ import json
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.db import transaction
+from django.db.models import Count, Prefetch
 
 from cmdb.serializer.serialiser_cmdb import AppInfoListSerializers, AppInfoSerializers, KubernetesClusterListSerializers, KubernetesClusterSerializers, MicroAppListSerializers, MicroAppSerializers
-from common.extends.decorators import cmdb_app_unique_check
+from common.extends.decorators import cmdb_app_unique_check, get_exist_apps
 from common.extends.viewsets import AutoModelViewSet, ops_response
 
-from cmdb.models import Product, Project, Environment, KubernetesCluster, MicroApp, AppInfo, KubernetesDeploy
+from cmdb.models import Product, Project, Environment, KubernetesCluster, MicroApp, AppInfo, KubernetesDeploy, MicroAppMember, MicroAppGroup, \
+    AppInfoMember
 from cmdb.serializers import ProductSerializers, ProjectSerializers, EnvironmentSerializers
 
 import logging
@@ -48,6 +50,7 @@ class ProductViewSet(AutoModelViewSet):
     )
     queryset = Product.objects.all()
     serializer_class = ProductSerializers
+    query_budget = {'list': 2, 'retrieve': 1, 'create': 4, 'update': 5}
 
 
 class ProjectViewSet(AutoModelViewSet):
@@ -73,6 +76,7 @@ class ProjectViewSet(AutoModelViewSet):
     )
     queryset = Project.objects.all()
     serializer_class = ProjectSerializers
+    query_budget = {'list': 2, 'retrieve': 1, 'create': 3, 'update': 5}
 
 
 class EnvironmentViewSet(AutoModelViewSet):
@@ -98,6 +102,7 @@ class EnvironmentViewSet(AutoModelViewSet):
     )
     queryset = Environment.objects.all()
     serializer_class = EnvironmentSerializers
+    query_budget = {'list': 2, 'retrieve': 1, 'create': 2, 'update': 3}
 
 
 class KubernetesClusterViewSet(AutoModelViewSet):
@@ -123,6 +128,11 @@ class KubernetesClusterViewSet(AutoModelViewSet):
     )
     queryset = KubernetesCluster.objects.all()
     serializer_class = KubernetesClusterSerializers
+    eager_loading_by_action = {
+        _action: {'prefetch_related': ('environment', 'product')}
+        for _action in ['list', 'retrieve']
+    }
+    query_budget = {'list': 4, 'retrieve': 3, 'create': 11, 'update': 10}
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
@@ -152,13 +162,47 @@ class MicroAppViewSet(AutoModelViewSet):
         {'delete': ('microapp_delete', '删除应用')}
     )
     queryset = MicroApp.objects.all()
+    read_replica = True
     serializer_class = MicroAppSerializers
+    # 列表/详情预加载， 额外成员组用户由 MicroAppListBatchSerializers 整页批量查询
+    eager_loading_by_action = {
+        _action: {
+            'select_related': ('project', 'project__product', 'creator', 'group'),
+            'prefetch_related': (
+                Prefetch('appinfo_set', queryset=AppInfo.objects.select_related('environment')),
+                Prefetch('group__apps', queryset=MicroApp.objects.only('id', 'group_id')),
+            )
+        }
+        for _action in ['list', 'retrieve']
+    }
+    query_budget = {'list': 4, 'retrieve': 3, 'create': 6, 'update': 7}
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return MicroAppListSerializers
         return MicroAppSerializers
 
+    def extend_filter(self, queryset):
+        """
+        按成员索引查询用户相关的应用
+
+        ### 查询参数:
+            member: 用户ID， me 为当前用户
+            member_role: can_edit(管理人员) 或 extra_members 成员组key， 不传为全部
+        """
+        member = self.request.query_params.get('member', None)
+        if not member:
+            return queryset
+        if member == 'me':
+            member = self.request.user.id
+        elif not member.isdigit():
+            return queryset.none()
+        members = MicroAppMember.objects.filter(user_id=member)
+        role = self.request.query_params.get('member_role', None)
+        if role:
+            members = members.filter(role=role)
+        return queryset.filter(id__in=members.values('app_id'))
+
     @cmdb_app_unique_check()
     def create(self, request, *args, **kwargs):
         """
@@ -172,6 +216,43 @@ class MicroAppViewSet(AutoModelViewSet):
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
+    def validate_bulk_create(self, serializers):
+        """
+        产品下应用名称唯一， 批次内去重并一次查询已存在的应用
+        """
+        keys = [(getattr(i.validated_data.get('project', None), 'product_id', None), i.validated_data['name'])
+                for i in serializers]
+        exists = get_exist_apps([i for i in keys if i[0]])
+        errors, seen = [], set()
+        for key in keys:
+            errors.append({'name': [f'该产品下已存在[{key[1]}]同名应用.']}
+                          if key[0] and (key in exists or key in seen) else {})
+            seen.add(key)
+        return errors if any(errors) else None
+
+    def perform_bulk_create(self, serializers):
+        # 同 MicroAppSerializers.create
+        instances = self.bulk_save(
+            serializers, creator=self.request.user, can_edit=[self.request.user.id])
+        MicroApp.sync_relations(instances)
+        return instances
+
+    def perform_bulk_update(self, serializers):
+        instances = self.bulk_save(serializers)
+        MicroApp.sync_relations(instances)
+        return instances
+
+    @staticmethod
+    def clean_groups(group_ids):
+        """
+        解散成员不足2个的关联组
+        """
+        groups = list(MicroAppGroup.objects.filter(id__in=group_ids).annotate(
+            count=Count('apps')).filter(count__lt=2).values_list('id', flat=True))
+        if groups:
+            MicroApp.objects.filter(group_id__in=groups).update(group=None)
+            MicroAppGroup.objects.filter(id__in=groups).delete()
+
     @action(methods=['POST'], url_path='related', detail=False)
     def app_related(self, request):
         """
@@ -179,20 +260,35 @@ class MicroAppViewSet(AutoModelViewSet):
 
         ### 传递参数:
             ids: 待关联应用id数组
-            target: 目标应用id
+            target: 目标应用id， 待关联应用加入目标应用所在的关联组
         """
+        target = request.data.get('target', None)
+        ids = request.data.get('ids', None) or []
+        if not isinstance(ids, list):
+            return ops_response({}, code=40000, message='参数ids必须为数组.')
+        ids = {str(i) for i in (ids + [target] if target else ids)}
         try:
-            target = request.data.get('target', None)
-            ids = request.data.get('ids', None)
-            if target:
-                instance = self.queryset.get(id=target)
-                ids.extend(instance.multiple_ids)
-            self.queryset.filter(id__in=list(set(ids))).update(
-                multiple_app=True, multiple_ids=list(set(ids)))
+            with transaction.atomic():
+                apps = list(MicroApp.objects.select_for_update().filter(
+                    id__in=ids).only('id', 'group_id'))
+                if len(apps) != len(ids) or len(apps) < 2:
+                    return ops_response({}, code=40000, message='应用不存在或关联应用少于2个.')
+                group_ids = {i.group_id for i in apps if i.group_id}
+                # 优先加入目标应用所在的关联组
+                group_id = next((i.group_id for i in apps if str(i.id) == str(target) and i.group_id), None) or \
+                    next(iter(group_ids), None)
+                if group_id is None:
+                    group_id = MicroAppGroup.objects.create().id
+                # 锁定关联组， 同一关联组的变更串行执行
+                list(MicroAppGroup.objects.select_for_update().filter(
+                    id__in=group_ids | {group_id}))
+                MicroApp.objects.filter(id__in=[i.id for i in apps if i.group_id != group_id]).update(
+                    group_id=group_id)
+                self.clean_groups(group_ids - {group_id})
             return ops_response('应用关联成功.')
         except BaseException as e:
-            logger.error('err', e)
-            return ops_response({}, success=False, errorCode=50000, errorMessage='关联应用异常,请联系管理员!')
+            logger.exception(f'关联应用异常, 原因: {e}')
+            return ops_response({}, code=50000, message='关联应用异常,请联系管理员!')
 
     @action(methods=['POST'], url_path='unrelated', detail=False)
     def app_unrelated(self, request):
@@ -203,22 +299,21 @@ class MicroAppViewSet(AutoModelViewSet):
             id: 应用id
         """
         try:
-            instance = self.queryset.filter(id=request.data.get('id'))
-            # 获取关联应用ID列表
-            ids = instance[0].multiple_ids
-            ids.remove(instance[0].id)
-            if len(ids) == 1:
-                # 如果关联应用只剩下一个,则一起取消关联
-                self.queryset.filter(id__in=instance[0].multiple_ids).update(
-                    multiple_app=False, multiple_ids=[])
-            else:
-                # 更新其它应用的关联应用ID
-                self.queryset.filter(id__in=ids).update(multiple_ids=ids)
-                # 取消当前实例应用关联
-                instance.update(multiple_app=False, multiple_ids=[])
+            with transaction.atomic():
+                instance = MicroApp.objects.select_for_update().filter(
+                    id=request.data.get('id', None)).only('id', 'group_id').first()
+                if instance is None:
+                    return ops_response({}, code=40000, message='应用不存在.')
+                if instance.group_id:
+                    list(MicroAppGroup.objects.select_for_update().filter(
+                        id=instance.group_id))
+                    MicroApp.objects.filter(id=instance.id).update(group=None)
+                    # 关联应用只剩下一个, 则一起取消关联
+                    self.clean_groups([instance.group_id])
             return ops_response('应用取消关联成功.')
         except BaseException as e:
-            return ops_response({}, success=False, errorCode=50000, errorMessage=f'关联应用异常,请联系管理员! 原因：{e}')
+            logger.exception(f'取消应用关联异常, 原因: {e}')
+            return ops_response({}, code=50000, message=f'关联应用异常,请联系管理员! 原因：{e}')
 
 
 class AppInfoViewSet(AutoModelViewSet):
@@ -246,12 +341,72 @@ class AppInfoViewSet(AutoModelViewSet):
     )
     queryset = AppInfo.objects.all()
     serializer_class = AppInfoSerializers
+    # 列表/详情预加载， 同时覆盖 namespace/jenkins_jobname 访问的 environment、app、app.project
+    eager_loading_by_action = {
+        _action: {
+            'select_related': ('app', 'app__project', 'app__group', 'environment'),
+            'prefetch_related': (
+                'kubernetes',
+                Prefetch('app_info', queryset=KubernetesDeploy.objects.select_related('kubernetes')),
+                Prefetch('app__group__apps', queryset=MicroApp.objects.only('id', 'group_id')),
+            )
+        }
+        for _action in ['list', 'retrieve']
+    }
+    query_budget = {'list': 4, 'retrieve': 3, 'create': 11, 'update': 13}
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return AppInfoListSerializers
         return AppInfoSerializers
 
+    def extend_filter(self, queryset):
+        """
+        按成员索引查询用户管理的应用服务
+
+        ### 查询参数:
+            member: 用户ID， me 为当前用户
+        """
+        member = self.request.query_params.get('member', None)
+        if not member:
+            return queryset
+        if member == 'me':
+            member = self.request.user.id
+        elif not member.isdigit():
+            return queryset.none()
+        return queryset.filter(id__in=AppInfoMember.objects.filter(user_id=member).values('appinfo_id'))
+
     def create(self, request, *args, **kwargs):
         request.data['uniq_tag'] = 'default'
         return super().create(request, *args, **kwargs)
+
+    def prepare_bulk_create_item(self, item):
+        if isinstance(item, dict):
+            item['uniq_tag'] = 'default'
+        return super().prepare_bulk_create_item(item)
+
+    @staticmethod
+    def bulk_save_kubernetes(instances, serializers, is_update=False):
+        """
+        批量写入服务关联的k8s集群， 同 AppInfoSerializers.perform_extend_save
+        """
+        changed = [(instance, serializer.initial_data['kubernetes']) for instance, serializer in zip(instances, serializers)
+                   if serializer.initial_data.get('kubernetes', None) is not None]
+        if is_update:
+            KubernetesDeploy.objects.filter(
+                appinfo__in=[i[0] for i in changed]).delete()
+        KubernetesDeploy.objects.bulk_create([KubernetesDeploy(appinfo=instance, kubernetes_id=kid)
+                                              for instance, kubernetes in changed for kid in kubernetes],
+                                             ignore_conflicts=True)
+
+    def perform_bulk_create(self, serializers):
+        instances = self.bulk_save(serializers)
+        self.bulk_save_kubernetes(instances, serializers)
+        AppInfo.sync_members(instances)
+        return instances
+
+    def perform_bulk_update(self, serializers):
+        instances = self.bulk_save(serializers)
+        self.bulk_save_kubernetes(instances, serializers, is_update=True)
+        AppInfo.sync_members(instances)
+        return instances
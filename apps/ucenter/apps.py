@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UcenterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ucenter'
+
+    def ready(self):
+        from ucenter import signals  # noqa
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   rebuild_feishu_openid.py
+@time    :   2026/10/18 11:40
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ucenter.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = '按 extra_data 重建用户飞书OpenID索引， 升级后执行一次， 否则用户部门领导为空'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = UserProfile.rebuild_feishu_openid()
+        self.stdout.write(self.style.SUCCESS(f'已更新 {count} 个用户飞书OpenID.'))
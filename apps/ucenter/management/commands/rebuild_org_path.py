@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   rebuild_org_path.py
+@time    :   2026/10/18 10:10
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ucenter.models import Organization
+
+
+class Command(BaseCommand):
+    help = '重建部门层级路径， 升级后执行一次'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = Organization.rebuild_path()
+        self.stdout.write(self.style.SUCCESS(f'已更新 {count} 个部门层级路径.'))
@@ -9,12 +9,19 @@
 
 # here put the import lib
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import AbstractUser
 
 from common.extends.models import TimeAbstract, CommonParent
 
 # Create your models here.
 
+# 菜单版本key， 菜单或角色菜单关系变更时递增(signals)
+MENU_VERSION_KEY = 'ucenter:menu:version'
+# 登录默认绑定角色缓存， 缓存角色ID(不存在时为0)， 角色变更时清除(signals)
+DEFAULT_ROLE_CACHE_KEY = 'ucenter:role:default'
+
 
 def org_extra_data():
     return {
@@ -136,6 +143,9 @@ class Organization(TimeAbstract, CommonParent):
         max_length=20, choices=organization_type_choices, default='department', verbose_name='类型')
     extra_data = models.JSONField(
         default=org_extra_data, verbose_name='其它数据', help_text=f'数据格式：{org_extra_data()}')
+    # 物化路径: /根部门ID/.../当前部门ID/， 由save维护
+    path = models.CharField(max_length=255, default='', blank=True, db_index=True, editable=False,
+                            verbose_name='层级路径')
 
     @property
     def full(self):
@@ -143,13 +153,105 @@ class Organization(TimeAbstract, CommonParent):
         self.get_parents(l)
         return l
 
+    @property
+    def path_ids(self):
+        return [int(i) for i in self.path.strip('/').split('/') if i]
+
     def get_parents(self, parent_result: list):
+        if not self.path:
+            # 未生成层级路径， 逐级向上查找
+            if not parent_result:
+                parent_result.append(self)
+            parent_obj = self.parent
+            if parent_obj:
+                parent_result.append(parent_obj)
+                parent_obj.get_parents(parent_result)
+            return
         if not parent_result:
             parent_result.append(self)
-        parent_obj = self.parent
-        if parent_obj:
-            parent_result.append(parent_obj)
-            parent_obj.get_parents(parent_result)
+        parent_result.extend(self.get_ancestors())
+
+    def get_ancestors(self):
+        """
+        获取所有上级部门， 由近及远
+        """
+        ids = self.path_ids[:-1]
+        if not ids:
+            return []
+        parents = {i.id: i for i in Organization.objects.filter(id__in=ids)}
+        return [parents[i] for i in reversed(ids) if i in parents]
+
+    def get_descendants(self, include_self=True):
+        """
+        获取所有下级部门
+        """
+        if self.path:
+            qs = Organization.objects.filter(path__startswith=self.path)
+        else:
+            # 未生成层级路径(需执行 rebuild_org_path)， 逐级向下查找， 避免空前缀匹配所有部门
+            ids, level = {self.pk}, [self.pk]
+            while level:
+                level = list(Organization.objects.filter(parent_id__in=level).exclude(
+                    pk__in=ids).values_list('id', flat=True))
+                ids.update(level)
+            qs = Organization.objects.filter(pk__in=ids)
+        if not include_self:
+            qs = qs.exclude(pk=self.pk)
+        return qs
+
+    def get_users(self):
+        """
+        获取部门及所有下级部门的用户
+        """
+        if not self.path:
+            return UserProfile.objects.filter(department__in=self.get_descendants()).distinct()
+        return UserProfile.objects.filter(department__path__startswith=self.path).distinct()
+
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        parent_path = '/'
+        if self.parent_id:
+            # 从数据库读取， 避免内存中的上级部门路径已过期
+            parent_path = Organization.objects.filter(
+                pk=self.parent_id).values_list('path', flat=True).first() or '/'
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError('不能将部门移动到其下级部门.')
+        super().save(*args, **kwargs)
+        path = f'{parent_path}{self.pk}/'
+        if path == old_path:
+            return
+        Organization.objects.filter(pk=self.pk).update(path=path)
+        if old_path:
+            # 部门移动， 同步更新所有下级部门路径
+            Organization.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(path), Substr('path', len(old_path) + 1)))
+        self.path = path
+
+    @classmethod
+    def rebuild_path(cls):
+        """
+        重建所有部门层级路径， 用于历史数据
+        """
+        orgs = {i.id: i for i in cls.objects.only('id', 'parent_id', 'path')}
+        paths = {}
+
+        def get_path(org, seen=()):
+            if org.id not in paths:
+                parent = orgs.get(org.parent_id)
+                if parent is None or parent.id in seen:
+                    paths[org.id] = f'/{org.id}/'
+                else:
+                    paths[org.id] = f'{get_path(parent, seen + (org.id, ))}{org.id}/'
+            return paths[org.id]
+
+        changed = []
+        for org in orgs.values():
+            path = get_path(org)
+            if org.path != path:
+                org.path = path
+                changed.append(org)
+        cls.objects.bulk_update(changed, ['path'], batch_size=500)
+        return len(changed)
 
     def __str__(self):
         return self.name
@@ -185,6 +287,9 @@ class UserProfile(TimeAbstract, AbstractUser):
     extra_data = models.JSONField(
         default=user_extra_data, verbose_name='其它数据', help_text=f'数据格式：{user_extra_data()}')
     is_ldap = models.BooleanField(default=False, verbose_name='是否ldap用户')
+    # 冗余 extra_data.feishu_openid， 用于按部门领导批量查询用户， 由save维护
+    feishu_openid = models.CharField(max_length=64, null=True, blank=True, db_index=True, editable=False,
+                                     verbose_name='飞书OpenID')
 
     @property
     def nickname(self):
@@ -193,7 +298,28 @@ class UserProfile(TimeAbstract, AbstractUser):
         return self.username
 
     def __str__(self):
-        return self.name
+        return self.nickname
+
+    def save(self, *args, **kwargs):
+        self.feishu_openid = (self.extra_data or {}).get('feishu_openid', None) or None
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is not None and 'extra_data' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'feishu_openid'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def rebuild_feishu_openid(cls):
+        """
+        按 extra_data 重建飞书OpenID， 用于历史数据
+        """
+        changed = []
+        for user in cls.objects.only('id', 'extra_data', 'feishu_openid'):
+            openid = (user.extra_data or {}).get('feishu_openid', None) or None
+            if user.feishu_openid != openid:
+                user.feishu_openid = openid
+                changed.append(user)
+        cls.objects.bulk_update(changed, ['feishu_openid'], batch_size=500)
+        return len(changed)
 
     class ExtMeta:
         related = True
@@ -13,7 +13,8 @@ from rest_framework.utils import model_meta
 
 from ucenter.models import Menu, Permission, Role, Organization, UserProfile, DataDict
 
-from common.recursive import RecursiveField
+from common.recursive import RecursiveField, prefetch_tree
+from common.extends.serializers import BulkPrimaryKeyRelatedField
 
 import json
 
@@ -128,20 +129,51 @@ class PermissionSerializers(serializers.ModelSerializer):
         fields = '__all__'
 
 
+def prefetch_role_menus(instances):
+    """
+    批量加载角色菜单的下级菜单， 整页数据只查询一次(菜单需预加载)
+    """
+    prefetch_tree([menu for instance in instances for menu in instance.menus.all()])
+
+
+class RoleListBatchSerializers(serializers.ListSerializer):
+    """
+    角色列表批量序列化， 预先按整页数据加载下级菜单
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if hasattr(data, 'all') else data
+        iterable = list(iterable)
+        prefetch_role_menus(iterable)
+        self.context['role_menus_prefetched'] = True
+        return super().to_representation(iterable)
+
+
 class RoleListSerializers(serializers.ModelSerializer):
+    """
+    需配合预加载使用: prefetch menus/permissions
+    """
     menus = MenuListSerializers(many=True)
     permissions = PermissionSerializers(many=True)
 
+    def to_representation(self, instance):
+        if not self.context.get('role_menus_prefetched', False):
+            # 单条数据序列化
+            prefetch_role_menus([instance])
+        return super().to_representation(instance)
+
     class Meta:
         model = Role
         fields = ['id', 'name', 'desc', 'menus', 'permissions']
+        list_serializer_class = RoleListBatchSerializers
 
 
 class RoleSerializers(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
     role_menus = serializers.SerializerMethodField()
 
     def get_role_menus(self, instance):
-        qs = instance.menus.filter(parent__isnull=True)
+        qs = prefetch_tree(instance.menus.filter(parent__isnull=True))
         serializer = MenuListSerializers(instance=qs, many=True)
         return serializer.data
 
@@ -164,10 +196,39 @@ class OrganizationSerializers(serializers.ModelSerializer):
 
     class Meta:
         model = Organization
-        fields = '__all__'
+        exclude = ('path', )
+
+
+def get_leaders_map(instances):
+    """
+    批量获取用户所在部门的领导， 整页数据只查询一次(部门需预加载)
+
+    :return: {feishu_openid: user}
+    """
+    openids = {i.extra_data['leader_user_id'] for instance in instances for i in instance.department.all()
+               if (i.extra_data or {}).get('leader_user_id', None)}
+    if not openids:
+        return {}
+    return {i.feishu_openid: i for i in UserProfile.objects.filter(feishu_openid__in=openids).only(
+        'id', 'username', 'first_name', 'feishu_openid')}
+
+
+class UserProfileListBatchSerializers(serializers.ListSerializer):
+    """
+    用户列表批量序列化， 预先按整页数据加载部门领导
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if hasattr(data, 'all') else data
+        iterable = list(iterable)
+        self.context['leaders_map'] = get_leaders_map(iterable)
+        return super().to_representation(iterable)
 
 
 class UserProfileListSerializers(serializers.ModelSerializer):
+    """
+    需配合预加载使用: prefetch department
+    """
     user_department = serializers.SerializerMethodField()
     user_director = serializers.SerializerMethodField()
 
@@ -175,15 +236,20 @@ class UserProfileListSerializers(serializers.ModelSerializer):
         return [{'org_id': i.id, 'org_name': i.name} for i in instance.department.all()]
 
     def get_user_director(self, instance):
-        leader_ou = [i.extra_data['leader_user_id'] for i in instance.department.all(
-        ) if i.extra_data.get('leader_user_id', None)]
-        leaders = UserProfile.objects.filter(
-            extra_data__feishu_openid__in=leader_ou)
-        return [[{'id': i.id, 'name': i.name} for i in leaders]]
+        leaders_map = self.context.get('leaders_map', None)
+        if leaders_map is None:
+            # 单条数据序列化
+            leaders_map = get_leaders_map([instance])
+        leader_ou = {i.extra_data['leader_user_id'] for i in instance.department.all(
+        ) if (i.extra_data or {}).get('leader_user_id', None)}
+        leaders = sorted({leaders_map[i].id: leaders_map[i] for i in leader_ou if i in leaders_map}.values(),
+                         key=lambda i: i.id)
+        return [[{'id': i.id, 'name': i.nickname} for i in leaders]]
 
     class Meta:
         model = UserProfile
-        exclude = ('password', )
+        exclude = ('password', 'feishu_openid')
+        list_serializer_class = UserProfileListBatchSerializers
 
 
 class UserProfileDetailSerializers(UserProfileListSerializers):
@@ -198,11 +264,15 @@ class UserProfileDetailSerializers(UserProfileListSerializers):
             return []
 
     def get_permissions(self, instance):
+        if instance.is_superuser:
+            return ['admin']
+        if 'roles' in getattr(instance, '_prefetched_objects_cache', {}):
+            # 列表预加载了 roles__permissions
+            perms = {p.method: None for i in instance.roles.all() for p in i.permissions.all()}
+            return [p for p in perms if p]
         perms = instance.roles.values(
             'permissions__method',
         ).distinct()
-        if instance.is_superuser:
-            return ['admin']
         return [p['permissions__method'] for p in perms if p['permissions__method']]
 
 
@@ -233,14 +303,15 @@ class UserProfileMenuSerializers(serializers.ModelSerializer):
 
     class Meta:
         model = UserProfile
-        exclude = ('avatar',)
+        exclude = ('avatar', 'feishu_openid')
 
 
 class UserProfileSerializers(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
 
     class Meta:
         model = UserProfile
-        exclude = ('avatar',)
+        exclude = ('avatar', 'feishu_openid')
 
     def create(self, validated_data):
         roles = validated_data.pop('roles')
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   signals.py
+@time    :   2026/10/17 10:12
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.core.cache import cache
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from ucenter.models import Permission, Role, UserProfile, Organization, Menu, MENU_VERSION_KEY, \
+    DEFAULT_ROLE_CACHE_KEY
+
+from common.extends.cache import bump_cache_version
+from common.extends.permissions import bump_permission_version
+from common.extends.jwt_auth import bump_user_version
+
+
+@receiver([post_save, post_delete], sender=Permission)
+@receiver([post_save, post_delete], sender=Role)
+def permission_changed(sender, **kwargs):
+    """
+    权限/角色变更， 刷新用户权限缓存
+    """
+    bump_permission_version()
+
+
+@receiver([post_save, post_delete], sender=Role)
+def role_changed(sender, **kwargs):
+    """
+    角色变更， 清除默认角色缓存
+    """
+    cache.delete(DEFAULT_ROLE_CACHE_KEY)
+
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+@receiver(m2m_changed, sender=UserProfile.roles.through)
+def role_relation_changed(sender, action, pk_set=None, **kwargs):
+    """
+    角色权限、用户角色关系变更， 刷新用户权限缓存
+    """
+    if action == 'post_clear' or (action in ('post_add', 'post_remove') and pk_set):
+        # add/remove 未实际变更关系时(pk_set为空)不刷新， 如登录时绑定已有的默认角色
+        bump_permission_version()
+
+
+@receiver(m2m_changed, sender=UserProfile.roles.through)
+def user_role_changed(sender, instance, action, reverse, pk_set=None, **kwargs):
+    """
+    用户角色变更， 刷新认证用户缓存
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        if action == 'pre_clear' or pk_set:
+            bump_user_version(instance.pk)
+        return
+    # role.user_role.add/remove/clear
+    user_ids = pk_set if action != 'pre_clear' else instance.user_role.values_list('id', flat=True)
+    for user_id in user_ids or []:
+        bump_user_version(user_id)
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    """
+    用户信息变更(禁用、重置密码等)， 刷新认证用户缓存
+    """
+    if update_fields and set(update_fields) == {'last_login'}:
+        # 登录更新最后登录时间， 无需刷新
+        return
+    bump_user_version(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Menu)
+def menu_changed(sender, **kwargs):
+    """
+    菜单变更， 刷新用户路由缓存
+    """
+    bump_cache_version(MENU_VERSION_KEY)
+
+
+@receiver(m2m_changed, sender=Role.menus.through)
+def role_menu_changed(sender, action, pk_set=None, **kwargs):
+    """
+    角色菜单关系变更， 刷新用户路由缓存
+    """
+    if action == 'post_clear' or (action in ('post_add', 'post_remove') and pk_set):
+        bump_cache_version(MENU_VERSION_KEY)
+
+
+@receiver(post_delete, sender=Organization)
+def organization_deleted(sender, instance, **kwargs):
+    """
+    删除部门后， 下级部门(parent已置空)成为根部门， 同步更新层级路径
+    """
+    if instance.path:
+        Organization.objects.filter(path__startswith=instance.path).update(
+            path=Concat(Value('/'), Substr('path', len(instance.path) + 1)))
@@ -1,3 +1,846 @@
+import json
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from ucenter.models import UserProfile, Organization, Role, Permission, Menu, MENU_VERSION_KEY
+from common.extends.middleware import PerformanceMiddleware, get_request_metrics
+from common.extends.metrics import REGISTRY
+from common.extends import jwt_auth
+from common.extends.jwt_auth import JWTAuthentication, AccessToken, RefreshToken, TokenRefreshSerializer, \
+    api_settings, revoke_token, revoke_user_tokens, is_token_revoked
+from common.extends.permissions import get_user_permission, get_url_whitelist, UrlWhitelist, \
+    RbacPermission
+from common.testing import QueryBudgetTestMixin
+from ucenter.views import UserViewSet, MenuViewSet, OrganizationViewSet
+from ucenter.serializers import RoleSerializers, MenuSerializers, MenuListSerializers, PermissionSerializers, \
+    UserProfileSerializers, UserProfileListSerializers, UserProfileDetailSerializers
+from common.extends.cache import get_cache_version, bump_cache_version
+from common.extends.db import _use_replica
+from devops_backend.urls import router
+from config import PLATFORM_CONFIG
 
 # Create your tests here.
+
+
+class UserDirectorTestCase(TestCase):
+    """
+    用户列表部门领导批量查询
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        cls.leaders = [UserProfile.objects.create(username=f'leader{i}', first_name=f'领导{i}',
+                                                  extra_data={'feishu_openid': f'ou_{i}'}) for i in range(2)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_users(self, count):
+        start = Organization.objects.count()
+        for i in range(start, start + count):
+            org = Organization.objects.create(
+                dept_id=f'dept{i}', name=f'dept{i}', extra_data={'leader_user_id': f'ou_{i % 2}'})
+            UserProfile.objects.create(
+                username=f'user{i}').department.add(org)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()['data']
+
+    def test_feishu_openid(self):
+        leader = self.leaders[0]
+        self.assertEqual(leader.feishu_openid, 'ou_0')
+        leader.extra_data['feishu_openid'] = 'ou_x'
+        leader.save(update_fields=['extra_data'])
+        self.assertTrue(UserProfile.objects.filter(
+            id=leader.id, feishu_openid='ou_x').exists())
+        UserProfile.objects.filter(id=leader.id).update(feishu_openid=None)
+        self.assertEqual(UserProfile.rebuild_feishu_openid(), 1)
+        UserProfile.objects.update(feishu_openid=None)
+        call_command('rebuild_feishu_openid', stdout=StringIO())
+        self.assertTrue(UserProfile.objects.filter(
+            id=leader.id, feishu_openid='ou_x').exists())
+
+    def test_list_query_count(self):
+        self.create_users(2)
+        small, data = self.count_queries('/api/users/?page_size=1000')
+        user = [i for i in data['list'] if i['username'] == 'user1'][0]
+        self.assertEqual(user['user_director'], [
+                         [{'id': self.leaders[1].id, 'name': '领导1'}]])
+        self.assertNotIn('feishu_openid', user)
+        self.create_users(50)
+        large, data = self.count_queries('/api/users/?page_size=1000')
+        self.assertEqual(len(data['list']), 55)
+        self.assertEqual(small, large)
+
+    def test_retrieve(self):
+        self.create_users(1)
+        user = UserProfile.objects.get(username='user0')
+        _, data = self.count_queries(f'/api/users/{user.id}/')
+        self.assertEqual(data['user_director'], [
+                         [{'id': self.leaders[0].id, 'name': '领导0'}]])
+
+
+class PerformanceMiddlewareTestCase(TestCase):
+    """
+    请求性能统计
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/users/'))
+
+    @mock.patch.object(PerformanceMiddleware, 'server_timing', True)
+    def test_server_timing(self):
+        response = self.client.get('/api/users/')
+        timing = dict(i.split(';', 1) for i in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'total', 'db', 'permission', 'serializer'})
+        self.assertIn('queries', timing['db'])
+
+    @mock.patch.object(PerformanceMiddleware, 'slow_threshold', 0.001)
+    def test_slow_request(self):
+        with self.assertLogs('common.extends.middleware', level='WARNING') as logs:
+            self.client.get('/api/users/')
+        self.assertIn('[UserViewSet.list]', logs.output[0])
+
+    @mock.patch.object(PerformanceMiddleware, 'server_timing', True)
+    def test_streaming(self):
+        for i in range(3):
+            UserProfile.objects.create(username=f'user{i}')
+        with mock.patch('common.extends.middleware.observe_request') as observe:
+            response = self.client.get('/api/users/?get_all=1&stream=ndjson')
+            self.assertTrue(response.streaming)
+            self.assertNotIn('Server-Timing', response)
+            observe.assert_not_called()
+            with CaptureQueriesContext(connection) as context:
+                lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(context.captured_queries)
+        observe.assert_called_once()
+        metrics = observe.call_args[0][2]
+        self.assertEqual(metrics.label, 'UserViewSet.list')
+        # 包含输出数据时执行的SQL
+        self.assertGreaterEqual(metrics.db_count, len(context.captured_queries))
+        self.assertIsNone(get_request_metrics())
+
+
+@mock.patch('common.extends.metrics.METRICS_TOKEN', 'secret')
+@mock.patch('common.extends.metrics.METRICS_ENABLED', True)
+class MetricsTestCase(TestCase):
+    """
+    Prometheus 指标
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_request_metrics(self):
+        labels = {'view': 'UserViewSet', 'action': 'list', 'method': 'GET'}
+        before = REGISTRY.get_sample_value('ydevops_request_duration_seconds_count', labels) or 0
+        self.client.get('/api/users/')
+        self.assertEqual(REGISTRY.get_sample_value(
+            'ydevops_request_duration_seconds_count', labels), before + 1)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode('utf-8')
+        self.assertIn('ydevops_request_queries_bucket{action="list"', content)
+        self.assertIn('ydevops_response_size_bytes_count{action="list",view="UserViewSet"}', content)
+
+    def test_cache_metrics(self):
+        user = UserProfile.objects.create(username='user')
+        labels = {'cache': 'rbac_permission', 'result': 'hit'}
+        before = REGISTRY.get_sample_value('ydevops_cache_requests_total', labels) or 0
+        get_user_permission(user)
+        get_user_permission(UserProfile.objects.get(id=user.id))
+        self.assertEqual(REGISTRY.get_sample_value(
+            'ydevops_cache_requests_total', labels), before + 1)
+
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other').status_code, 401)
+        with mock.patch('common.extends.metrics.METRICS_TOKEN', ''):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with mock.patch('common.extends.metrics.METRICS_ENABLED', False):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 404)
+
+
+class UserSyncTestCase(TestCase):
+    """
+    用户同步任务锁
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(UserProfile.objects.create(username='admin', is_superuser=True))
+
+    def test_sync_lock(self):
+        response = self.client.post('/api/users/sync/', {'sync': 1}, format='json')
+        self.assertEqual(response.json()['code'], 20000)
+        response = self.client.post('/api/users/sync/', {'sync': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['code'], 40300)
+
+
+class AuthUserCacheTestCase(TestCase):
+    """
+    认证用户缓存， 用户禁用、重置密码、角色变更后立即失效
+    """
+
+    def setUp(self):
+        cache.clear()
+        jwt_auth._user_cache.clear()
+        self.user = UserProfile.objects.create(username='user', extra_data={'feishu_openid': 'ou_0'})
+        self.token = AccessToken.for_user(self.user)
+
+    def get_user(self):
+        return JWTAuthentication().get_user(self.token)
+
+    def test_cached_copy(self):
+        user = self.get_user()
+        with self.assertNumQueries(0):
+            cached = self.get_user()
+        self.assertEqual(cached.pk, self.user.pk)
+        self.assertIsNot(cached._state, user._state)
+        self.assertFalse(cached._state.adding)
+        cached.extra_data['feishu_openid'] = 'ou_x'
+        self.assertEqual(self.get_user().extra_data['feishu_openid'], 'ou_0')
+
+    def test_deactivate(self):
+        self.get_user()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user()
+
+    def test_password_reset(self):
+        self.get_user()
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertTrue(self.get_user().check_password('new-password'))
+
+    def test_role_changed(self):
+        self.get_user()
+        self.user.roles.add(Role.objects.create(name='测试角色'))
+        with self.assertNumQueries(1):
+            self.get_user()
+
+
+class ReadReplicaTestCase(TestCase):
+    """
+    只读从库仅用于 list/retrieve 处理， 认证及权限查询使用主库
+    """
+
+    def setUp(self):
+        cache.clear()
+        jwt_auth._user_cache.clear()
+        self.user = UserProfile.objects.create(username='admin', is_superuser=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_replica_scope(self):
+        states = []
+        get_user = JWTAuthentication.get_user
+        check_permissions = UserViewSet.check_permissions
+        filter_queryset = UserViewSet.filter_queryset
+
+        def record(name, func):
+            def wrapper(*args, **kwargs):
+                states.append((name, _use_replica.get()))
+                return func(*args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(JWTAuthentication, 'get_user', record('auth', get_user)), \
+                mock.patch.object(UserViewSet, 'check_permissions', record('permission', check_permissions)), \
+                mock.patch.object(UserViewSet, 'filter_queryset', record('list', filter_queryset)):
+            response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(states, [('auth', False), ('permission', False), ('list', True)])
+        self.assertFalse(_use_replica.get())
+
+
+class LoginTestCase(TestCase):
+    """
+    登录失败锁定及最后登录时间批量写入
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create(username='user')
+        self.user.set_password('ydevops')
+        self.user.save()
+        self.client = APIClient()
+        # 默认同步写入， 不启动后台线程
+        patcher = mock.patch.object(jwt_auth, 'last_login_buffer', jwt_auth.LastLoginBuffer(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, password):
+        return self.client.post('/api/user/login/', {'username': 'user', 'password': password}, format='json')
+
+    @mock.patch.object(jwt_auth, 'LOGIN_MAX_FAILURES', 3)
+    def test_lockout(self):
+        for i in range(3):
+            self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertEqual(jwt_auth.get_login_failures('user'), 3)
+        # 锁定期间不校验密码
+        with mock.patch.object(UserProfile, 'check_password') as check_password, \
+                self.assertLogs('ucenter.views', 'WARNING') as logs:
+            response = self.login('ydevops')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('登录失败次数过多', response.content.decode('utf-8'))
+        check_password.assert_not_called()
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertIsNone(logs.records[0].exc_info)
+        # 锁定过期后可登录
+        jwt_auth.clear_login_failures('user')
+        self.assertEqual(self.login('ydevops').json()['code'], 20000)
+
+    @mock.patch.object(jwt_auth, 'LOGIN_MAX_FAILURES', 3)
+    def test_reset_failures(self):
+        self.login('wrong')
+        self.login('wrong')
+        self.assertEqual(self.login('ydevops').json()['code'], 20000)
+        self.assertEqual(jwt_auth.get_login_failures('user'), 0)
+        self.login('wrong')
+        self.login('wrong')
+        self.assertEqual(self.login('ydevops').json()['code'], 20000)
+
+    def test_last_login_buffer(self):
+        buffer = jwt_auth.LastLoginBuffer(60)
+        with mock.patch.object(jwt_auth, 'last_login_buffer', buffer), \
+                mock.patch('common.extends.jwt_auth.threading.Thread') as thread:
+            self.assertEqual(self.login('ydevops').json()['code'], 20000)
+            self.assertEqual(self.login('ydevops').json()['code'], 20000)
+        thread.return_value.start.assert_called_once()
+        self.assertIsNone(UserProfile.objects.get(pk=self.user.pk).last_login)
+        # 同一用户多次登录只保留最后一次
+        last_login = buffer._pending[self.user.pk]
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(UserProfile.objects.get(pk=self.user.pk).last_login, last_login)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_last_login_sync(self):
+        jwt_auth.LastLoginBuffer(0).add(self.user)
+        self.assertIsNotNone(UserProfile.objects.get(pk=self.user.pk).last_login)
+
+
+class CacheVersionTestCase(TestCase):
+    """
+    缓存版本号
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lost_version(self):
+        version = get_cache_version('test:version')
+        self.assertEqual(get_cache_version('test:version'), version)
+        bump_cache_version('test:version')
+        bumped = get_cache_version('test:version')
+        self.assertEqual(bumped, version + 1)
+        # 版本key被淘汰后不会回退到已使用过的版本号
+        cache.delete('test:version')
+        self.assertNotIn(get_cache_version('test:version'), (1, version, bumped))
+        cache.delete('test:version')
+        bump_cache_version('test:version')
+        self.assertNotIn(get_cache_version('test:version'), (1, 2, version, bumped))
+
+    def test_max_entries(self):
+        # 超出默认的300条不淘汰已吊销的token
+        token = AccessToken.for_user(UserProfile.objects.create(username='user'))
+        revoke_token(token)
+        cache.set_many({f'test:entry:{i}': i for i in range(1000)})
+        self.assertTrue(is_token_revoked(token))
+
+
+class TokenRevokeTestCase(TestCase):
+    """
+    Token注销
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create(username='user')
+        self.user.roles.add(Role.objects.create(name='测试角色'))
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = self.refresh.access_token
+
+    def test_revoke_token(self):
+        self.assertFalse(is_token_revoked(self.access))
+        revoke_token(self.access)
+        self.assertTrue(is_token_revoked(self.access))
+        self.assertFalse(is_token_revoked(self.refresh))
+
+    def test_watermark(self):
+        # 水位线晚于签发时间
+        with mock.patch('common.extends.jwt_auth.time.time', return_value=self.access['iat'] + 1):
+            revoke_user_tokens(self.user.id)
+        self.assertTrue(is_token_revoked(self.access))
+        self.assertTrue(is_token_revoked(self.refresh))
+        self.assertFalse(is_token_revoked(AccessToken.for_user(UserProfile.objects.create(username='other'))))
+
+    @mock.patch.object(api_settings, 'ROTATE_REFRESH_TOKENS', True)
+    @mock.patch.object(api_settings, 'BLACKLIST_AFTER_ROTATION', True)
+    def test_refresh_rotation(self):
+        serializer = TokenRefreshSerializer(data={'refresh': str(self.refresh)})
+        self.assertTrue(serializer.is_valid())
+        self.assertNotEqual(serializer.validated_data['refresh'], str(self.refresh))
+        with self.assertRaises(TokenError):
+            TokenRefreshSerializer(data={'refresh': str(self.refresh)}).is_valid()
+
+    def test_logout(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        response = client.post('/api/user/logout/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(client.get('/api/users/').status_code, 401)
+        self.assertTrue(is_token_revoked(self.refresh))
+
+
+class CursorPaginationTestCase(TestCase):
+    """
+    游标分页
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        for i in range(4):
+            UserProfile.objects.create(username=f'user{i}', first_name=f'用户{i % 2}')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_pages(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()['data']
+            pages.append(data)
+            url = data['next']
+        return pages
+
+    def test_round_trip(self):
+        pages = self.get_pages('/api/users/?cursor=&page_size=2')
+        ids = [i['id'] for page in pages for i in page['list']]
+        # 按模型默认排序 id
+        self.assertEqual(ids, list(UserProfile.objects.order_by('id').values_list('id', flat=True)))
+        self.assertIsNone(pages[0]['total'])
+        # 上一页
+        response = self.client.get(pages[1]['previous'])
+        self.assertEqual([i['id'] for i in response.json()['data']['list']], ids[:2])
+
+    def test_ordering(self):
+        pages = self.get_pages('/api/users/?cursor=&page_size=2&ordering=first_name')
+        names = [i['first_name'] for page in pages for i in page['list']]
+        self.assertEqual(len(names), 5)
+        self.assertEqual(names, sorted(names))
+        # 可为空的字段与页码分页顺序一致
+        UserProfile.objects.filter(username__in=['user1', 'user2']).update(last_login=timezone.now())
+        pages = self.get_pages('/api/users/?cursor=&page_size=2&ordering=-last_login,-id')
+        response = self.client.get('/api/users/?page_size=100&ordering=-last_login,-id')
+        self.assertEqual([i['id'] for page in pages for i in page['list']],
+                         [i['id'] for i in response.json()['data']['list']])
+
+    def test_invalid_cursor(self):
+        for cursor in ('invalid', 'eyJwIjogW251bGxdfQ==', 'eyJwIjogWyJ4Il19'):
+            response = self.client.get(f'/api/users/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_with_total(self):
+        response = self.client.get('/api/users/?cursor=&page_size=2&with_total=1')
+        self.assertEqual(response.json()['data']['total'], 5)
+        response = self.client.get('/api/users/?cursor=&page_size=2&with_total=approx')
+        self.assertEqual(response.json()['data']['total'], 5)
+
+
+class MenuTreeTestCase(TestCase):
+    """
+    菜单树一次查询加载， 输出与逐节点查询一致
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(
+            username='admin', is_superuser=True)
+        for i in range(2):
+            root = Menu.objects.create(name=f'root{i}', title=f'根{i}', path=f'/root{i}')
+            for j in range(2):
+                child = Menu.objects.create(name=f'child{i}{j}', path=f'child{i}{j}', parent=root)
+                Menu.objects.create(name=f'leaf{i}{j}', path=f'leaf{i}{j}', sort=j, parent=child)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_same_output(self):
+        response = self.client.get('/api/menus/?page_size=100')
+        expected = MenuListSerializers(Menu.objects.filter(parent__isnull=True), many=True).data
+        self.assertEqual(self.render(response.json()['data']['list']), self.render(expected))
+        root = Menu.objects.get(name='root0')
+        response = self.client.get(f'/api/menus/{root.id}/')
+        self.assertEqual(self.render(response.json()['data']), self.render(MenuListSerializers(root).data))
+
+    def get_depth(self, nodes):
+        return 1 + max((self.get_depth(i['children']) for i in nodes if i['children']), default=0)
+
+    def test_max_depth(self):
+        response = self.client.get('/api/menus/?page_size=100')
+        self.assertEqual(self.get_depth(response.json()['data']['list']), 3)
+        response = self.client.get('/api/menus/?page_size=100&depth=1')
+        self.assertEqual(self.get_depth(response.json()['data']['list']), 2)
+        with mock.patch.object(MenuViewSet, 'tree_max_depth', 0):
+            response = self.client.get('/api/menus/?page_size=100')
+            self.assertEqual(self.get_depth(response.json()['data']['list']), 1)
+            # 请求参数优先
+            response = self.client.get('/api/menus/?page_size=100&depth=2')
+            self.assertEqual(self.get_depth(response.json()['data']['list']), 3)
+
+
+class UserMenuCacheTestCase(TestCase):
+    """
+    用户路由缓存及 ETag
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = Menu.objects.create(name='root', title='根', path='/root')
+        cls.role = Role.objects.create(name='测试角色')
+        cls.role.menus.add(cls.menu)
+        cls.user = UserProfile.objects.create(username='user')
+        cls.user.roles.add(cls.role)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_menus(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get('/api/user/profile/menus/', **headers)
+
+    def test_etag(self):
+        response = self.get_menus()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['code'], 20000)
+        etag = response['ETag']
+        response = self.get_menus(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get_menus(f'"other", W/{etag}').status_code, 304)
+        self.assertEqual(self.get_menus('"other"').status_code, 200)
+
+    def assertMenuChanged(self, change):
+        version = get_cache_version(MENU_VERSION_KEY)
+        etag = self.get_menus()['ETag']
+        change()
+        self.assertNotEqual(get_cache_version(MENU_VERSION_KEY), version)
+        response = self.get_menus(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response.json()['data']
+
+    def test_menu_changed(self):
+        def change():
+            self.menu.title = '新标题'
+            self.menu.save()
+        self.assertIn('新标题', json.dumps(self.assertMenuChanged(change), ensure_ascii=False))
+        self.assertMenuChanged(lambda: Menu.objects.create(name='other', path='/other'))
+        self.assertMenuChanged(lambda: Menu.objects.filter(name='other').delete())
+
+    def test_role_menus_changed(self):
+        menu = Menu.objects.create(name='other', path='/other')
+        self.assertMenuChanged(lambda: self.role.menus.add(menu))
+        self.assertMenuChanged(lambda: self.role.menus.remove(menu))
+        # 未实际变更关系时不递增
+        version = get_cache_version(MENU_VERSION_KEY)
+        self.role.menus.add(self.menu)
+        self.assertEqual(get_cache_version(MENU_VERSION_KEY), version)
+        self.assertMenuChanged(lambda: self.role.menus.clear())
+
+
+class ActionSerializerTestCase(TestCase):
+    """
+    按 action 获取 serializer_{action}_class
+    """
+
+    def get_serializer_class(self, viewset, action):
+        view = viewset(action=action, request=Request(APIRequestFactory().get('/')), format_kwarg=None)
+        return view.get_serializer().__class__
+
+    def test_action_serializers(self):
+        self.assertEqual(self.get_serializer_class(UserViewSet, 'list'), UserProfileListSerializers)
+        self.assertEqual(self.get_serializer_class(UserViewSet, 'detail_info'), UserProfileListSerializers)
+        self.assertEqual(self.get_serializer_class(UserViewSet, 'retrieve'), UserProfileDetailSerializers)
+        self.assertEqual(self.get_serializer_class(UserViewSet, 'create'), UserProfileSerializers)
+        self.assertEqual(self.get_serializer_class(MenuViewSet, 'retrieve'), MenuListSerializers)
+
+    def test_alias_and_inherit(self):
+        class TestViewSet(MenuViewSet):
+            serializer_update_class = PermissionSerializers
+
+        class ChildViewSet(TestViewSet):
+            serializer_list_class = None
+
+        self.assertEqual(self.get_serializer_class(TestViewSet, 'partial_update'), PermissionSerializers)
+        self.assertEqual(self.get_serializer_class(ChildViewSet, 'update'), PermissionSerializers)
+        # 子类置空后使用 serializer_class
+        self.assertEqual(self.get_serializer_class(ChildViewSet, 'list'), MenuSerializers)
+        self.assertEqual(self.get_serializer_class(MenuViewSet, 'list'), MenuListSerializers)
+
+    def test_organization_users(self):
+        # 部门用户使用 serializer_organization_users_class 输出用户数据
+        admin = UserProfile.objects.create(username='admin', is_superuser=True)
+        org = Organization.objects.create(dept_id='dept', name='部门')
+        UserProfile.objects.create(username='user', first_name='用户').department.add(org)
+        request = APIRequestFactory().get('/api/organization/users/', {'org_id': org.id})
+        force_authenticate(request, user=admin)
+        response = OrganizationViewSet.as_view({'get': 'organization_users'})(request)
+        self.assertEqual(response.status_code, 200)
+        users = response.data['data']['list']
+        self.assertEqual([i['username'] for i in users], ['user'])
+        self.assertEqual(users[0]['first_name'], '用户')
+
+
+class OrganizationPathTestCase(TestCase):
+    """
+    部门层级路径
+    """
+
+    def setUp(self):
+        self.root = Organization.objects.create(dept_id='root', name='root')
+        self.child = Organization.objects.create(dept_id='child', name='child', parent=self.root)
+        self.leaf = Organization.objects.create(dept_id='leaf', name='leaf', parent=self.child)
+        self.other = Organization.objects.create(dept_id='other', name='other')
+
+    def get_path(self, org):
+        return Organization.objects.get(pk=org.pk).path
+
+    def test_create(self):
+        self.assertEqual(self.get_path(self.leaf), f'/{self.root.id}/{self.child.id}/{self.leaf.id}/')
+        self.assertEqual([i.id for i in self.leaf.full], [self.leaf.id, self.child.id, self.root.id])
+        self.assertEqual(set(self.root.get_descendants(include_self=False)), {self.child, self.leaf})
+
+    def test_move(self):
+        self.child.parent = self.other
+        self.child.save()
+        self.assertEqual(self.get_path(self.leaf), f'/{self.other.id}/{self.child.id}/{self.leaf.id}/')
+        self.child.parent = self.leaf
+        with self.assertRaises(ValueError):
+            self.child.save()
+
+    def test_delete(self):
+        self.child.delete()
+        self.assertEqual(self.get_path(self.leaf), f'/{self.leaf.id}/')
+
+    def test_empty_path(self):
+        user = UserProfile.objects.create(username='leaf')
+        user.department.add(self.leaf)
+        UserProfile.objects.create(username='other').department.add(self.other)
+        Organization.objects.update(path='')
+        child = Organization.objects.get(pk=self.child.pk)
+        self.assertEqual(set(child.get_descendants()), {self.child, self.leaf})
+        self.assertEqual(list(child.get_users()), [user])
+        call_command('rebuild_org_path', stdout=StringIO())
+        self.assertEqual(self.get_path(self.leaf), f'/{self.root.id}/{self.child.id}/{self.leaf.id}/')
+
+
+class PermissionTestView(object):
+    perms_map = (
+        {'*': ('admin', '管理员')},
+        {'get': ('perm_test_list', '查看测试')},
+    )
+    action = 'list'
+
+
+class PermissionCacheTestCase(TestCase):
+    """
+    用户权限缓存， 角色、权限、用户角色变更后下一次请求生效
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.permission = Permission.objects.create(name='查看测试', method='perm_test_list')
+        cls.role = Role.objects.create(name='测试角色')
+        cls.role.permissions.add(cls.permission)
+        cls.user = UserProfile.objects.create(username='user')
+        cls.user.roles.add(cls.role)
+
+    def setUp(self):
+        # 测试回滚数据库但不回滚缓存
+        cache.clear()
+
+    def has_permission(self):
+        # 每次请求重新获取用户
+        request = Request(APIRequestFactory().get('/api/test/'))
+        request.user = UserProfile.objects.get(id=self.user.id)
+        return RbacPermission().has_permission(request, PermissionTestView())
+
+    def test_role_permission_changed(self):
+        self.assertTrue(self.has_permission())
+        self.role.permissions.remove(self.permission)
+        self.assertFalse(self.has_permission())
+        self.role.permissions.add(self.permission)
+        self.assertTrue(self.has_permission())
+
+    def test_permission_changed(self):
+        self.assertTrue(self.has_permission())
+        self.permission.method = 'perm_test_edit'
+        self.permission.save()
+        self.assertFalse(self.has_permission())
+
+    def test_user_role_changed(self):
+        self.assertTrue(self.has_permission())
+        self.user.roles.remove(self.role)
+        self.assertFalse(self.has_permission())
+        self.role.user_role.add(self.user)
+        self.assertTrue(self.has_permission())
+        self.role.delete()
+        self.assertFalse(self.has_permission())
+
+    def test_bulk_update(self):
+        client = APIClient()
+        client.force_authenticate(UserProfile.objects.create(username='admin', is_superuser=True))
+        self.role.menus.add(Menu.objects.create(name='test', title='测试', path='/test'))
+        self.assertTrue(self.has_permission())
+        menu_version = get_cache_version(MENU_VERSION_KEY)
+        response = client.put('/api/roles/bulk/', [{'id': self.role.id, 'name': self.role.name, 'permissions': [],
+                                                    'menus': []}], format='json')
+        self.assertEqual(response.json()['code'], 20000, response.content)
+        self.assertFalse(self.has_permission())
+        self.assertNotEqual(get_cache_version(MENU_VERSION_KEY), menu_version)
+
+
+class UrlWhitelistTestCase(TestCase):
+    """
+    URL白名单
+    """
+
+    def test_match(self):
+        whitelist = UrlWhitelist([
+            {'url': '/api/user/login/', 'match': 'exact'},
+            {'url': '/api/public/', 'match': 'prefix'},
+            {'url': '/api/hook/', 'match': 'prefix', 'methods': ['POST']},
+            {'url': '/callback/'},
+        ])
+        self.assertEqual(whitelist.match('get', '/api/user/login/'), '/api/user/login/')
+        self.assertIsNone(whitelist.match('get', '/api/user/login/x/'))
+        self.assertEqual(whitelist.match('put', '/api/public/1/'), '/api/public/')
+        self.assertIsNone(whitelist.match('get', '/api/v1/public/'))
+        self.assertEqual(whitelist.match('post', '/api/hook/gitlab/'), '/api/hook/')
+        self.assertIsNone(whitelist.match('get', '/api/hook/gitlab/'))
+        self.assertEqual(whitelist.match('get', '/api/cicd/callback/1/'), '/callback/')
+        with self.assertRaises(ValueError):
+            UrlWhitelist([{'url': '/api/', 'match': 'regex'}])
+
+    def test_reload(self):
+        with mock.patch.dict(PLATFORM_CONFIG, {'whitelist': [{'url': '/api/public/', 'match': 'prefix'}]}):
+            whitelist = get_url_whitelist()
+            self.assertIs(get_url_whitelist(), whitelist)
+            PLATFORM_CONFIG['whitelist'] = [{'url': '/api/open/', 'match': 'prefix'}]
+            self.assertIsNone(get_url_whitelist().match('get', '/api/public/1/'))
+            self.assertEqual(get_url_whitelist().match('get', '/api/open/1/'), '/api/open/')
+
+    def test_permission(self):
+        request = Request(APIRequestFactory().get('/api/users/'))
+        request.user = UserProfile.objects.create(username='user')
+        # 无权限用户且视图未配置 perms_map
+        self.assertFalse(RbacPermission().has_permission(request, None))
+        with mock.patch.dict(PLATFORM_CONFIG, {'whitelist': [{'url': '/api/users/', 'match': 'exact',
+                                                              'methods': ['get']}]}):
+            self.assertTrue(RbacPermission().has_permission(request, None))
+
+
+class BulkRelatedFieldTestCase(TestCase):
+    """
+    多对多主键批量校验
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.permissions = [Permission.objects.create(name=f'权限{i}', method=f'perm{i}') for i in range(5)]
+
+    def validate(self, permissions):
+        serializer = RoleSerializers(data={'name': '角色', 'permissions': permissions, 'menus': []})
+        return serializer.is_valid(), serializer
+
+    def test_validate(self):
+        ids = [i.id for i in reversed(self.permissions)]
+        with CaptureQueriesContext(connection) as context:
+            valid, serializer = self.validate(ids + [str(ids[0])])
+        self.assertTrue(valid, serializer.errors)
+        # 角色名唯一校验及权限各一次查询
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertEqual([i.id for i in serializer.validated_data['permissions']], ids + [ids[0]])
+
+    def test_errors(self):
+        missing = max(i.id for i in self.permissions) + 1
+        valid, serializer = self.validate([self.permissions[0].id, missing])
+        self.assertFalse(valid)
+        self.assertEqual(serializer.errors['permissions'][0].code, 'does_not_exist')
+        for value in ('abc', True, {'id': 1}):
+            valid, serializer = self.validate([self.permissions[0].id, value])
+            self.assertFalse(valid)
+            self.assertEqual(serializer.errors['permissions'][0].code, 'incorrect_type')
+        valid, serializer = self.validate(self.permissions[0].id)
+        self.assertEqual(serializer.errors['permissions'][0].code, 'not_a_list')
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """
+    用户中心视图查询次数预算
+    """
+    routers = ((router, '/api/'), )
+
+    def get_UserViewSet_payload(self, action, instance):
+        # UserProfileSerializers 仅处理部门及角色的多对多字段
+        data = self.get_default_payload(UserViewSet, action, instance)
+        data.pop('groups', None)
+        data.pop('user_permissions', None)
+        return data
+
+    def get_UserProfileViewSet_payload(self, action, instance):
+        if action == 'create':
+            return {'username': f'{instance.username}-c{self.counter}', 'password': 'ydevops',
+                    'department': [i.id for i in instance.department.all()], 'roles': []}
+        # 更新当前用户信息
+        return {'first_name': 'query-budget', 'mobile': '13800000000'}
@@ -15,7 +15,9 @@ import shortuuid
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework import pagination
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework import pagination, status
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.exceptions import TokenError
@@ -24,13 +26,17 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.db.models import Q
 from django.core.cache import cache
 from django.contrib.auth import logout
-from django.contrib.auth.models import update_last_login
 
-from ucenter.models import UserProfile, Menu, Role, Permission, Organization
+from ucenter.models import UserProfile, Menu, Role, Permission, Organization, MENU_VERSION_KEY, \
+    DEFAULT_ROLE_CACHE_KEY
 from ucenter.serializers import MenuSerializers, MenuListSerializers, PermissionSerializers, PermissionListSerializers, RoleSerializers, RoleListSerializers, OrganizationSerializers, UserProfileListSerializers, UserProfileDetailSerializers, UserProfileMenuSerializers, UserProfileSerializers
 
 from common.extends.viewsets import AutoModelViewSet, AutoModelParentViewSet, ops_response
-from common.extends.jwt_auth import TokenObtainPairSerializer, TokenRefreshSerializer, CustomInvalidToken
+from common.extends.permissions import get_user_permission
+from common.extends.cache import get_cache_version
+from common.extends.metrics import record_cache
+from common.extends.jwt_auth import TokenObtainPairSerializer, TokenRefreshSerializer, CustomInvalidToken, RefreshToken, \
+    revoke_token, revoke_user_tokens
 from config import USER_AUTH_BACKEND
 
 import logging
@@ -43,6 +49,21 @@ USER_SYNC_KEY = {
     'ldap': 'celery_job:ldap_user_sync',  # LDAP用户同步任务KEY
 }
 
+# 用户路由缓存， 按角色集合缓存
+USER_ROUTER_CACHE_KEY = 'ucenter:router:{roles}:{version}'
+USER_ROUTER_CACHE_TIMEOUT = 60 * 60 * 24
+# 登录默认绑定角色
+DEFAULT_ROLE_NAME = '默认角色'
+
+
+def get_default_role_id():
+    role_id = cache.get(DEFAULT_ROLE_CACHE_KEY)
+    if role_id is None:
+        role_id = Role.objects.filter(name=DEFAULT_ROLE_NAME).values_list(
+            'id', flat=True).first() or 0
+        cache.set(DEFAULT_ROLE_CACHE_KEY, role_id, timeout=None)
+    return role_id
+
 
 class MenuViewSet(AutoModelParentViewSet):
     """
@@ -66,6 +87,7 @@ class MenuViewSet(AutoModelParentViewSet):
         {'delete': ('menu_delete', '删除菜单')}
     )
     queryset = Menu.objects.all()
+    read_replica = True
     serializer_class = MenuSerializers
     serializer_list_class = MenuListSerializers
     serializer_retrieve_class = MenuListSerializers
@@ -74,6 +96,7 @@ class MenuViewSet(AutoModelParentViewSet):
     extra_columns = [{'id': 'parent', 'dataIndex': 'parent',
                       'title': '上级', 'type': 'related', 'required': False}]
     column_width = {'name': 140}
+    query_budget = {'list': 3, 'retrieve': 2, 'create': 3, 'update': 4}
 
 
 class PermissionViewSet(AutoModelParentViewSet):
@@ -120,6 +143,12 @@ class RoleViewSet(AutoModelViewSet):
     serializer_class = RoleSerializers
     serializer_list_class = RoleListSerializers
     serializer_retrieve_class = RoleListSerializers
+    # 下级菜单由 RoleListBatchSerializers 整页批量加载
+    eager_loading_by_action = {
+        _action: {'prefetch_related': ('menus', 'permissions')}
+        for _action in ['list', 'retrieve']
+    }
+    query_budget = {'list': 5, 'retrieve': 4, 'create': 14, 'update': 11}
 
     def perform_destroy(self, instance):
         if instance.name != '默认角色':
@@ -158,11 +187,7 @@ class OrganizationViewSet(AutoModelParentViewSet):
         return super().get_queryset()
 
     def get_org_users(self, org):
-        qs = org.org_user.all()
-        for i in org.children.all():
-            qs |= self.get_org_users(i)
-            # qs = qs.distinct()
-        return qs
+        return org.get_users()
 
     @action(methods=['GET'], url_path='users', detail=False)
     def organization_users(self, request, *args, **kwargs):
@@ -192,8 +217,16 @@ class UserViewSet(AutoModelViewSet):
     )
     queryset = UserProfile.objects.exclude(
         Q(username='thirdparty'))
+    read_replica = True
     serializer_class = UserProfileSerializers
     serializer_list_class = UserProfileListSerializers
+    serializer_detail_info_class = UserProfileListSerializers
+    # 多对多字段预加载， 部门领导由 UserProfileListBatchSerializers 整页批量查询
+    eager_loading_by_action = {
+        _action: {'prefetch_related': ('department', 'roles', 'groups', 'user_permissions')}
+        for _action in ['list', 'retrieve', 'detail_info']
+    }
+    query_budget = {'list': 7, 'retrieve': 6, 'create': 12, 'update': 10}
     filter_backends = (
         django_filters.rest_framework.DjangoFilterBackend, SearchFilter, OrderingFilter)
     filter_fields = {
@@ -236,6 +269,8 @@ class UserViewSet(AutoModelViewSet):
         # 禁用用户
         instance.is_active = not instance.is_active
         instance.save()
+        if not instance.is_active:
+            revoke_user_tokens(instance.id)
 
     @action(methods=['POST'], url_path='password/reset', detail=False)
     def password_reset(self, request):
@@ -253,6 +288,7 @@ class UserViewSet(AutoModelViewSet):
         pwd.update(data['password'].encode(encoding='utf-8'))
         user.set_password(pwd.hexdigest())
         user.save()
+        revoke_user_tokens(user.id)
         return ops_response('密码已更新.')
 
     @action(methods=['GET'], url_path='detail', detail=False)
@@ -273,15 +309,16 @@ class UserViewSet(AutoModelViewSet):
             sync: 1
         """
         sync = request.data.get('sync', 0)
-        is_job_exist = cache.get(USER_SYNC_KEY[USER_AUTH_BACKEND])
-        if is_job_exist:
-            return ops_response({}, success=False, errorCode=40300, errorMessage='已经有组织架构同步任务在运行中... 请稍后刷新页面查看')
-
         if sync:
             # 同步任务
             taskid = None
-            # 限制只能有一个同步任务在跑
-            cache.set(USER_SYNC_KEY[USER_AUTH_BACKEND], taskid, timeout=300)
+            # 限制只能有一个同步任务在跑， cache.add 为原子操作， 多个worker之间同样有效
+            is_job_exist = not cache.add(
+                USER_SYNC_KEY[USER_AUTH_BACKEND], taskid or 'running', timeout=300)
+        else:
+            is_job_exist = cache.get(USER_SYNC_KEY[USER_AUTH_BACKEND])
+        if is_job_exist:
+            return ops_response({}, code=40300, message='已经有组织架构同步任务在运行中... 请稍后刷新页面查看')
         return ops_response('正在同步组织架构信息...')
 
 
@@ -300,15 +337,18 @@ class UserAuthTokenView(TokenObtainPairView):
                 logger.exception(f'用户登录异常{serializer.errors}')
             else:
                 data = serializer.validated_data
-                # 用户登录成功,绑定默认角色并更新最后登录时间
-                user = UserProfile.objects.get(
-                    username=request.data['username'])
+                # 用户登录成功,绑定默认角色(最后登录时间由序列化器批量写入)
+                user = serializer.user
                 try:
-                    role = Role.objects.get(name='默认角色')
-                    user.roles.add(*[role.id])
+                    role_id = get_default_role_id()
+                    if role_id and role_id not in get_user_permission(user)['roles']:
+                        user.roles.add(role_id)
                 except BaseException as e:
                     logger.exception(f"绑定用户角色失败, 原因: {e}")
-                # update_last_login(None, user)
+        except AuthenticationFailed as e:
+            # 密码错误、登录锁定属于正常拒绝， 不记录异常堆栈
+            logger.warning(f"用户登录失败, 用户: {request.data.get('username')}, 原因: {e}")
+            raise CustomInvalidToken(e.args[0], code=40100)
         except BaseException as e:
             logger.exception(f"用户登录异常, 原因: {e}")
 
@@ -341,18 +381,30 @@ class UserLogout(APIView):
     用户注销视图
     """
     perms_map = ()
+    # 登录用户均可注销， 不校验RBAC权限
+    permission_classes = [IsAuthenticated]
+
+    def revoke(self, request):
+        """
+        撤销当前请求的access token， 以及请求参数中的refresh token
+        """
+        if request.auth is not None and hasattr(request.auth, 'payload'):
+            revoke_token(request.auth)
+        refresh = request.data.get('refresh', None) if hasattr(
+            request.data, 'get') else None
+        if refresh:
+            try:
+                revoke_token(RefreshToken(refresh))
+            except TokenError as e:
+                logger.debug(f'注销refresh token失败: {e}')
 
     def get(self, request, format=None):
-        # token.blacklist()
-        # # simply delete the token to force a login
-        # request.user.auth_token.delete()
+        self.revoke(request)
         logout(request)
         return ops_response('用户已退出')
 
     def post(self, request, format=None):
-        # token.blacklist()
-        # # simply delete the token to force a login
-        # request.user.auth_token.delete()
+        self.revoke(request)
         logout(request)
         return ops_response('用户已退出')
 
@@ -376,6 +428,11 @@ class UserProfileViewSet(AutoModelViewSet):
     )
     queryset = UserProfile.objects.exclude(
         username='thirdparty').order_by('id')
+    eager_loading_by_action = {
+        _action: {'prefetch_related': ('department', 'roles__permissions', 'groups', 'user_permissions')}
+        for _action in ['list', 'retrieve']
+    }
+    query_budget = {'list': 8, 'retrieve': 6, 'create': 11, 'update': 6}
     # authentication_classes = [JWTAuthentication, ]
     serializer_class = UserProfileDetailSerializers
     serializer_menus_class = UserProfileMenuSerializers
@@ -435,14 +492,33 @@ class UserProfileViewSet(AutoModelViewSet):
     def menus(self, request):
         """
         获取用户菜单
+
+        按角色集合缓存路由树， 支持 ETag/If-None-Match， 未变更返回304
         :param request:
         :return:
         """
-        serializer = self.get_serializer(request.user)
-        data = serializer.data
-        routers = data['routers']
-        routers = self.menu_sort(routers)
-        return ops_response(routers)
+        roles = sorted(get_user_permission(request.user)['roles'])
+        roles_key = ','.join(
+            str(i) for i in roles) if not request.user.is_superuser else 'admin'
+        version = get_cache_version(MENU_VERSION_KEY)
+        etag = '"%s"' % hashlib.md5(
+            f'{roles_key}:{version}'.encode('utf-8')).hexdigest()
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [i.strip().lstrip('W/') for i in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        cache_key = USER_ROUTER_CACHE_KEY.format(
+            roles=hashlib.md5(roles_key.encode('utf-8')).hexdigest(), version=version)
+        routers = cache.get(cache_key)
+        record_cache('menu', routers is not None)
+        if routers is None:
+            serializer = self.get_serializer(request.user)
+            data = serializer.data
+            routers = self.menu_sort(data['routers'])
+            cache.set(cache_key, routers, timeout=USER_ROUTER_CACHE_TIMEOUT)
+        response = ops_response(routers)
+        response['ETag'] = etag
+        return response
 
     @action(methods=['POST'], url_path='system/dict/invalid-hash', detail=False)
     def expired_hash(self, request):
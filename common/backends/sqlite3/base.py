@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   base.py
+@time    :   2026/10/17 18:05
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.db.backends.sqlite3.base import DatabaseWrapper as BaseDatabaseWrapper
+
+
+class DatabaseWrapper(BaseDatabaseWrapper):
+    """
+    SQLite 支持通过 OPTIONS 设置日志模式
+
+    OPTIONS: {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+    WAL 模式下读写互不阻塞， 适用于本地开发及多线程测试
+    """
+    pragma_options = ('journal_mode', 'synchronous')
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for key in self.pragma_options:
+            kwargs.pop(key, None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        options = self.settings_dict['OPTIONS']
+        for key in self.pragma_options:
+            if options.get(key):
+                conn.execute(f'PRAGMA {key} = {options[key]}')
+        return conn
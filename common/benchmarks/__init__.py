@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   __init__.py
+@time    :   2026/10/17 11:05
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from contextlib import contextmanager
+import os
+import statistics
+import time
+
+
+def setup_django():
+    """
+    初始化Django环境， 用于在项目根目录下直接执行基准测试
+    python -m common.benchmarks.xxx
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'devops_backend.settings')
+    os.environ.setdefault('DJANGO_TESTING', '1')
+    import django
+    django.setup()
+
+
+def bench(func, number=1000, repeat=5):
+    """
+    执行基准测试
+
+    :return: 单次调用耗时(微秒)的最优值
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        cost = (time.perf_counter() - start) / number * 1e6
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+def bench_latency(func, number=20):
+    """
+    多次执行， 返回耗时(毫秒)中位数
+    """
+    costs = []
+    for _ in range(number):
+        start = time.perf_counter()
+        func()
+        costs.append((time.perf_counter() - start) * 1000)
+    return statistics.median(costs)
+
+
+@contextmanager
+def test_database(name=None):
+    """
+    创建独立的测试数据库， 退出时销毁
+
+    :param name: 测试数据库名称， 多线程压测时SQLite需使用文件数据库
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    if name:
+        connection.settings_dict['TEST']['NAME'] = name
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
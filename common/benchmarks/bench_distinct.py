@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   bench_distinct.py
+@time    :   2026/10/17 16:40
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+import sys
+
+from common.benchmarks import setup_django, bench_latency, test_database
+
+setup_django()
+
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+
+from ucenter.models import UserProfile  # noqa: E402
+from cmdb.models import Product, Project, MicroApp  # noqa: E402
+from cmdb.views import MicroAppViewSet  # noqa: E402
+
+
+class LegacyMicroAppViewSet(MicroAppViewSet):
+    """
+    旧版本实现： 无条件 distinct
+    """
+
+    @staticmethod
+    def distinct_if_needed(queryset):
+        return queryset.distinct()
+
+
+def prepare(count):
+    user = UserProfile.objects.create(username='benchmark', is_superuser=True)
+    product = Product.objects.create(name='product')
+    project = Project.objects.create(
+        projectid='product.project', name='project', product=product)
+    template = {'strategy': {'replicas': 2, 'revisionHistoryLimit': 1},
+                'resources': {'limits': {'cpu': '1000m', 'memory': '2048Mi'}}}
+    MicroApp.objects.bulk_create([
+        MicroApp(appid=f'product.project.app{i}', name=f'app{i}', project=project, creator=user, template=template,
+                 repo={'name': f'app{i}', 'http_url_to_repo': f'https://git.example.com/app{i}.git'},
+                 notify={'robot': 'ops'}) for i in range(count)], batch_size=2000)
+    return user
+
+
+def main(count=50000, number=20):
+    with test_database():
+        user = prepare(count)
+        factory = APIRequestFactory()
+        for params in ('page_size=20', 'page_size=20&page=1000'):
+            for name, view_class in (('distinct', LegacyMicroAppViewSet), ('conditional', MicroAppViewSet)):
+                view = view_class.as_view({'get': 'list'})
+
+                def call():
+                    request = factory.get(f'/api/app/?{params}')
+                    force_authenticate(request, user)
+                    response = view(request)
+                    response.render()
+
+                cost = bench_latency(call, number=number)
+                print(f'{name:<12} {count} rows, {params:<24}: {cost:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   bench_endpoints.py
+@time    :   2026/10/17 22:40
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+import argparse
+import datetime
+import json
+import logging
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from common.benchmarks import setup_django, test_database
+
+setup_django()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from ucenter.models import UserProfile  # noqa: E402
+from devops_backend.urls import router as ucenter_router  # noqa: E402
+from cmdb.urls import router as cmdb_router  # noqa: E402
+from cmdb.management.commands.gen_cmdb_data import Command as GenerateCommand  # noqa: E402
+from common.testing import get_routes  # noqa: E402
+
+# 路由及其挂载的URL前缀
+ROUTERS = ((ucenter_router, '/api/'), (cmdb_router, '/api/'))
+
+
+def get_endpoints():
+    """
+    遍历路由注册的视图， 获取所有GET接口
+
+    :return: [(url, view, action)]
+    """
+    endpoints, pks = [], {}
+    for url, viewset, mapping, detail in get_routes(ROUTERS):
+        action = mapping.get('get')
+        if not action:
+            continue
+        lookup = ''
+        if detail:
+            if viewset not in pks:
+                obj = viewset.queryset.order_by('pk').first()
+                pks[viewset] = obj.pk if obj is not None else None
+            if pks[viewset] is None:
+                continue
+            lookup = pks[viewset]
+        endpoints.append((url.format(lookup=lookup), viewset.__name__, action))
+    return endpoints
+
+
+def run(client, url, params, number):
+    """
+    :return: 单个接口的测试结果
+    """
+    queries = []
+
+    def count_queries(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    # 预热
+    response = client.get(url, params)
+    with connection.execute_wrapper(count_queries):
+        client.get(url, params)
+    tracemalloc.start()
+    client.get(url, params)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    costs = []
+    for _ in range(number):
+        start = time.perf_counter()
+        client.get(url, params)
+        costs.append((time.perf_counter() - start) * 1000)
+    costs.sort()
+    return {
+        'status': response.status_code,
+        'p50_ms': round(statistics.median(costs), 3),
+        'p95_ms': round(costs[max(int(len(costs) * 0.95) - 1, 0)], 3),
+        'queries': len(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'size': len(response.content) if not response.streaming else None,
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    与上次的测试结果对比
+    """
+    with open(baseline) as f:
+        old = {i['url']: i for i in json.load(f)['results']}
+    print(f'\n{"endpoint":<48} {"p50 ms":>18} {"queries":>14}')
+    for i in results:
+        o = old.get(i['url'])
+        if o is None:
+            continue
+        print(f'{i["url"]:<48} {o["p50_ms"]:>8.2f} -> {i["p50_ms"]:<8.2f} {o["queries"]:>5} -> {i["queries"]:<5}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='接口性能基准测试')
+    for name, default, help_text in GenerateCommand.sizes:
+        parser.add_argument(f'--{name}', type=int, default=default, help=f'{help_text}， 默认{default}')
+    parser.add_argument('--number', type=int, default=20, help='每个接口的请求次数')
+    parser.add_argument('--page-size', type=int, default=20, help='列表接口分页大小')
+    parser.add_argument('--output', default='bench_endpoints.json', help='结果文件')
+    parser.add_argument('--compare', default=None, help='对比的历史结果文件')
+    args = parser.parse_args()
+
+    # 屏蔽慢请求等日志
+    logging.disable(logging.CRITICAL)
+    sizes = {name: getattr(args, name) for name, _, _ in GenerateCommand.sizes}
+    with test_database():
+        call_command('gen_cmdb_data', verbosity=0, **sizes)
+        # 接口异常时返回500， 不中断测试
+        client = APIClient(raise_request_exception=False)
+        client.force_authenticate(UserProfile.objects.create(username='benchmark', is_superuser=True))
+        results = []
+        for url, view, action in get_endpoints():
+            result = {'url': url, 'view': view, 'action': action,
+                      **run(client, url, {'page_size': args.page_size}, args.number)}
+            results.append(result)
+            print(f'{url:<48} {result["status"]} p50 {result["p50_ms"]:8.2f} ms  p95 {result["p95_ms"]:8.2f} ms  '
+                  f'{result["queries"]:4} queries  {result["peak_memory_kb"]:8.1f} KB')
+        data = {
+            'commit': get_commit(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'sizes': sizes,
+            'number': args.number,
+            'page_size': args.page_size,
+            'results': results,
+        }
+    with open(args.output, 'w') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    print(f'结果已写入 {args.output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   bench_get_serializer.py
+@time    :   2026/10/17 11:12
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from common.benchmarks import setup_django, bench
+
+setup_django()
+
+import inspect  # noqa: E402
+
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from ucenter.views import UserViewSet  # noqa: E402
+
+
+class LegacyUserViewSet(UserViewSet):
+    """
+    旧版本实现： 通过 inspect.stack() 获取调用方法名
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        call_func_name = inspect.stack()[1][3]
+        serializer_class = getattr(
+            self, f'serializer_{call_func_name}_class', None)
+        if not serializer_class:
+            serializer_class = self.get_serializer_class()
+        kwargs['context'] = self.get_serializer_context()
+        return serializer_class(*args, **kwargs)
+
+
+def make_view(view_class):
+    request = APIRequestFactory().get('/api/users/')
+    view = view_class(request=request, format_kwarg=None, action='list')
+    return view
+
+
+def deep_call(depth, func):
+    """
+    模拟DRF中间件/分发的调用栈深度
+    """
+    if depth == 0:
+        return func()
+    return deep_call(depth - 1, func)
+
+
+def list(view):
+    # 与 AutoModelViewSet.list 同名， 旧实现依赖调用方法名
+    return view.get_serializer(many=True)
+
+
+def main(depth=60, number=200):
+    for name, view_class in (('inspect.stack', LegacyUserViewSet), ('action', UserViewSet)):
+        view = make_view(view_class)
+        cost = bench(lambda: deep_call(depth, lambda: list(view)), number=number)
+        print(f'{name:<16} stack depth {depth}: {cost:10.1f} us/call')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   bench_login.py
+@time    :   2026/10/17 17:20
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from common.benchmarks import setup_django, test_database
+
+setup_django()
+
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.contrib.auth.models import update_last_login  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import close_old_connections  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer  # noqa: E402
+
+from ucenter.models import UserProfile, Role  # noqa: E402
+from ucenter.views import UserAuthTokenView  # noqa: E402
+from common.extends.jwt_auth import RefreshToken, last_login_buffer  # noqa: E402
+from common.extends.viewsets import ops_response  # noqa: E402
+
+PASSWORD = 'benchmark'
+
+
+class LegacyTokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    """
+    旧版本实现: 同步更新最后登录时间， 无失败计数
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        return RefreshToken.for_user(user)
+
+
+class LegacyUserAuthTokenView(UserAuthTokenView):
+    """
+    旧版本实现: 每次登录查询用户、默认角色
+    """
+    serializer_class = LegacyTokenObtainPairSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = UserProfile.objects.get(username=request.data['username'])
+        role = Role.objects.get(name='默认角色')
+        user.roles.add(*[role.id])
+        update_last_login(None, user)
+        return ops_response(serializer.validated_data)
+
+
+def prepare(count):
+    Role.objects.create(name='默认角色')
+    # 所有用户共用同一密码哈希， 避免准备数据时逐个计算
+    password = make_password(PASSWORD)
+    UserProfile.objects.bulk_create([
+        UserProfile(username=f'user{i}', password=password, is_active=True) for i in range(count)])
+
+
+def run(view, usernames, password, workers):
+    """
+    并发登录
+
+    :return: (每秒登录数, p50 ms, p95 ms)
+    """
+    factory = APIRequestFactory()
+
+    def login(username):
+        start = time.perf_counter()
+        request = factory.post('/api/user/login/', {'username': username, 'password': password}, format='json')
+        try:
+            view(request).render()
+        except BaseException:
+            pass
+        finally:
+            close_old_connections()
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        costs = sorted(executor.map(login, usernames))
+    total = time.perf_counter() - start
+    return len(usernames) / total, statistics.median(costs), costs[int(len(costs) * 0.95) - 1]
+
+
+def main(count=100, workers=8):
+    # 屏蔽登录失败日志
+    logging.disable(logging.CRITICAL)
+    with test_database(os.path.join(tempfile.gettempdir(), 'bench_login.sqlite3')):
+        prepare(count)
+        usernames = [f'user{i}' for i in range(count)]
+        cases = (
+            ('legacy', LegacyUserAuthTokenView.as_view(), usernames, PASSWORD),
+            ('pipeline', UserAuthTokenView.as_view(), usernames, PASSWORD),
+            # 第二轮登录: 默认角色已绑定
+            ('pipeline (2nd)', UserAuthTokenView.as_view(), usernames, PASSWORD),
+            # 暴力破解: 先耗尽失败次数， 再统计锁定后的拒绝耗时
+            ('brute force', UserAuthTokenView.as_view(), usernames[:10] * (count // 10), 'wrong'),
+        )
+        for name, view, _usernames, password in cases:
+            cache.clear()
+            if name == 'brute force':
+                run(view, usernames[:10] * 10, password, workers)
+            rate, p50, p95 = run(view, _usernames, password, workers)
+            print(f'{name:<16} {len(_usernames)} logins, {workers} workers: {rate:8.1f}/s  '
+                  f'p50 {p50:8.2f} ms  p95 {p95:8.2f} ms')
+        last_login_buffer.flush()
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   bench_whitelist.py
+@time    :   2026/10/17 23:50
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+import sys
+from types import SimpleNamespace
+
+from common.benchmarks import setup_django, bench
+
+setup_django()
+
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from common.extends.permissions import RbacPermission  # noqa: E402
+from config import PLATFORM_CONFIG  # noqa: E402
+
+
+class LegacyRbacPermission(RbacPermission):
+    """
+    旧版本实现： 每次请求读取配置并逐条做包含匹配
+    """
+
+    @classmethod
+    def check_whitelist(cls, request):
+        url_whitelist = PLATFORM_CONFIG['whitelist'] if PLATFORM_CONFIG.get(
+            'whitelist', None) else []
+        path_info = request.path_info
+        for item in url_whitelist:
+            url = item['url']
+            if url in path_info:
+                return url
+        return None
+
+
+def make_rules(count):
+    """
+    生成白名单规则， 完全匹配、前缀匹配、限定请求方法各占1/3
+    """
+    rules = []
+    for i in range(count):
+        if i % 3 == 0:
+            rules.append({'url': f'/api/public{i}/info/', 'match': 'exact'})
+        elif i % 3 == 1:
+            rules.append({'url': f'/api/open{i}/', 'match': 'prefix'})
+        else:
+            rules.append({'url': f'/api/hook{i}/', 'match': 'prefix', 'methods': ['post']})
+    return rules
+
+
+def make_request(method, path):
+    request = Request(getattr(APIRequestFactory(), method)(path))
+    # 未命中白名单时以超级管理员放行， 不查询数据库
+    request.user = SimpleNamespace(is_superuser=True)
+    return request
+
+
+def main(count=1000, number=2000):
+    rules = make_rules(count)
+    cases = (
+        ('hit first', make_request('get', '/api/public0/info/')),
+        ('hit last', make_request('post', f'/api/hook{count - 1}/run/')),
+        ('miss', make_request('get', '/api/cmdb/app/1/')),
+    )
+    for name, permission in (('legacy', LegacyRbacPermission()), ('compiled', RbacPermission())):
+        # 旧版本仅支持包含匹配
+        PLATFORM_CONFIG['whitelist'] = [{'url': i['url']} for i in rules] if name == 'legacy' else rules
+        for case, request in cases:
+            cost = bench(lambda: permission.has_permission(request, None), number=number)
+            print(f'{name:<10} {count} rules, {case:<10}: {cost:8.2f} us/check, {1e6 / cost:12.0f} checks/s')
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
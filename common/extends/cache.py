@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   cache.py
+@time    :   2026/10/17 14:20
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+import random
+import time
+
+from django.core.cache import cache
+
+
+def new_cache_version():
+    """
+    生成初始版本号， 按时间递增并追加随机数
+
+    版本key被淘汰(LRU/MAX_ENTRIES)或缓存重启后重新生成， 不会回退到已使用过的版本号而命中旧缓存
+    """
+    return int(time.time() * 1000) * 1000 + random.randint(0, 999)
+
+
+def get_cache_version(key):
+    """
+    获取数据版本号， 用于拼接缓存key， 数据变更时递增版本号即可使旧缓存失效
+    """
+    version = cache.get(key)
+    if version is None:
+        version = new_cache_version()
+        if not cache.add(key, version, timeout=None):
+            # 其他进程已生成
+            version = cache.get(key, version)
+    return version
+
+
+def bump_cache_version(key):
+    """
+    递增数据版本号
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        # key不存在
+        cache.set(key, new_cache_version(), timeout=None)
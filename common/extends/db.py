@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   db.py
+@time    :   2026/10/17 18:10
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# 只读从库别名
+REPLICA_DATABASE = 'replica'
+
+_use_replica = ContextVar('use_read_replica', default=False)
+
+
+@contextmanager
+def use_read_replica():
+    """
+    上下文内的读查询路由到只读从库(未配置从库时使用主库)
+    """
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReadReplicaRouter(object):
+    """
+    读写分离路由
+
+    默认所有查询使用主库， 仅 use_read_replica() 上下文内的读查询使用从库，
+    由视图按需开启(AutoModelViewSet.read_replica)， 避免写后立即读取到从库延迟数据
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and REPLICA_DATABASE in settings.DATABASES:
+            return REPLICA_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 主从为同一份数据
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA_DATABASE:
+            return False
+        return None
@@ -8,36 +8,56 @@
 '''
 
 # here put the import lib
-from functools import wraps
+from collections import defaultdict
+from functools import reduce, wraps
+import operator
 
 from rest_framework.response import Response
 
+from django.db.models import Q
+
 from cmdb.models import MicroApp
 
 from common.extends.viewsets import ops_response
 
 
+def get_exist_apps(keys):
+    """
+    批量查询已存在的应用， 走 (product, name) 唯一索引， 只查询一次
+
+    :param keys: [(product_id, name), ...]
+    :return: {(product_id, name), ...}
+    """
+    names = defaultdict(set)
+    for product, name in keys:
+        names[product].add(name)
+    if not names:
+        return set()
+    query = reduce(operator.or_, [Q(product_id=product, name__in=_names)
+                                  for product, _names in names.items()])
+    return set(MicroApp.objects.filter(query).values_list('product_id', 'name'))
+
+
 def cmdb_app_unique_check():
     """
     应用唯一性检查
 
     appid: {product.name}.{app.name}
+    同一产品下应用名称唯一， 由数据库唯一约束保证， 此处提前检查以返回友好提示
     """
 
-    def check_app(product, name):
-        try:
-            if MicroApp.objects.filter(project__product__id=product, name=name).exists():
-                # 存在应用
-                return True
-        except BaseException as e:
-            pass
-        return False
-
     def decorator(func):
         @wraps(func)
         def wrapper(self, request, *args, **kwargs):
-            if check_app(request.data['product'], request.data['name']):
-                return ops_response({}, success=False, errorCode=40300, errorMessage=f'该产品下已存在[{request.data["name"]}]同名应用.')
+            try:
+                product = int(request.data['product'])
+                # 与 AutoModelViewSet.create 的名称处理保持一致
+                name = str(request.data['name']).strip(' ').replace(' ', '-')
+            except (KeyError, TypeError, ValueError):
+                # 参数不完整， 交由序列化器校验
+                return func(self, request, *args, **kwargs)
+            if (product, name) in get_exist_apps([(product, name)]):
+                return ops_response({}, code=40300, message=f'该产品下已存在[{name}]同名应用.')
 
             return func(self, request, *args, **kwargs)
 
@@ -15,21 +15,234 @@ from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as Ba
     TokenRefreshSerializer as BaseTokenRefreshSerializer
 from rest_framework_simplejwt.tokens import Token as BaseToken, RefreshToken as BaseRefreshToken
 from rest_framework_simplejwt.settings import APISettings, DEFAULTS, IMPORT_STRINGS
-from django.contrib.auth import authenticate
+from django.contrib.auth import authenticate, get_user_model
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from config import PLATFORM_CONFIG
 from devops_backend import settings
 
+from common.extends.cache import get_cache_version, bump_cache_version
+from common.extends.metrics import record_cache
+
+import atexit
+import copy
 import datetime
 import hashlib
+import threading
+import time
+
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 api_settings = APISettings(
     getattr(settings, 'SIMPLE_JWT', None), DEFAULTS, IMPORT_STRINGS)
 
 
+def get_token_lifetime(token_type, default):
+    """
+    从平台配置获取token有效期(分钟)， 启动时解析一次
+    """
+    expired_time = PLATFORM_CONFIG.get('timeout', None)
+    if isinstance(expired_time, dict) and expired_time.get(token_type):
+        return datetime.timedelta(minutes=expired_time[token_type])
+    return default
+
+
+ACCESS_TOKEN_LIFETIME = get_token_lifetime(
+    'access', api_settings.ACCESS_TOKEN_LIFETIME)
+REFRESH_TOKEN_LIFETIME = get_token_lifetime(
+    'refresh', api_settings.REFRESH_TOKEN_LIFETIME)
+
+# 用户数据版本key， 用户信息/状态/角色变更时递增， 使认证用户缓存失效
+USER_VERSION_KEY = 'auth:user:version:{user_id}'
+# 进程内认证用户缓存 {user_id: (过期时间, 版本号, 数据库别名, {字段: 值})}
+USER_CACHE_TIMEOUT = 60
+USER_CACHE_MAX_SIZE = 10000
+_user_cache = {}
+
+
+# 已撤销token， 按jti存储， 过期时间与token一致
+TOKEN_REVOKED_KEY = 'auth:token:revoked:{jti}'
+# 用户token失效水位线， 签发时间(iat)早于该时间的token全部失效
+TOKEN_WATERMARK_KEY = 'auth:token:watermark:{user_id}'
+
+
+def revoke_token(token):
+    """
+    撤销单个token(注销、刷新轮换)
+    """
+    jti = token.get(api_settings.JTI_CLAIM)
+    if not jti:
+        return
+    exp = token.get('exp')
+    timeout = int(exp - time.time()) + 1 if exp else int(
+        REFRESH_TOKEN_LIFETIME.total_seconds())
+    if timeout > 0:
+        cache.set(TOKEN_REVOKED_KEY.format(jti=jti), 1, timeout=timeout)
+
+
+def revoke_user_tokens(user_id):
+    """
+    撤销用户当前已签发的所有token(重置密码、禁用用户)
+    """
+    timeout = int(max(ACCESS_TOKEN_LIFETIME, REFRESH_TOKEN_LIFETIME).total_seconds()) + 1
+    cache.set(TOKEN_WATERMARK_KEY.format(user_id=user_id),
+              int(time.time()), timeout=timeout)
+
+
+def is_token_revoked(token):
+    """
+    检查token是否已撤销， 一次缓存查询
+    """
+    jti_key = TOKEN_REVOKED_KEY.format(jti=token.get(api_settings.JTI_CLAIM))
+    watermark_key = TOKEN_WATERMARK_KEY.format(
+        user_id=token.get(api_settings.USER_ID_CLAIM))
+    revoked = cache.get_many([jti_key, watermark_key])
+    if revoked.get(jti_key):
+        return True
+    watermark = revoked.get(watermark_key)
+    return bool(watermark and token.get('iat', 0) < watermark)
+
+
+# 登录配置: {'max_failures': 5, 'lock_timeout': 300, 'last_login_flush': 10}
+LOGIN_CONFIG = PLATFORM_CONFIG.get('login', None) or {}
+# 登录失败计数， 达到上限后锁定， 锁定期间直接拒绝， 不再校验密码
+LOGIN_FAILURE_KEY = 'auth:login:failure:{username}'
+LOGIN_MAX_FAILURES = LOGIN_CONFIG.get('max_failures', 5)
+LOGIN_LOCK_TIMEOUT = LOGIN_CONFIG.get('lock_timeout', 60 * 5)
+# 最后登录时间批量写入间隔(秒)， 0 为同步写入
+LAST_LOGIN_FLUSH_INTERVAL = LOGIN_CONFIG.get('last_login_flush', 10)
+
+
+def get_login_failure_key(username):
+    return LOGIN_FAILURE_KEY.format(username=hashlib.md5(str(username).lower().encode('utf-8')).hexdigest())
+
+
+def get_login_failures(username):
+    return cache.get(get_login_failure_key(username), 0)
+
+
+def record_login_failure(username):
+    """
+    登录失败次数+1， 计数在首次失败 LOGIN_LOCK_TIMEOUT 秒后过期
+    """
+    key = get_login_failure_key(username)
+    if cache.add(key, 1, timeout=LOGIN_LOCK_TIMEOUT):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=LOGIN_LOCK_TIMEOUT)
+        return 1
+
+
+def clear_login_failures(username):
+    cache.delete(get_login_failure_key(username))
+
+
+class LastLoginBuffer(object):
+    """
+    最后登录时间缓冲区， 后台线程按间隔批量写入数据库
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, user):
+        user.last_login = timezone.now()
+        if self.interval <= 0:
+            user.save(update_fields=['last_login'])
+            return
+        with self._lock:
+            self._pending[user.pk] = user.last_login
+            if self._thread is None:
+                # 首次登录时启动， 避免在 gunicorn master 进程中创建线程
+                self._thread = threading.Thread(
+                    target=self._run, name='last-login-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def flush(self):
+        """
+        写入缓冲区内的最后登录时间
+
+        :return: 写入用户数
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        UserModel = get_user_model()
+        try:
+            UserModel.objects.bulk_update([UserModel(pk=k, last_login=v) for k, v in pending.items()],
+                                          ['last_login'], batch_size=500)
+        except BaseException:
+            # 写入失败放回缓冲区， 保留较新的登录时间
+            with self._lock:
+                for k, v in pending.items():
+                    self._pending[k] = max(v, self._pending.get(k, v))
+            raise
+        return len(pending)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except BaseException as e:
+                logger.exception(f'批量更新最后登录时间失败, 原因: {e}')
+            finally:
+                close_old_connections()
+
+
+last_login_buffer = LastLoginBuffer(LAST_LOGIN_FLUSH_INTERVAL)
+
+
+def bump_user_version(user_id):
+    """
+    递增用户数据版本号， 使所有进程内的认证用户缓存失效
+    """
+    bump_cache_version(USER_VERSION_KEY.format(user_id=user_id))
+
+
 class JWTAuthentication(BaseJWTAuthentication):
 
+    def get_user(self, validated_token):
+        """
+        从进程内缓存获取用户， 缓存以 用户ID + 用户数据版本号 校验， 用户变更后立即失效
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            return super().get_user(validated_token)
+
+        version = get_cache_version(USER_VERSION_KEY.format(user_id=user_id))
+        now = time.monotonic()
+        cached = _user_cache.get(user_id)
+        if cached and cached[0] > now and cached[1] == version:
+            record_cache('auth_user', True)
+            return self.build_user(cached[2], cached[3])
+
+        record_cache('auth_user', False)
+        user = super().get_user(validated_token)
+        if len(_user_cache) >= USER_CACHE_MAX_SIZE:
+            _user_cache.clear()
+        # 只缓存字段值， 每次请求重新构建用户对象， 避免请求/线程间共享 _state 及关联对象缓存
+        values = {f.attname: getattr(user, f.attname) for f in user._meta.concrete_fields}
+        _user_cache[user_id] = (now + USER_CACHE_TIMEOUT, version, user._state.db, values)
+        return user
+
+    def build_user(self, db, values):
+        # JSON等可变字段值复制一份
+        return self.user_model.from_db(db, list(values), [copy.deepcopy(v) for v in values.values()])
+
     def get_validated_token(self, raw_token):
         """
         Validates an encoded JSON web token and returns a validated token
@@ -38,7 +251,10 @@ class JWTAuthentication(BaseJWTAuthentication):
         messages = []
         for AuthToken in api_settings.AUTH_TOKEN_CLASSES:
             try:
-                return AuthToken(raw_token)
+                token = AuthToken(raw_token)
+                if is_token_revoked(token):
+                    raise TokenError('Token已注销.')
+                return token
             except TokenError as e:
                 messages.append(
                     {
@@ -82,25 +298,12 @@ class CustomInvalidToken(InvalidToken):
 
 class AccessToken(BaseToken):
     token_type = 'access'
-
-    def __init__(self, token=None, verify=True):
-        expired_time = PLATFORM_CONFIG.get('timeout', 120)
-        lifetime = datetime.timedelta(minutes=expired_time[
-            'access']) if expired_time and 'access' in expired_time else api_settings.ACCESS_TOKEN_LIFETIME
-        self.lifetime = lifetime
-        super().__init__(token, verify)
+    lifetime = ACCESS_TOKEN_LIFETIME
 
 
 class RefreshToken(BaseRefreshToken):
     token_type = 'refresh'
-
-    def __init__(self, token=None, verify=True):
-        expired_time = PLATFORM_CONFIG.get(
-            'timeout', {'access': 360, 'refresh': 3600})
-        lifetime = datetime.timedelta(minutes=expired_time[
-            'refresh']) if expired_time and 'refresh' in expired_time else api_settings.REFRESH_TOKEN_LIFETIME
-        self.lifetime = lifetime
-        super().__init__(token, verify)
+    lifetime = REFRESH_TOKEN_LIFETIME
 
     @property
     def access_token(self):
@@ -125,17 +328,14 @@ class TokenRefreshSerializer(BaseTokenRefreshSerializer):
 
     def validate(self, attrs):
         refresh = RefreshToken(attrs['refresh'])
+        if is_token_revoked(refresh):
+            raise TokenError('Token已注销.')
         data = {'access': str(refresh.access_token)}
 
         if api_settings.ROTATE_REFRESH_TOKENS:
             if api_settings.BLACKLIST_AFTER_ROTATION:
-                try:
-                    # Attempt to blacklist the given refresh token
-                    refresh.blacklist()
-                except AttributeError:
-                    # If blacklist app not installed, `blacklist` method will
-                    # not be present
-                    pass
+                # 撤销轮换前的refresh token
+                revoke_token(refresh)
 
             refresh.set_jti()
             refresh.set_exp()
@@ -148,9 +348,35 @@ class TokenRefreshSerializer(BaseTokenRefreshSerializer):
 class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
 
     default_error_messages = {
-        "no_active_account": "用户名或者密码错误！"
+        "no_active_account": "用户名或者密码错误！",
+        "login_locked": "登录失败次数过多，请稍后再试！"
     }
 
+    def validate(self, attrs):
+        """
+        登录校验: 失败次数超限直接拒绝(不执行密码哈希)， 最后登录时间延迟批量写入
+        """
+        username = attrs[self.username_field]
+        failures = get_login_failures(username)
+        if LOGIN_MAX_FAILURES and failures >= LOGIN_MAX_FAILURES:
+            raise exceptions.AuthenticationFailed(
+                self.error_messages['login_locked'], 'login_locked')
+        try:
+            data = super(BaseTokenObtainPairSerializer, self).validate(attrs)
+        except exceptions.AuthenticationFailed:
+            record_login_failure(username)
+            raise
+        if failures:
+            clear_login_failures(username)
+
+        refresh = self.get_token(self.user)
+        data['refresh'] = str(refresh)
+        data['access'] = str(refresh.access_token)
+
+        if api_settings.UPDATE_LAST_LOGIN:
+            last_login_buffer.add(self.user)
+        return data
+
     @classmethod
     def get_token(cls, user):
         token = RefreshToken.for_user(user)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   metrics.py
+@time    :   2026/10/17 21:30
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+import hmac
+import os
+
+from django.http import HttpResponse, Http404
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, multiprocess
+from config import PLATFORM_CONFIG
+
+# Prometheus 监控指标: enabled 是否开启(默认关闭)， token 拉取指标的Bearer Token(为空时不开放 /metrics)
+# gunicorn 多worker部署时设置环境变量 PROMETHEUS_MULTIPROC_DIR， 各worker指标写入该目录后汇总
+METRICS_CONFIG = PLATFORM_CONFIG.get('metrics') or {}
+METRICS_ENABLED = METRICS_CONFIG.get('enabled', False)
+METRICS_TOKEN = METRICS_CONFIG.get('token', '')
+
+# 未匹配到视图的请求统一标记， 避免按路径产生大量标签
+UNKNOWN_VIEW = 'unknown'
+
+REQUEST_TOTAL = Counter('ydevops_requests_total', '请求数', [
+                        'view', 'action', 'method', 'status'])
+REQUEST_LATENCY = Histogram('ydevops_request_duration_seconds', '请求耗时', ['view', 'action', 'method'],
+                            buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_QUERIES = Histogram('ydevops_request_queries', '单个请求的SQL数量', ['view', 'action'],
+                            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+RESPONSE_SIZE = Histogram('ydevops_response_size_bytes', '响应大小', ['view', 'action'],
+                          buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+# 命中率: rate(ydevops_cache_requests_total{result="hit"}[5m]) / rate(ydevops_cache_requests_total[5m])
+CACHE_REQUESTS = Counter('ydevops_cache_requests_total', '缓存访问次数', [
+                         'cache', 'result'])
+
+
+def observe_request(request, response, metrics):
+    """
+    记录请求指标
+
+    :param metrics: common.extends.middleware.RequestMetrics
+    """
+    if not METRICS_ENABLED:
+        return
+    view, action = metrics.view or UNKNOWN_VIEW, metrics.action or ''
+    REQUEST_TOTAL.labels(view, action, request.method, response.status_code).inc()
+    REQUEST_LATENCY.labels(view, action, request.method).observe(metrics.total)
+    REQUEST_QUERIES.labels(view, action).observe(metrics.db_count)
+    if not response.streaming:
+        RESPONSE_SIZE.labels(view, action).observe(len(response.content))
+
+
+def record_cache(name, hit):
+    """
+    记录缓存命中情况
+
+    :param name: 缓存名称， 如 auth_user/rbac_permission/menu
+    """
+    if METRICS_ENABLED:
+        CACHE_REQUESTS.labels(name, 'hit' if hit else 'miss').inc()
+
+
+def get_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    # 多进程模式， 汇总所有worker写入的指标文件
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    """
+    Prometheus 指标， 须携带 Bearer Token 拉取
+    """
+    if not (METRICS_ENABLED and METRICS_TOKEN):
+        raise Http404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return HttpResponse(status=401)
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+def child_exit(server, worker):
+    """
+    gunicorn worker 退出时清理该进程的指标文件， 在 gunicorn 配置文件中引用
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
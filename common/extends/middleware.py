@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   middleware.py
+@time    :   2026/10/17 20:40
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+import time
+
+from django.db import connections
+from config import PLATFORM_CONFIG
+
+from common.extends.metrics import observe_request
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 请求性能统计: server_timing 是否返回 Server-Timing 响应头(默认关闭)， slow_threshold 慢请求日志阈值(毫秒, 0为关闭)，
+# duplicate_top 慢请求日志中输出的重复SQL数量
+PERFORMANCE_CONFIG = PLATFORM_CONFIG.get('performance') or {}
+
+_request_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics(object):
+    """
+    单个请求的性能数据， 时间单位为秒
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view = None
+        self.action = None
+        self.total = 0
+        self.db_count = 0
+        self.db_time = 0
+        self.queries = Counter()
+        # 分段耗时， 如 serializer/permission
+        self.timings = Counter()
+
+    @property
+    def label(self):
+        if not self.view:
+            return None
+        return f'{self.view}.{self.action}' if self.action else self.view
+
+    def duplicates(self, top):
+        return [(sql, count) for sql, count in self.queries.most_common(top) if count > 1]
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.db_count += 1
+            self.queries[sql] += 1
+
+
+def get_request_metrics():
+    """
+    当前请求的性能数据， 不在请求内返回None
+    """
+    return _request_metrics.get()
+
+
+@contextmanager
+def record_timing(name):
+    """
+    记录当前请求的分段耗时， 不在请求内时不做统计
+    """
+    metrics = _request_metrics.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] += time.perf_counter() - start
+
+
+class PerformanceMiddleware(object):
+    """
+    请求性能统计
+
+    按视图/action记录请求耗时、SQL数量及耗时、序列化及权限校验耗时(AutoModelViewSet)，
+    超过阈值的请求记录日志及重复执行的SQL， 用于排查N+1查询， 同时写入 Prometheus 指标(common.extends.metrics)
+
+    Server-Timing 响应头会暴露SQL数量及耗时， 默认关闭， 仅在调试环境开启
+    流式响应(StreamingHttpResponse)在输出完成后统计， 包含输出数据时执行的SQL， 不返回 Server-Timing
+    """
+    server_timing = PERFORMANCE_CONFIG.get('server_timing', False)
+    slow_threshold = PERFORMANCE_CONFIG.get('slow_threshold', 1000)
+    duplicate_top = PERFORMANCE_CONFIG.get('duplicate_top', 5)
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        with self.collect(metrics):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.iter_streaming(
+                request, response, metrics, response.streaming_content)
+            return response
+        metrics.total = time.perf_counter() - metrics.start
+        if self.server_timing:
+            response['Server-Timing'] = self.get_server_timing(metrics)
+        self.finish(request, response, metrics)
+        return response
+
+    @staticmethod
+    @contextmanager
+    def collect(metrics):
+        """
+        统计上下文内所有数据库连接执行的SQL
+        """
+        token = _request_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(metrics.execute_wrapper))
+                yield
+        finally:
+            _request_metrics.reset(token)
+
+    def iter_streaming(self, request, response, metrics, content):
+        """
+        流式响应逐块生成数据时统计SQL， 输出完成后记录日志及指标
+        """
+        iterator = iter(content)
+        try:
+            while True:
+                with self.collect(metrics):
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        break
+                yield chunk
+        finally:
+            metrics.total = time.perf_counter() - metrics.start
+            self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        self.report(request, response, metrics)
+        observe_request(request, response, metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _request_metrics.get()
+        if metrics is None:
+            return None
+        view_class = getattr(view_func, 'cls', None)
+        if view_class is None:
+            metrics.view = getattr(view_func, '__name__', view_func.__class__.__name__)
+            return None
+        metrics.view = view_class.__name__
+        # ViewSet 由路由生成请求方法与action的映射
+        actions = getattr(view_func, 'actions', None) or {}
+        metrics.action = actions.get(request.method.lower(), request.method.lower())
+        return None
+
+    @staticmethod
+    def get_server_timing(metrics):
+        items = [f'total;dur={metrics.total * 1000:.2f}',
+                 f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.db_count} queries"']
+        items.extend(f'{name};dur={cost * 1000:.2f}' for name, cost in metrics.timings.items())
+        return ', '.join(items)
+
+    def report(self, request, response, metrics):
+        """
+        慢请求日志
+        """
+        if not self.slow_threshold or metrics.total * 1000 < self.slow_threshold:
+            return
+        logger.warning('慢请求 %s %s [%s] %s: %.2fms, %d queries %.2fms, %s, 重复SQL: %s',
+                       request.method, request.path, metrics.label, response.status_code, metrics.total * 1000,
+                       metrics.db_count, metrics.db_time * 1000,
+                       ', '.join(f'{name} {cost * 1000:.2f}ms' for name, cost in metrics.timings.items()) or '-',
+                       ''.join(f'\n  [{count}x] {sql}' for sql, count in metrics.duplicates(self.duplicate_top)) or '-')
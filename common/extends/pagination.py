@@ -9,14 +9,238 @@
 
 # here put the import lib
 # import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+import datetime
+import hashlib
+import json
+import operator
+
 from rest_framework.pagination import PageNumberPagination, LimitOffsetPagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework import status
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import Q
+
+# 统计总数缓存时间
+TOTAL_CACHE_TIMEOUT = 60
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    分页
+
+    默认页码分页， 请求携带 cursor 参数(首页传空值: ?cursor=) 或视图设置 cursor_pagination = True 时使用游标分页:
+        按 queryset 排序字段(视图 cursor_ordering / 查询排序 / 模型 Meta.ordering)做 keyset 查询， 不执行 COUNT
+        排序字段可为空时 NULL 位置与页码分页一致
+        with_total=1 返回缓存的精确总数， with_total=approx 返回数据库统计的估算总数
+    """
+    cursor_query_param = 'cursor'
+    total_query_param = 'with_total'
+
+    cursor_mode = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params or getattr(
+            view, 'cursor_pagination', False)
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_queryset_by_cursor(queryset, request, view)
+
     def get_paginated_response(self, data):
         # print('pages total', self.paginator.num_pages)
         # print('page size', self.page_size, 'totalPage', self.page.paginator.num_pages)
+        if self.cursor_mode:
+            return Response({'data': {'list': data, 'total': self.total, 'next': self.get_cursor_link(self.next_position),
+                                      'previous': self.get_cursor_link(self.previous_position, reverse=True)},
+                             'code': 20000, 'message': None}, status=status.HTTP_200_OK)
         return Response({'data': {'list': data, 'total': self.page.paginator.count, 'next': self.get_next_link(),
                                   'previous': self.get_previous_link()}, 'code': 20000, 'message': None}, status=status.HTTP_200_OK)
+
+    def get_cursor_ordering(self, queryset, view):
+        """
+        游标排序字段， 最后追加主键保证唯一
+
+        :return: [(field, desc, nullable), ...]
+        """
+        ordering = getattr(view, 'cursor_ordering', None) or queryset.query.order_by or \
+            queryset.model._meta.ordering or ['-pk']
+        if isinstance(ordering, str):
+            ordering = [i.strip() for i in ordering.split(',')]
+        if not all(isinstance(i, str) for i in ordering):
+            # 表达式排序不支持keyset
+            ordering = ['-pk']
+        nullable = [self.is_nullable(queryset.model, i.lstrip('-')) for i in ordering]
+        if None in nullable:
+            # 多值关联字段及无法解析的字段不支持keyset
+            ordering, nullable = ['-pk'], [False]
+        result = []
+        for i, null in zip(ordering, nullable):
+            field = 'pk' if i.lstrip('-') == 'id' else i.lstrip('-')
+            result.append((field, i.startswith('-'), null))
+        if 'pk' not in [i[0] for i in result]:
+            result.append(('pk', result[0][1], False))
+        return result
+
+    @staticmethod
+    def is_nullable(model, field):
+        """
+        排序字段是否可能为空
+
+        :return: True/False， 多值关联字段及无法解析的字段返回 None
+        """
+        if field in ('pk', 'id'):
+            return False
+        opts, nullable = model._meta, False
+        for name in field.split('__'):
+            try:
+                _field = opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if _field.many_to_many or _field.one_to_many:
+                return None
+            nullable = nullable or _field.null
+            if not _field.is_relation:
+                return nullable
+            opts = _field.related_model._meta
+        return nullable
+
+    @staticmethod
+    def get_position(instance, ordering):
+        position = []
+        for field, *_ in ordering:
+            value = instance
+            for attr in field.split('__'):
+                value = getattr(value, attr)
+                if value is None:
+                    break
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    @staticmethod
+    def get_position_filter(ordering, position, reverse=False, nulls_largest=False):
+        """
+        keyset 过滤条件: (f1 < v1) | (f1 = v1 & f2 < v2) | ...
+
+        排序与页码分页一致使用数据库默认的NULL位置， nulls_largest 为 True 时 NULL 视为最大值(PostgreSQL/Oracle)，
+        否则视为最小值(MySQL/SQLite)
+        """
+        conditions = []
+        for index, (field, desc, nullable) in enumerate(ordering):
+            lookup = 'lt' if desc != reverse else 'gt'
+            # 当前方向上 NULL 是否排在非空值之后
+            nulls_after = nullable and (lookup == 'gt') == nulls_largest
+            value = position[index]
+            if value is None:
+                if nulls_after:
+                    continue
+                q = Q(**{f'{field}__isnull': False})
+            else:
+                q = Q(**{f'{field}__{lookup}': value})
+                if nulls_after:
+                    q |= Q(**{f'{field}__isnull': True})
+            for _index, (_field, *_) in enumerate(ordering[:index]):
+                _value = position[_index]
+                q &= Q(**{f'{_field}__isnull': True}) if _value is None else Q(**{_field: _value})
+            conditions.append(q)
+        return reduce(operator.or_, conditions)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(
+                encoded.encode('ascii')).decode('utf-8'))
+            return cursor['p'], bool(cursor.get('r', 0))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound('无效的游标.')
+
+    def get_cursor_link(self, position, reverse=False):
+        if position is None:
+            return None
+        encoded = urlsafe_b64encode(json.dumps(
+            {'p': position, 'r': int(reverse)}).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def paginate_queryset_by_cursor(self, queryset, request, view=None):
+        self.request = request
+        page_size = int(self.get_page_size(request) or 0) or 1
+        ordering = self.get_cursor_ordering(queryset, view)
+        position, reverse = self.decode_cursor(request)
+        self.total = self.get_total(queryset, request)
+
+        order_by = [f'-{field}' if desc != reverse else field for field,
+                    desc, _ in ordering]
+        qs = queryset.order_by(*order_by)
+        if position is not None:
+            if len(position) != len(ordering) or any(
+                    value is None and not nullable for value, (_, _, nullable) in zip(position, ordering)):
+                raise NotFound('无效的游标.')
+            try:
+                qs = qs.filter(self.get_position_filter(
+                    ordering, position, reverse, connections[queryset.db].features.nulls_order_largest))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound('无效的游标.')
+        results = list(qs[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            first, last = self.get_position(
+                results[0], ordering), self.get_position(results[-1], ordering)
+            if reverse:
+                self.previous_position = first if has_more else None
+                self.next_position = last
+            else:
+                self.next_position = last if has_more else None
+                self.previous_position = first if position is not None else None
+        return results
+
+    def get_total(self, queryset, request):
+        """
+        游标分页总数， 默认不统计
+        """
+        with_total = request.query_params.get(self.total_query_param)
+        if not with_total:
+            return None
+        if with_total == 'approx' and not queryset.query.where:
+            approx = self.get_approximate_total(queryset)
+            if approx is not None:
+                return approx
+        sql, params = queryset.query.sql_with_params()
+        key = 'pagination:total:%s' % hashlib.md5(
+            f'{sql}{params}'.encode('utf-8')).hexdigest()
+        total = cache.get(key)
+        if total is None:
+            total = queryset.count()
+            cache.set(key, total, timeout=TOTAL_CACHE_TIMEOUT)
+        return total
+
+    @staticmethod
+    def get_approximate_total(queryset):
+        """
+        从数据库统计信息读取估算行数
+        """
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        sql = None
+        if connection.vendor == 'mysql':
+            sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+        elif connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+        if not sql:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
@@ -8,14 +8,158 @@
 '''
 
 # here put the import lib
+import re
+
 from rest_framework.permissions import BasePermission
+from django.core.cache import cache
 
+from common.extends.cache import get_cache_version, bump_cache_version
+from common.extends.metrics import record_cache
 from config import PLATFORM_CONFIG
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 权限缓存版本key， 角色/权限变更时递增， 使所有用户权限缓存失效
+PERMISSION_VERSION_KEY = 'rbac:permission:version'
+PERMISSION_CACHE_KEY = 'rbac:permission:{user_id}:{version}'
+PERMISSION_CACHE_TIMEOUT = 60 * 60
+
+# 视图类 perms_map 编译结果 {ViewSet: (perms_map, compiled)}
+_compiled_perms_map = {}
+# URL白名单编译结果 (whitelist, UrlWhitelist)
+_compiled_whitelist = (None, None)
+
+
+def get_permission_version():
+    return get_cache_version(PERMISSION_VERSION_KEY)
+
+
+def bump_permission_version():
+    """
+    递增权限版本号， 角色、权限、用户角色关系变更时调用
+    """
+    bump_cache_version(PERMISSION_VERSION_KEY)
+
+
+def get_user_permission(user):
+    """
+    获取用户权限缓存
+
+    :return: {'is_admin': bool, 'perms': frozenset, 'roles': frozenset(角色ID)}
+    """
+    if not getattr(user, 'is_authenticated', False):
+        return {'is_admin': False, 'perms': frozenset(), 'roles': frozenset()}
+    version = get_permission_version()
+    # 同一请求内复用
+    _cached = getattr(user, '_rbac_permission', None)
+    if _cached is not None and _cached[0] == version:
+        return _cached[1]
+    key = PERMISSION_CACHE_KEY.format(user_id=user.id, version=version)
+    data = cache.get(key)
+    record_cache('rbac_permission', data is not None)
+    if data is None:
+        role_perms = user.roles.values_list(
+            'id', 'name', 'permissions__method').distinct()
+        roles = {}
+        perms = set()
+        for role_id, name, method in role_perms:
+            roles[role_id] = name
+            if method:
+                perms.add(method)
+        data = {'is_admin': '管理员' in roles.values(), 'perms': frozenset(perms),
+                'roles': frozenset(roles)}
+        cache.set(key, data, timeout=PERMISSION_CACHE_TIMEOUT)
+    user._rbac_permission = (version, data)
+    return data
+
+
+def compile_perms_map(view):
+    """
+    编译视图 perms_map， 每个视图类只编译一次
+
+    :return: {method: frozenset(权限标识)}, method 为 '*' / 'get' / 'get_test_data' / '*_test_data'
+    """
+    view_class = view.__class__
+    perms_map = view_class.perms_map
+    compiled = _compiled_perms_map.get(view_class)
+    if compiled is None or compiled[0] is not perms_map:
+        _map = {}
+        for i in perms_map:
+            for method, alias in i.items():
+                _map.setdefault(method, set()).add(alias[0])
+        compiled = (perms_map, {k: frozenset(v) for k, v in _map.items()})
+        _compiled_perms_map[view_class] = compiled
+    return compiled[1]
+
+
+class UrlWhitelist(object):
+    """
+    URL白名单
+
+    规则格式: {'url': '/api/user/login/', 'match': 'exact', 'methods': ['post']}
+        match: exact 完全匹配 / prefix 前缀匹配 / contains 包含(默认， 兼容旧配置)
+        methods: 限定请求方法， 为空不限制
+    """
+    MATCH_TYPES = ('exact', 'prefix', 'contains')
+
+    def __init__(self, rules):
+        _rules = {}
+        for item in rules:
+            match = item.get('match') or 'contains'
+            if match not in self.MATCH_TYPES:
+                raise ValueError(f'白名单 {item["url"]} 不支持的匹配方式 {match}')
+            # '*' 为不限制请求方法的规则
+            for method in [i.lower() for i in item.get('methods') or []] or ['*']:
+                _rules.setdefault(method, {i: set() for i in self.MATCH_TYPES})[match].add(item['url'])
+        # {method: (完全匹配URL集合, ((前缀长度, 前缀集合), ...), 包含匹配正则)}
+        self.rules = {method: self.compile(**urls) for method, urls in _rules.items()}
+
+    @staticmethod
+    def compile(exact, prefix, contains):
+        prefixes = {}
+        for url in prefix:
+            prefixes.setdefault(len(url), set()).add(url)
+        pattern = None
+        if contains:
+            # 长的优先， 日志中输出最具体的规则
+            pattern = re.compile('|'.join(re.escape(i) for i in sorted(contains, key=len, reverse=True)))
+        return frozenset(exact), tuple((k, frozenset(v)) for k, v in sorted(prefixes.items())), pattern
+
+    def match(self, method, path):
+        """
+        :return: 命中的白名单URL， 未命中返回None
+        """
+        for key in (method, '*'):
+            compiled = self.rules.get(key)
+            if compiled is None:
+                continue
+            exact, prefixes, pattern = compiled
+            if path in exact:
+                return path
+            for length, urls in prefixes:
+                if length > len(path):
+                    break
+                if path[:length] in urls:
+                    return path[:length]
+            if pattern is not None:
+                matched = pattern.search(path)
+                if matched:
+                    return matched.group()
+        return None
+
+
+def get_url_whitelist():
+    """
+    编译 PLATFORM_CONFIG['whitelist']， 配置替换后重新编译
+    """
+    global _compiled_whitelist
+    whitelist = PLATFORM_CONFIG.get('whitelist') or ()
+    if _compiled_whitelist[0] is not whitelist:
+        _compiled_whitelist = (whitelist, UrlWhitelist(whitelist))
+    return _compiled_whitelist[1]
+
 
 class RbacPermission(BasePermission):
     """
@@ -24,17 +168,18 @@ class RbacPermission(BasePermission):
 
     @classmethod
     def check_is_admin(cls, request):
-        return request.user.is_authenticated and request.user.roles.filter(name='管理员').count() > 0
+        return get_user_permission(request.user)['is_admin']
 
     @classmethod
     def get_permission_from_role(cls, request):
-        try:
-            perms = request.user.roles.values(
-                'permissions__method',
-            ).distinct()
-            return [p['permissions__method'] for p in perms]
-        except AttributeError:
-            return []
+        return list(get_user_permission(request.user)['perms'])
+
+    @classmethod
+    def check_whitelist(cls, request):
+        """
+        :return: 命中的白名单URL， 未命中返回None
+        """
+        return get_url_whitelist().match(request._request.method.lower(), request.path_info)
 
     def _has_permission(self, request, view):
         """
@@ -60,64 +205,57 @@ class RbacPermission(BasePermission):
         :return:
         """
         _method = request._request.method.lower()
-        url_whitelist = PLATFORM_CONFIG['whitelist'] if PLATFORM_CONFIG.get(
-            'whitelist', None) else []
         path_info = request.path_info
-        for item in url_whitelist:
-            url = item['url']
-            if url in path_info:
-                logger.debug(f'请求地址 {path_info} 命中白名单 {url}， 放行')
-                return True
+        url = self.check_whitelist(request)
+        if url is not None:
+            logger.debug('请求地址 %s 命中白名单 %s， 放行', path_info, url)
+            return True
 
         is_superuser = request.user.is_superuser
         # 超级管理员 或者 白名单模式 直接放行
         if is_superuser:
             logger.debug(
-                f'用户 {request.user} 是超级管理员， 放行 is_superuser = {is_superuser}')
+                '用户 %s 是超级管理员， 放行 is_superuser = %s', request.user, is_superuser)
             return True
 
-        is_admin = RbacPermission.check_is_admin(request)
-        perms = self.get_permission_from_role(request)
+        user_permission = get_user_permission(request.user)
+        is_admin = user_permission['is_admin']
+        perms = user_permission['perms']
         # 不是管理员 且 权限列表为空的情况下， 直接拒绝
         if not is_admin and not perms:
-            logger.debug(f'用户 {request.user} 不是管理员 且 权限列表为空， 直接拒绝')
+            logger.debug('用户 %s 不是管理员 且 权限列表为空， 直接拒绝', request.user)
             return False
 
-        perms_map = view.perms_map
         # 未配置权限映射的视图一律禁止访问
         if not hasattr(view, 'perms_map'):
-            logger.debug(f'未配置权限映射的视图一律禁止访问 {view}')
+            logger.debug('未配置权限映射的视图一律禁止访问 %s', view)
             return False
+        perms_map = compile_perms_map(view)
 
-        # _custom_method = None
-        # default_funcs = ['create', 'list', 'retrieve', 'update', 'destroy']
-        action = view.action
-        _custom_method = f'{_method}_{action}'
-        for i in perms_map:
-            logger.debug(f'perms_map item ===  {i}')
-            for method, alias in i.items():
-                # 如果是管理员， 判断当前perms_map是否带有 {'*': ('admin', '管理员')} 标记，如果有， 则当前 ViewSet 所有方法全放行
-                if is_admin and (method == '*' and alias[0] == 'admin'):
-                    logger.debug('管理员判断通过， 放行')
-                    return True
-                # 如果带有某个模块的管理权限， 则当前模块所有方法都放行
-                if method == '*' and alias[0] in perms:
-                    logger.debug('模块管理权限 判断通过， 放行')
-                    return True
-
-                # 判断自定义action的情况
-                # {'get_test_data': ('get_test_data', '获取测试数据')},
-                # {'*_test_data': ('get_test_data', '获取测试数据')},
-                if _custom_method and alias[0] in perms and (_custom_method == method or method == f'*_{action}'):
-                    logger.debug('自定义action权限 判断通过， 放行')
-                    return True
-
-                # 判断是否拥有ViewSet 某个方法的权限， 有则放行
-                # {'get': ('workflow_list', '查看工单')},
-                if _method == method and alias[0] in perms:
-                    logger.debug(f'{method}方法权限 判断通过， 放行')
-                    return True
-        logger.debug(f'{path_info} 没有符合条件的， 则默认禁止访问')
+        # APIView 没有action
+        action = getattr(view, 'action', None)
+        module_perms = perms_map.get('*', frozenset())
+        # 如果是管理员， 判断当前perms_map是否带有 {'*': ('admin', '管理员')} 标记，如果有， 则当前 ViewSet 所有方法全放行
+        if is_admin and 'admin' in module_perms:
+            logger.debug('管理员判断通过， 放行')
+            return True
+        # 如果带有某个模块的管理权限， 则当前模块所有方法都放行
+        if not module_perms.isdisjoint(perms):
+            logger.debug('模块管理权限 判断通过， 放行')
+            return True
+        # 判断自定义action的情况
+        # {'get_test_data': ('get_test_data', '获取测试数据')},
+        # {'*_test_data': ('get_test_data', '获取测试数据')},
+        for method in (f'{_method}_{action}', f'*_{action}') if action else ():
+            if not perms_map.get(method, frozenset()).isdisjoint(perms):
+                logger.debug('自定义action权限 判断通过， 放行')
+                return True
+        # 判断是否拥有ViewSet 某个方法的权限， 有则放行
+        # {'get': ('workflow_list', '查看工单')},
+        if not perms_map.get(_method, frozenset()).isdisjoint(perms):
+            logger.debug('%s方法权限 判断通过， 放行', _method)
+            return True
+        logger.debug('%s 没有符合条件的， 则默认禁止访问', path_info)
         return False
 
     def has_permission(self, request, view):
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   serializers.py
+@time    :   2026/10/18 12:10
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """
+    多对多主键列表一次查询校验， DRF 默认逐个主键 get 查询
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_many(data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    在 ModelSerializer 中设置 serializer_related_field = BulkPrimaryKeyRelatedField 启用
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_internal_value_many(self, data):
+        data = list(data)
+        if self.pk_field is not None:
+            data = [self.pk_field.to_internal_value(i) for i in data]
+        queryset = self.get_queryset()
+        pk = queryset.model._meta.pk
+        try:
+            if any(isinstance(i, bool) for i in data):
+                raise TypeError
+            pks = [pk.to_python(i) for i in data]
+        except (TypeError, ValueError, DjangoValidationError):
+            # 类型错误逐个校验， 返回与 DRF 一致的错误信息
+            return [self.to_internal_value(i) for i in data]
+        instances = queryset.in_bulk(set(pks)) if pks else {}
+        for value, key in zip(data, pks):
+            if key not in instances:
+                self.fail('does_not_exist', pk_value=value)
+        return [instances[i] for i in pks]
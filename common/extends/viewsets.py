@@ -8,21 +8,32 @@
 '''
 
 # here put the import lib
-import inspect
-from rest_framework.permissions import IsAuthenticated
+import json
+import re
+from contextlib import ExitStack
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework import viewsets
 from rest_framework import pagination
+from rest_framework.serializers import ModelSerializer
 from rest_framework.settings import api_settings
 from rest_framework.filters import OrderingFilter
+from rest_framework.utils import encoders
+from django.http import StreamingHttpResponse
+from django.db import transaction, router, connections, IntegrityError
 from django.db.models.query import QuerySet
-from django.db.models import ProtectedError, fields
+from django.db.models import Model, ProtectedError, fields
+from django.db.models.signals import pre_save, post_save, m2m_changed
 from django.core.cache import cache
 import pytz
 import logging
 
+from common.recursive import prefetch_tree
+from common.extends.db import use_read_replica
+from common.extends.middleware import record_timing
+
 logger = logging.getLogger(__name__)
 
 
@@ -48,8 +59,25 @@ class AutoModelViewSet(viewsets.ModelViewSet):
 
     permission_classes = [IsAuthenticated]
     permission_classes_by_action = {}
+    # 按action声明的预加载配置
+    # 例子： {'list': {'select_related': ('project', ), 'prefetch_related': (Prefetch('appinfo_set'), )}}
+    eager_loading_by_action = {}
+    # get_all 流式导出， 每批序列化的数据量
+    stream_chunk_size = 500
+    stream_content_types = {'ndjson': 'application/x-ndjson',
+                            'json': 'application/json'}
     filter_backends = (OrderingFilter, )
     column_width = {}
+    # read_replica_actions 中的读请求使用只读从库， 需在 config.py 中配置 replica
+    # 认证及RBAC权限查询始终使用主库， 避免版本号递增后从库延迟数据被写入新版本缓存
+    read_replica = False
+    read_replica_actions = ('list', 'retrieve')
+    # 各action的最大查询次数， 由 common.testing.QueryBudgetTestMixin 检查
+    # 例子： {'list': 5, 'retrieve': 3, 'create': 6, 'update': 6}
+    query_budget = {}
+    # 批量操作单次最大数据量， 及每条SQL写入的数据量
+    bulk_max_size = 1000
+    bulk_batch_size = 500
 
     def __init__(self, *args, **kwargs):
         if not hasattr(self, 'queryset'):
@@ -60,18 +88,48 @@ class AutoModelViewSet(viewsets.ModelViewSet):
 
         super().__init__(*args, **kwargs)
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # 认证、权限校验通过后再切换从库， 在 finalize_response 中恢复
+        if self.read_replica and request.method in SAFE_METHODS and self.action in self.read_replica_actions:
+            self._read_replica = ExitStack()
+            self._read_replica.enter_context(use_read_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        read_replica = self.__dict__.pop('_read_replica', None)
+        if read_replica is not None:
+            read_replica.close()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    # 各action专用serializer_class的别名映射， 如 partial_update 复用 serializer_update_class
+    serializer_action_alias = {'partial_update': 'update'}
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        类创建时收集 serializer_{action}_class 属性， 生成 {action: serializer_class} 映射
+        """
+        super().__init_subclass__(**kwargs)
+        cls._action_serializer_classes = {
+            match.group(1): getattr(cls, name)
+            for name in dir(cls)
+            for match in [re.fullmatch(r'serializer_(\w+)_class', name)]
+            if match and getattr(cls, name, None) is not None
+        }
+
     def get_serializer(self, *args, **kwargs):
         """
         重写 get_serializer 类，用来支持自动获取不同的 serializer_class
         例子：  list 方法， 设置一个serializer_list_class， 则调用get_serializer的时候， 优先获取
-        命名格式 serializer_{call_func_name}_class
+        命名格式 serializer_{action}_class
         :param args:
         :param kwargs:
         :return:
         """
-        call_func_name = inspect.stack()[1][3]
-        serializer_class = getattr(
-            self, f'serializer_{call_func_name}_class', None)
+        action = getattr(self, 'action', None)
+        action_serializer_classes = getattr(
+            self, '_action_serializer_classes', {})
+        serializer_class = action_serializer_classes.get(action) or action_serializer_classes.get(
+            self.serializer_action_alias.get(action))
         if not serializer_class:
             serializer_class = self.get_serializer_class()
         kwargs['context'] = self.get_serializer_context()
@@ -86,6 +144,22 @@ class AutoModelViewSet(viewsets.ModelViewSet):
         except KeyError:
             return [permission() for permission in self.permission_classes]
 
+    def check_permissions(self, request):
+        with record_timing('permission'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with record_timing('permission'):
+            super().check_object_permissions(request, obj)
+
+    @staticmethod
+    def serialize(serializer):
+        """
+        获取序列化数据， 统计序列化耗时(含序列化过程中的查询)
+        """
+        with record_timing('serializer'):
+            return serializer.data
+
     def get_permission_from_role(self, request):
         try:
             perms = request.user.roles.values(
@@ -98,6 +172,35 @@ class AutoModelViewSet(viewsets.ModelViewSet):
     def extend_filter(self, queryset):
         return queryset
 
+    @staticmethod
+    def distinct_if_needed(queryset):
+        """
+        仅当查询关联了多值关系(反向外键/多对多)可能产生重复行时才去重
+        """
+        if not isinstance(queryset, QuerySet) or queryset.query.distinct:
+            return queryset
+        for join in queryset.query.alias_map.values():
+            join_field = getattr(join, 'join_field', None)
+            if getattr(join_field, 'one_to_many', False) or getattr(join_field, 'many_to_many', False):
+                return queryset.distinct()
+        return queryset
+
+    def filter_queryset(self, queryset):
+        return self.distinct_if_needed(super().filter_queryset(queryset))
+
+    def eager_loading(self, queryset):
+        """
+        根据 eager_loading_by_action 对当前action的queryset做预加载
+        """
+        profile = self.eager_loading_by_action.get(self.action)
+        if not profile or not isinstance(queryset, QuerySet):
+            return queryset
+        if profile.get('select_related'):
+            queryset = queryset.select_related(*profile['select_related'])
+        if profile.get('prefetch_related'):
+            queryset = queryset.prefetch_related(*profile['prefetch_related'])
+        return queryset
+
     def get_queryset(self):
         assert self.queryset is not None, (
             "'%s' should either include a `queryset` attribute, "
@@ -107,7 +210,7 @@ class AutoModelViewSet(viewsets.ModelViewSet):
         queryset = self.extend_filter(self.queryset)
         if isinstance(queryset, QuerySet):
             queryset = queryset.all()
-        return queryset.distinct()
+        return self.distinct_if_needed(self.eager_loading(queryset))
 
     def create(self, request, *args, **kwargs):
         try:
@@ -122,7 +225,7 @@ class AutoModelViewSet(viewsets.ModelViewSet):
             self.perform_create(serializer)
         except BaseException as e:
             return ops_response({}, code=50000, message=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        return ops_response(serializer.data)
+        return ops_response(self.serialize(serializer))
 
     def list(self, request, pk=None, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
@@ -131,12 +234,56 @@ class AutoModelViewSet(viewsets.ModelViewSet):
         if not page_size:
             page_size = api_settings.PAGE_SIZE
         pagination.PageNumberPagination.page_size = page_size
-        page = self.paginate_queryset(queryset)
-        if not get_all and page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+        if get_all:
+            stream = request.query_params.get('stream', None)
+            if stream in self.stream_content_types and isinstance(queryset, QuerySet):
+                return self.stream_list(queryset, stream)
+        else:
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(self.serialize(serializer))
         serializer = self.get_serializer(queryset, many=True)
-        return ops_response({'list': serializer.data, 'total': queryset.count()})
+        data = self.serialize(serializer)
+        return ops_response({'list': data, 'total': len(data)})
+
+    def iter_serialized(self, queryset):
+        """
+        分批迭代queryset并序列化， 内存占用只与 stream_chunk_size 有关
+        """
+        chunk = []
+        for obj in queryset.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= self.stream_chunk_size:
+                yield from self.get_serializer(chunk, many=True).data
+                chunk = []
+        if chunk:
+            yield from self.get_serializer(chunk, many=True).data
+
+    def stream_list(self, queryset, stream):
+        """
+        流式导出全部数据
+
+        stream=ndjson: 每行一条JSON数据
+        stream=json: 与 get_all 相同的响应结构， 增量编码输出
+        """
+        def dumps(item):
+            return json.dumps(item, cls=encoders.JSONEncoder, ensure_ascii=False)
+
+        def ndjson():
+            for item in self.iter_serialized(queryset):
+                yield dumps(item) + '\n'
+
+        def json_list():
+            total = 0
+            yield '{"data": {"list": ['
+            for item in self.iter_serialized(queryset):
+                yield (',' if total else '') + dumps(item)
+                total += 1
+            yield '], "total": %d}, "code": 20000, "message": null}' % total
+
+        content = ndjson() if stream == 'ndjson' else json_list()
+        return StreamingHttpResponse(content, content_type=self.stream_content_types[stream])
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -157,12 +304,12 @@ class AutoModelViewSet(viewsets.ModelViewSet):
 
         if getattr(instance, '_prefetched_objects_cache', None):
             instance._prefetched_objects_cache = {}
-        return ops_response(serializer.data)
+        return ops_response(self.serialize(serializer))
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
-        return ops_response(serializer.data)
+        return ops_response(self.serialize(serializer))
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -176,6 +323,257 @@ class AutoModelViewSet(viewsets.ModelViewSet):
             return ops_response({}, code=50000, message=f'删除异常： {str(e)}')
         return ops_response('删除成功')
 
+    def check_bulk_data(self, data):
+        """
+        检查批量提交的数据
+
+        :return: 错误信息， 检查通过返回None
+        """
+        if not isinstance(data, list) or not data:
+            return '请提交数据列表.'
+        if len(data) > self.bulk_max_size:
+            return f'单次最多提交{self.bulk_max_size}条数据.'
+        return None
+
+    @staticmethod
+    def bulk_validate(serializers):
+        """
+        逐条校验
+
+        :return: 与提交数据一一对应的错误列表， 全部通过返回None
+        """
+        errors = [{} if i is not None and i.is_valid() else getattr(i, 'errors', None) or {'id': ['数据不存在.']}
+                  for i in serializers]
+        return errors if any(errors) else None
+
+    def validate_bulk_create(self, serializers):
+        """
+        批量创建的整批校验(如批次内及与已有数据的唯一性)， 在逐条校验通过后执行
+
+        :return: 与提交数据一一对应的错误列表， 全部通过返回None
+        """
+        return None
+
+    @staticmethod
+    def has_save_receivers(model):
+        """
+        模型或其多对多关系是否注册了信号(如权限、菜单缓存失效)， 批量写入不会发送信号
+        """
+        return pre_save.has_listeners(model) or post_save.has_listeners(model) or \
+            any(m2m_changed.has_listeners(i.remote_field.through) for i in model._meta.many_to_many)
+
+    @classmethod
+    def can_bulk_save(cls, serializer, method):
+        """
+        序列化器未重写 create/update、模型未重写 save 且未注册保存信号时才可批量写入， 否则需逐条保存
+        """
+        return isinstance(serializer, ModelSerializer) and \
+            getattr(type(serializer), method) is getattr(ModelSerializer, method) and \
+            serializer.Meta.model.save is Model.save and not cls.has_save_receivers(serializer.Meta.model)
+
+    def bulk_save(self, serializers, **kwargs):
+        """
+        批量写入， 新增使用 bulk_create， 更新使用 bulk_update， 多对多关系按字段批量写入
+
+        :param serializers: 已校验的序列化器， 同一批次全部为新增或全部为更新
+        :param kwargs: 额外字段， 同 serializer.save(**kwargs)
+        :return: 实例列表
+        """
+        model = self.queryset.model
+        is_update = serializers[0].instance is not None
+        many_to_many = {i.name for i in model._meta.many_to_many}
+        instances, relations, update_fields = [], [], set()
+        for serializer in serializers:
+            attrs = {**serializer.validated_data, **kwargs}
+            if hasattr(serializer, 'perform_extend_save'):
+                attrs = serializer.perform_extend_save(attrs)
+            relations.append({k: attrs.pop(k)
+                             for k in list(attrs) if k in many_to_many})
+            instance = serializer.instance or model()
+            for k, v in attrs.items():
+                setattr(instance, k, v)
+            update_fields.update(attrs)
+            instances.append(instance)
+
+        if not is_update:
+            if connections[router.db_for_write(model)].features.can_return_rows_from_bulk_insert:
+                model._default_manager.bulk_create(
+                    instances, batch_size=self.bulk_batch_size)
+            else:
+                # 数据库不支持批量写入后返回主键(如MySQL)， 逐条写入
+                for instance in instances:
+                    instance.save(force_insert=True)
+        else:
+            for field in model._meta.concrete_fields:
+                if getattr(field, 'auto_now', False):
+                    # bulk_update 不会自动更新 auto_now 字段
+                    for instance in instances:
+                        field.pre_save(instance, add=False)
+                    update_fields.add(field.name)
+            if update_fields:
+                model._default_manager.bulk_update(
+                    instances, list(update_fields), batch_size=self.bulk_batch_size)
+
+        for name in {k for i in relations for k in i}:
+            field = model._meta.get_field(name)
+            through = field.remote_field.through
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            changed = [(instance, relation[name]) for instance, relation in zip(
+                instances, relations) if name in relation]
+            if is_update:
+                through._default_manager.filter(
+                    **{f'{source}__in': [i[0] for i in changed]}).delete()
+            through._default_manager.bulk_create([through(**{source: instance, target: value}) for instance, values in changed
+                                                 for value in values], batch_size=self.bulk_batch_size, ignore_conflicts=True)
+
+        for serializer, instance in zip(serializers, instances):
+            serializer.instance = instance
+        return instances
+
+    def perform_bulk_create(self, serializers):
+        if self.can_bulk_save(serializers[0], 'create'):
+            return self.bulk_save(serializers)
+        for serializer in serializers:
+            self.perform_create(serializer)
+        return [i.instance for i in serializers]
+
+    def perform_bulk_update(self, serializers):
+        if self.can_bulk_save(serializers[0], 'update'):
+            return self.bulk_save(serializers)
+        for serializer in serializers:
+            self.perform_update(serializer)
+        return [i.instance for i in serializers]
+
+    def perform_bulk_destroy(self, instances):
+        if type(self).perform_destroy is not viewsets.ModelViewSet.perform_destroy:
+            # 视图自定义了删除逻辑(如禁用用户)， 逐条处理
+            for instance in instances:
+                self.perform_destroy(instance)
+            return
+        self.queryset.model._default_manager.filter(
+            pk__in=[i.pk for i in instances]).delete()
+
+    def bulk_write(self, func, serializers):
+        """
+        在同一事务中执行批量写入
+        """
+        try:
+            with transaction.atomic():
+                instances = func(serializers)
+        except IntegrityError as e:
+            return ops_response([], code=40000, message=f'数据冲突: {e}', status=status.HTTP_400_BAD_REQUEST)
+        except BaseException as e:
+            logger.exception(f'批量写入数据发生错误 {e}, {e.__class__}')
+            return ops_response([], code=50000, message=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return ops_response(self.get_serializer(instances, many=True).data)
+
+    @staticmethod
+    def normalize_name(item):
+        if isinstance(item, dict) and isinstance(item.get('name', None), str):
+            item['name'] = item['name'].strip(' ').replace(' ', '-')
+        return item
+
+    def prepare_bulk_create_item(self, item):
+        """
+        批量创建前处理单条数据， 对应 create 中对 request.data 的处理
+        """
+        return self.normalize_name(item)
+
+    @action(methods=['POST'], url_path='bulk', detail=False)
+    def bulk_create(self, request, *args, **kwargs):
+        """
+        批量创建， 整批数据在同一事务中写入， 权限只校验一次
+
+        ### 传递参数:
+            [{...}, {...}]  每条数据格式同创建接口
+
+        ### 返回:
+            校验失败时 data 为与提交数据一一对应的错误列表， 校验通过的数据为 {}
+        """
+        message = self.check_bulk_data(request.data)
+        if message:
+            return ops_response([], code=40000, message=message, status=status.HTTP_400_BAD_REQUEST)
+        serializers = [self.get_serializer(
+            data=self.prepare_bulk_create_item(item)) for item in request.data]
+        errors = self.bulk_validate(
+            serializers) or self.validate_bulk_create(serializers)
+        if errors:
+            return ops_response(errors, code=40000, message='数据校验失败.', status=status.HTTP_400_BAD_REQUEST)
+        return self.bulk_write(self.perform_bulk_create, serializers)
+
+    def get_bulk_instances(self, ids):
+        """
+        批量获取数据
+
+        :return: {str(id): instance}
+        """
+        try:
+            return {str(k): v for k, v in self.get_queryset().in_bulk(ids).items()}
+        except (TypeError, ValueError):
+            # 存在非法id
+            return {str(k): v for k, v in self.get_queryset().in_bulk(
+                [i for i in ids if str(i).isdigit()]).items()}
+
+    @bulk_create.mapping.put
+    def bulk_update(self, request, *args, **kwargs):
+        """
+        批量更新
+
+        ### 传递参数:
+            [{"id": 1, ...}, {"id": 2, ...}]  每条数据须包含id， PATCH 为部分更新
+        """
+        partial = kwargs.pop('partial', False)
+        message = self.check_bulk_data(request.data)
+        if message:
+            return ops_response([], code=40000, message=message, status=status.HTTP_400_BAD_REQUEST)
+        ids = [str(item.get('id', '')) if isinstance(
+            item, dict) else '' for item in request.data]
+        instances = self.get_bulk_instances([i for i in ids if i])
+        serializers, seen = [], set()
+        for _id, item in zip(ids, request.data):
+            # 不存在或重复提交的数据
+            instance = instances.get(_id) if _id not in seen else None
+            seen.add(_id)
+            serializers.append(instance and self.get_serializer(
+                instance, data=self.normalize_name(item), partial=partial))
+        errors = self.bulk_validate(serializers)
+        if errors:
+            return ops_response(errors, code=40000, message='数据校验失败.', status=status.HTTP_400_BAD_REQUEST)
+        return self.bulk_write(self.perform_bulk_update, serializers)
+
+    @bulk_create.mapping.patch
+    def bulk_partial_update(self, request, *args, **kwargs):
+        kwargs['partial'] = True
+        return self.bulk_update(request, *args, **kwargs)
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request, *args, **kwargs):
+        """
+        批量删除
+
+        ### 传递参数:
+            ids: 待删除数据id数组
+        """
+        ids = request.data.get('ids', None) if isinstance(
+            request.data, dict) else request.data
+        message = self.check_bulk_data(ids)
+        if message:
+            return ops_response([], code=40000, message=message, status=status.HTTP_400_BAD_REQUEST)
+        instances = self.get_bulk_instances(ids)
+        errors = [{} if str(i) in instances else {'id': ['数据不存在.']} for i in ids]
+        if any(errors):
+            return ops_response(errors, code=40000, message='数据校验失败.', status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                self.perform_bulk_destroy(list(instances.values()))
+        except ProtectedError:
+            # 存在关联数据，不可删除
+            return ops_response({}, code=40300, message='存在关联数据，禁止删除！')
+        except BaseException as e:
+            logger.exception(f'批量删除数据发生错误 {e}, {e.__class__}')
+            return ops_response({}, code=50000, message=f'删除异常： {str(e)}')
+        return ops_response('删除成功')
+
     @action(methods=['GET'], url_path='columns', detail=False)
     def model_columns(self, request):
         """
@@ -183,7 +581,7 @@ class AutoModelViewSet(viewsets.ModelViewSet):
         """
         columns = [i for i in self.queryset.model._meta.fields if i.name not in [
             'created_time', 'update_time']]
-        data = [{'id': i.name, 'title': i.verbose_name, 'dataIndex': i.name, 'type': self.queryset.model._meta.get_field(i.name).get_internal_type(), 'width': self.column_width.get(i.name, None),  'required': not i.null, 'default': None if i.default == fields.NOT_PROVIDED else i.default}
+        data = [{'id': i.name, 'title': i.verbose_name, 'dataIndex': i.name, 'type': self.queryset.model._meta.get_field(i.name).get_internal_type(), 'width': self.column_width.get(i.name, None),  'required': not i.null, 'default': None if i.default == fields.NOT_PROVIDED else (i.default() if callable(i.default) else i.default)}
                 for i in columns]
         if hasattr(self, 'include_columns'):
             data = [i for i in data if i['id'] in self.include_columns]
@@ -195,6 +593,28 @@ class AutoModelViewSet(viewsets.ModelViewSet):
 
 
 class AutoModelParentViewSet(AutoModelViewSet):
+    """
+    树形数据视图， list/retrieve 一次加载整棵树
+
+    可通过 类属性 tree_max_depth 或 请求参数 depth 限制展开层级
+    """
+    tree_actions = ('list', 'retrieve')
+    tree_max_depth = None
+
+    def get_tree_max_depth(self):
+        try:
+            return int(self.request.query_params['depth'])
+        except (KeyError, ValueError):
+            return self.tree_max_depth
+
+    def get_serializer(self, *args, **kwargs):
+        if args and self.action in self.tree_actions:
+            instance = args[0]
+            many = kwargs.get('many', False)
+            nodes = prefetch_tree(
+                instance if many else [instance], max_depth=self.get_tree_max_depth())
+            args = (nodes if many else nodes[0], ) + args[1:]
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
         assert self.queryset is not None, (
@@ -208,4 +628,4 @@ class AutoModelParentViewSet(AutoModelViewSet):
                 queryset = queryset.filter(parent__isnull=True)
         if isinstance(queryset, QuerySet):
             queryset = queryset.all()
-        return queryset.distinct()
+        return self.distinct_if_needed(self.eager_loading(queryset))
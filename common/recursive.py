@@ -2,6 +2,7 @@
 
 import inspect
 import importlib
+from collections import defaultdict
 from rest_framework.fields import Field
 from rest_framework.serializers import BaseSerializer
 
@@ -127,3 +128,47 @@ class RecursiveField(Field):
                 pass
 
         return object.__getattribute__(self, name)
+
+
+def prefetch_tree(instances, max_depth=None, queryset=None, related_name='children'):
+    """
+    一次查询加载整棵树(CommonParent)， 在内存中按 parent_id 组装子节点，
+    并写入 prefetch 缓存， 使 RecursiveField 序列化 children 时不再逐节点查询
+
+    :param instances: 根节点列表
+    :param max_depth: 最大展开层级， None表示不限制， 超出层级的节点 children 为空
+    :param queryset: 节点数据集， 默认为模型全部数据
+    :param related_name: 子节点反向关联名
+    :return: instances
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+    if queryset is None:
+        queryset = instances[0].__class__._default_manager.all()
+    children_map = defaultdict(list)
+    for node in queryset:
+        children_map[node.parent_id].append(node)
+
+    visited = set()
+    level, depth = instances, 0
+    while level:
+        depth += 1
+        next_level = []
+        for node in level:
+            if id(node) in visited:
+                # 同一节点已处理(或存在环)
+                continue
+            visited.add(id(node))
+            children = []
+            if max_depth is None or depth <= max_depth:
+                children = children_map.get(node.pk, [])
+                next_level.extend(children)
+            qs = getattr(node, related_name).all()
+            qs._result_cache = children
+            qs._prefetch_done = True
+            if not hasattr(node, '_prefetched_objects_cache'):
+                node._prefetched_objects_cache = {}
+            node._prefetched_objects_cache[related_name] = qs
+        level = next_level
+    return instances
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@author  :   Charles Lai
+@file    :   testing.py
+@time    :   2026/10/17 23:20
+@contact :   qqing_lai@hotmail.com
+'''
+
+# here put the import lib
+from django.core.management import call_command
+from django.db import connection, models, transaction
+from rest_framework.test import APIClient
+
+from common.extends.viewsets import AutoModelViewSet
+
+# 查询预算检查的action及对应的请求方法
+BUDGET_ACTIONS = {'list': 'get', 'retrieve': 'get', 'create': 'post', 'update': 'put'}
+
+
+def get_routes(routers):
+    """
+    遍历路由注册的视图
+
+    :param routers: [(router, URL前缀)]
+    :return: [(url模板, viewset, {请求方法: action}, 是否详情路由)]， 详情路由url模板中的主键为 {lookup}
+    """
+    routes = []
+    for router, base in routers:
+        for prefix, viewset, basename in router.registry:
+            for route in router.get_routes(viewset):
+                # 动态路由的 mapping 为 MethodMapper， 其 get 方法用于注册请求方法
+                mapping = {method: action for method, action in dict.items(route.mapping)
+                           if hasattr(viewset, action)}
+                if not mapping:
+                    continue
+                url = route.url.lstrip('^').rstrip('$').format(
+                    prefix=prefix, lookup='{lookup}', trailing_slash='/')
+                routes.append((f'{base}{url}', viewset, mapping, route.detail))
+    return routes
+
+
+class QueryBudgetTestMixin(object):
+    """
+    视图查询次数预算检查
+
+    遍历 routers 中注册的 AutoModelViewSet， 在两种数据量下请求 list/retrieve/create/update，
+    查询次数不能超过视图类属性 query_budget 声明的值， 且不能随数据量增长， 用于发现序列化器等引入的N+1查询
+
+    以超级管理员身份请求(force_authenticate)， 不包含认证及RBAC权限的查询
+    """
+    # [(router, URL前缀)]
+    routers = ()
+    # 两次生成的数据量， gen_cmdb_data 参数
+    data_sizes = (
+        {'regions': 1, 'idcs': 1, 'products': 1, 'projects': 1, 'apps': 2, 'environments': 1, 'clusters': 1,
+         'deploys': 1, 'users': 3, 'orgs': 2, 'roles': 1, 'menus': 5, 'members': 1},
+        {'regions': 3, 'idcs': 2, 'products': 3, 'projects': 3, 'apps': 5, 'environments': 3, 'clusters': 3,
+         'deploys': 2, 'users': 30, 'orgs': 10, 'roles': 5, 'menus': 15, 'members': 3},
+    )
+    # 列表分页大小， 需大于生成的数据量， 保证数据量增长时单页数据也随之增长
+    page_size = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        from ucenter.models import UserProfile
+
+        cls.user = UserProfile.objects.create(
+            username='query-budget', is_superuser=True)
+
+    def setUp(self):
+        super().setUp()
+        # 接口异常时返回500， 由断言输出异常接口
+        self.client = APIClient(raise_request_exception=False)
+        self.client.force_authenticate(self.user)
+
+    def get_viewsets(self):
+        """
+        :return: {viewset: {action: (请求方法, url模板)}}
+        """
+        viewsets = {}
+        for url, viewset, mapping, detail in get_routes(self.routers):
+            if not issubclass(viewset, AutoModelViewSet):
+                continue
+            for method, action in mapping.items():
+                if BUDGET_ACTIONS.get(action) == method:
+                    viewsets.setdefault(viewset, {})[action] = (method, url)
+        return viewsets
+
+    def get_instance(self, viewset):
+        return viewset.queryset.order_by('-pk').first()
+
+    def get_payload(self, viewset, action, instance):
+        """
+        生成 create/update 请求数据， 默认使用写入序列化器序列化现有数据， 新增时唯一字段及名称(常用于生成唯一标识)追加后缀
+
+        视图数据无法通用生成时， 在测试类中定义 get_{视图类名}_payload(action, instance) 方法
+        """
+        custom = getattr(self, f'get_{viewset.__name__}_payload', None)
+        if custom is not None:
+            return custom(action, instance)
+        return self.get_default_payload(viewset, action, instance)
+
+    def get_default_payload(self, viewset, action, instance):
+        serializer_class = viewset._action_serializer_classes.get(action) or viewset.serializer_class
+        serializer = serializer_class(instance)
+        data = {}
+        for name, field in serializer.fields.items():
+            if field.read_only or name not in serializer.data:
+                continue
+            model_field = next((i for i in instance._meta.fields if i.name == name), None)
+            if isinstance(model_field, models.FileField):
+                continue
+            data[name] = serializer.data[name]
+        if action == 'create':
+            meta = instance._meta
+            unique = {i.name for i in meta.fields if i.unique} | {'name'}
+            unique.update(name for i in meta.constraints if isinstance(i, models.UniqueConstraint) for name in i.fields)
+            unique.update(name for i in meta.unique_together for name in i)
+            for name in unique:
+                if isinstance(data.get(name), str):
+                    data[name] = f'{data[name]}-c{self.counter}'
+        return data
+
+    def request(self, action, method, url, instance):
+        if instance is not None:
+            url = url.format(lookup=instance.pk)
+        data = self.get_payload(self.viewset, action, instance) if method in ('post', 'put') else {
+            'page_size': self.page_size}
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        # 每个请求使用独立的保存点， 避免请求内数据库异常影响后续请求
+        with transaction.atomic(), connection.execute_wrapper(count_queries):
+            response = getattr(self.client, method)(url, data, format='json' if method != 'get' else None)
+        return response, queries
+
+    def check_query_budget(self, size):
+        """
+        :return: {(视图类名, action): (查询次数, SQL)}
+        """
+        counts = {}
+        for viewset, actions in self.get_viewsets().items():
+            self.viewset = viewset
+            budget = getattr(viewset, 'query_budget', None) or {}
+            for action, (method, url) in actions.items():
+                with self.subTest(view=viewset.__name__, action=action, size=size):
+                    self.assertIn(action, budget, f'{viewset.__name__} 未声明 {action} 查询预算(query_budget)')
+                    self.counter += 1
+                    instance = self.get_instance(viewset)
+                    self.assertIsNotNone(instance, f'{viewset.__name__} 无测试数据')
+                    response, queries = self.request(
+                        action, method, url, instance if action in ('retrieve', 'update', 'create') else None)
+                    self.assertEqual(response.status_code, 200, response.content[:500])
+                    self.assertEqual(response.json().get('code'), 20000, response.content[:500])
+                    counts[(viewset.__name__, action)] = (len(queries), queries)
+                    self.assertLessEqual(len(queries), budget[action], '\n'.join(
+                        [f'{viewset.__name__}.{action} 查询次数 {len(queries)} 超出预算 {budget[action]}:'] + queries))
+        return counts
+
+    def test_query_budget(self):
+        self.counter = 0
+        baseline = None
+        for size, options in enumerate(self.data_sizes):
+            call_command('gen_cmdb_data', verbosity=0, prefix=f'qb{size}', **options)
+            counts = self.check_query_budget(size)
+            if baseline is None:
+                baseline = counts
+                continue
+            for (view, action), (count, queries) in counts.items():
+                if (view, action) not in baseline:
+                    continue
+                with self.subTest(view=view, action=action, size=size):
+                    self.assertEqual(count, baseline[(view, action)][0], '\n'.join(
+                        [f'{view}.{action} 查询次数随数据量增长 {baseline[(view, action)][0]} -> {count}:'] + queries))
@@ -0,0 +1,65 @@
+# 配置文件
+
+# 用户认证方式
+USER_AUTH_BACKEND = 'feishu'
+
+PLATFORM_CONFIG = {
+    'timeout': {'access': 360, 'refresh': 3600},
+    # 登录: 失败次数上限、锁定时间(秒)、最后登录时间批量写入间隔(秒, 0为同步写入)
+    'login': {'max_failures': 5, 'lock_timeout': 300, 'last_login_flush': 10},
+    # 请求性能统计: 返回 Server-Timing 响应头(暴露SQL数量及耗时， 仅调试环境开启)、慢请求日志阈值(毫秒, 0为关闭)、日志中输出的重复SQL数量
+    'performance': {'server_timing': False, 'slow_threshold': 1000, 'duplicate_top': 5},
+    # Prometheus 指标(/metrics): 是否开启、拉取指标的Bearer Token(必填， 为空时不开放 /metrics)
+    'metrics': {'enabled': False, 'token': ''},
+    # URL白名单， 跳过RBAC权限校验: match 匹配方式 exact/prefix/contains(默认)， methods 限定请求方法(为空不限制)
+    # 修改后需整体替换该列表才会重新编译
+    'whitelist': [
+        # {'url': '/api/user/login/', 'match': 'exact', 'methods': ['post']},
+        # {'url': '/api/public/', 'match': 'prefix'},
+    ]
+}
+
+# 数据库配置
+#   engine: mysql / postgresql / sqlite
+#   conn_max_age: 持久连接时间(秒)， conn_health_checks: 复用连接前检查连接是否可用
+#   pool: 连接池配置(需安装 django-db-connection-pool)， 如 {'POOL_SIZE': 10, 'MAX_OVERFLOW': 10, 'RECYCLE': 3600}
+#   replica: 只读从库， 未指定的配置与主库一致， 如 {'host': '10.0.0.2'}
+#   sqlite 开启 WAL: 'options': {'journal_mode': 'WAL'}， 测试库使用文件: 'test': {'NAME': '/tmp/test_ydevops.sqlite3'}
+DATABASE_CONFIG = {
+    'engine': 'sqlite',
+    'conn_max_age': 60,
+    'conn_health_checks': True,
+    'options': {'journal_mode': 'WAL'},
+    # 'engine': 'mysql',
+    # 'name': 'ydevopsdb',
+    # 'user': 'devops',
+    # 'password': 'ops123456',
+    # 'host': '127.0.0.1',
+    # 'port': 43306,
+    # 'options': {'charset': 'utf8mb4'},
+    # 'pool': {'POOL_SIZE': 10, 'MAX_OVERFLOW': 10},
+    # 'replica': {'host': '127.0.0.1', 'port': 43307},
+}
+
+# 缓存配置， 多个worker之间共享(锁、权限、菜单、token注销等)
+#   backend: redis / memcached / file(单机部署) / database(需执行 python manage.py createcachetable)
+#   location: redis://:password@127.0.0.1:6379/1 / 127.0.0.1:11211 / 缓存目录 / 缓存表名
+#   options: file/database 缓存条目上限 MAX_ENTRIES 未配置时为100000， 超出后随机淘汰
+CACHE_CONFIG = {
+    'backend': 'file',
+    'location': '/var/tmp/ydevops_cache',
+    'key_prefix': 'ydevops',
+    'version': 1,
+    'timeout': 300,
+    'options': {'MAX_ENTRIES': 100000}
+}
+
+# token时间
+TOKEN_TIME = {
+    'ACCESS': {
+        'minutes': 5
+    },
+    'REFRESH': {
+        'minutes': 30
+    }
+}
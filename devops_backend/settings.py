@@ -17,6 +17,16 @@ from pathlib import Path
 
 from config import TOKEN_TIME
 
+try:
+    from config import CACHE_CONFIG
+except ImportError:
+    CACHE_CONFIG = {}
+
+try:
+    from config import DATABASE_CONFIG
+except ImportError:
+    DATABASE_CONFIG = {}
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 sys.path.insert(0, os.path.join(BASE_DIR, 'apps'))
@@ -49,6 +59,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 请求性能统计， 放在最前以统计完整耗时
+    'common.extends.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,10 +94,87 @@ WSGI_APPLICATION = 'devops_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+DATABASE_ENGINES = {
+    'mysql': 'django.db.backends.mysql',
+    'postgresql': 'django.db.backends.postgresql',
+    # 支持 OPTIONS.journal_mode 设置 WAL 模式
+    'sqlite': 'common.backends.sqlite3',
+}
+# 连接池， 依赖 django-db-connection-pool
+DATABASE_POOL_ENGINES = {
+    'mysql': 'dj_db_conn_pool.backends.mysql',
+    'postgresql': 'dj_db_conn_pool.backends.postgresql',
+}
+
+
+def get_database(config):
+    """
+    根据 config.py 中的 DATABASE_CONFIG 生成数据库配置
+    """
+    engine = config.get('engine', 'sqlite')
+    pool = config.get('pool', None) if engine in DATABASE_POOL_ENGINES else None
+    database = {
+        'ENGINE': DATABASE_POOL_ENGINES[engine] if pool else DATABASE_ENGINES[engine],
+        'NAME': config.get('name', BASE_DIR / 'db.sqlite3'),
+        'USER': config.get('user', ''),
+        'PASSWORD': config.get('password', ''),
+        'HOST': config.get('host', ''),
+        'PORT': config.get('port', ''),
+        # 持久连接， 连接池模式下由连接池管理连接
+        'CONN_MAX_AGE': 0 if pool else config.get('conn_max_age', 60),
+        'CONN_HEALTH_CHECKS': config.get('conn_health_checks', True),
+        'OPTIONS': config.get('options', {}),
+        'TEST': config.get('test', {}),
+    }
+    if pool:
+        database['POOL_OPTIONS'] = pool
+    return database
+
+
 DATABASES = {
+    'default': get_database(DATABASE_CONFIG)
+}
+if DATABASE_CONFIG.get('replica', None):
+    # 只读从库， 未指定的配置与主库一致
+    DATABASES['replica'] = get_database(
+        {**DATABASE_CONFIG, 'test': {'MIRROR': 'default'}, **DATABASE_CONFIG['replica']})
+DATABASE_ROUTERS = ['common.extends.db.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHE_BACKENDS = {
+    # 共享缓存
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+    # 单机部署， 同一主机的多个worker共享
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', '/var/tmp/ydevops_cache'),
+    'database': ('django.core.cache.backends.db.DatabaseCache', 'django_cache'),
+    # 进程内缓存， 仅用于单元测试/单进程调试
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'ydevops'),
+}
+# 单元测试/基准测试使用进程内缓存， 避免与运行中的服务共享缓存数据
+TESTING = sys.argv[1:2] == ['test'] or bool(os.environ.get('DJANGO_TESTING'))
+_cache_backend = 'locmem' if TESTING else CACHE_CONFIG.get('backend', 'file')
+_cache_location = CACHE_BACKENDS[_cache_backend][1] if TESTING else CACHE_CONFIG.get(
+    'location', CACHE_BACKENDS[_cache_backend][1])
+
+# 本地缓存(file/database/locmem)默认最多300条， 超出后随机淘汰， 会淘汰版本号、Token吊销等无过期时间的key
+CACHE_MAX_ENTRIES = 100000
+_cache_options = {} if TESTING else dict(CACHE_CONFIG.get('options', {}))
+if _cache_backend in ('file', 'database', 'locmem'):
+    _cache_options.setdefault('MAX_ENTRIES', CACHE_MAX_ENTRIES)
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[_cache_backend][0],
+        'LOCATION': _cache_location,
+        'TIMEOUT': CACHE_CONFIG.get('timeout', 300),
+        # key格式: 前缀:版本:key， 多个环境共用缓存时通过前缀隔离， 升级不兼容的缓存数据时递增版本
+        'KEY_PREFIX': CACHE_CONFIG.get('key_prefix', 'ydevops'),
+        'VERSION': CACHE_CONFIG.get('version', 1),
+        'OPTIONS': _cache_options,
     }
 }
 
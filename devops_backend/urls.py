@@ -23,6 +23,7 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from common.extends.metrics import metrics_view
 from ucenter.views import MenuViewSet, RoleViewSet, UserAuthTokenRefreshView, UserAuthTokenView, UserLogout, UserProfileViewSet, UserViewSet
 
 schema_view = get_schema_view(
@@ -57,6 +58,7 @@ urlpatterns = [
     path('api/user/refresh/', UserAuthTokenRefreshView.as_view(),
          name='token-refresh'),
     path('api/', include(cmdb_urls)),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # from devops_backend.settings import DEBUG